@@ -6,6 +6,9 @@
 import os
 import shutil
 import json
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from sources.common.common import logger, processControl, log_
 from sources.common.paramsManager import getConfigs
@@ -13,37 +16,137 @@ from sources.static_analyzer import static_analyzer
 from sources.views.appsec import appsec_dashboard
 from sources.mongoManager import storeBoard
 from sources.common.utils import clear_directory
+from sources.scan_cache import invalidate_result
+from sources.tpl_index import build_tpl_index
+from sources.common.ingest import ingest_file
+
+
+def processApk(directory, filename):
+    """
+    @Desc: Runs the static analysis of one APK and stores its ScoreBoard.
+    @Result: Returns the checksum of the analyzed APK or None if the analysis failed.
+    """
+    processControl.data['process'] = {}
+    processControl.data['process']['filename'] = filename
+    processControl.data['process']['filePath'] = os.path.join(directory, filename)
+    checksum = static_analyzer(filename)
+
+    request = {}
+    if not processControl.args.result and processControl.args.proc != "TRIAGE":
+        context = appsec_dashboard(request, checksum, api=False)
+        if context:
+            jsonResultsPath = os.path.join(processControl.args.result, f"scoreBoard_{filename}.json")
+            with open(jsonResultsPath, "w", encoding="utf-8") as f:
+                json.dump(context, f, indent=4)
+
+            log_("info", logger, f"Archivo JSON ScoreBoard guardado en: {jsonResultsPath}")
+        else:
+              #dado que no se actualiza Mongo, esto hay que cambiarlo
+            result = storeBoard(context)
+    return checksum
+
+
+def initBatchWorker(env, settings, args):
+    """
+    @Desc: Initializes the process control of a batch worker with the parent configuration.
+    @Usage: Used as initializer of the process pool, so it works with any start method.
+    """
+    processControl.env = env
+    processControl.settings = settings
+    processControl.args = args
+    processControl.data = {}
+
+
+def batchWorker(directory, filename):
+    """
+    @Desc: Analyzes one APK inside its own workspace, with private input and output directories.
+    @Result: Returns a tuple (filename, checksum); checksum is None if the analysis failed.
+    """
+    checksum = None
+    workspace = tempfile.mkdtemp(prefix="apk_", dir=processControl.env['workspacePath'])
+    try:
+        processControl.env['inputPath'] = os.path.join(workspace, "input")
+        processControl.env['outputPath'] = os.path.join(workspace, "output")
+        os.makedirs(processControl.env['inputPath'])
+        os.makedirs(processControl.env['outputPath'])
+        # The APK is linked (or copied) into the workspace, the original is
+        # kept in the input directory until the analysis succeeds
+        source = os.path.join(directory, filename)
+        target = os.path.join(processControl.env['inputPath'], filename)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+        checksum = processApk(processControl.env['inputPath'], filename)
+        if checksum:
+            os.remove(source)
+        else:
+            log_("error", logger, f"Analysis of {filename} failed, the APK is kept in {directory}")
+    except Exception as e:
+        log_("exception", logger, e)
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+    return filename, checksum
+
+
+def batchProcess(directory, workers):
+    """
+    @Desc: Analyzes every APK of the input directory in a pool of worker processes.
+    @Result: Logs the aggregate throughput in APKs/hour.
+    """
+    os.makedirs(processControl.env['workspacePath'], exist_ok=True)
+    filenames = os.listdir(directory)
+    log_("info", logger, f"Batch mode: {len(filenames)} APKs with {workers} workers")
+
+    start = time.time()
+    analyzed = 0
+    failed = 0
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=initBatchWorker,
+            initargs=(processControl.env, processControl.settings, processControl.args)) as executor:
+        futures = [executor.submit(batchWorker, directory, filename) for filename in filenames]
+        for future in as_completed(futures):
+            filename, checksum = future.result()
+            if checksum:
+                analyzed += 1
+            else:
+                failed += 1
+            elapsed = time.time() - start
+            log_("info", logger, f"Batch progress: {analyzed + failed}/{len(filenames)} ({filename}) - "
+                                 f"{(analyzed + failed) * 3600 / elapsed:.1f} APKs/hour")
+
+    elapsed = time.time() - start
+    throughput = analyzed * 3600 / elapsed if elapsed else 0
+    log_("info", logger, f"Batch completed: {analyzed} analyzed, {failed} failed in {elapsed:.1f}s - "
+                         f"{throughput:.1f} APKs/hour")
 
 
 def mainProcess():
     try:
 
+        if processControl.args.tpl_index:
+            build_tpl_index()
+            return True
+
+        if processControl.args.invalidate:
+            checksum = processControl.args.invalidate
+            invalidate_result(None if checksum == "all" else checksum)
+            return True
+
         if processControl.args.source:
             src = processControl.args.source
             dst = processControl.env['inputPath']
-            shutil.copy(src, dst)
+            ingest_file(src, dst)
 
         directory = processControl.env['inputPath']
+        if processControl.args.workers > 1:
+            batchProcess(directory, processControl.args.workers)
+            return True
+
         for filename in os.listdir(directory):
             clear_directory(processControl.env['outputPath'])
-
-            processControl.data['process'] = {}
-            processControl.data['process']['filename'] = filename
-            processControl.data['process']['filePath'] = os.path.join(directory, filename)
-            checksum = static_analyzer(filename)
-
-            request = {}
-            if not processControl.args.result:
-                context = appsec_dashboard(request, checksum, api=False)
-                if context:
-                    jsonResultsPath = os.path.join(processControl.args.result, f"scoreBoard_{filename}.json")
-                    with open(jsonResultsPath, "w", encoding="utf-8") as f:
-                        json.dump(context, f, indent=4)
-
-                    log_("info", logger, f"Archivo JSON ScoreBoard guardado en: {jsonResultsPath}")
-                else:
-                      #dado que no se actualiza Mongo, esto hay que cambiarlo
-                    result = storeBoard(context)
+            processApk(directory, filename)
 
     except Exception as e:
         log_("exception", logger, e)
@@ -16,12 +16,17 @@ logger = logging.getLogger(__name__)
 """
 
 
+def get_rules_path():
+    """Return the path of the behaviour rules."""
+    #root = Path(settings.BASE_DIR) / 'MalwareAnalyzer' / 'views'
+    #rules = root / 'android' / 'rules' / 'behaviour_rules.yaml'
+    return os.path.join(processControl.env['realPath'], 'sources/MalwareAnalyzer/behaviour_rules.yaml')
+
+
 def analyze(checksum, sast, data):
     """Perform behaviour analysis."""
     try:
-        #root = Path(settings.BASE_DIR) / 'MalwareAnalyzer' / 'views'
-        #rules = root / 'android' / 'rules' / 'behaviour_rules.yaml'
-        rules = os.path.join(processControl.env['realPath'], 'sources/MalwareAnalyzer/behaviour_rules.yaml')
+        rules = get_rules_path()
         msg = 'Android Behaviour Analysis Started'
         #logger.info(msg)
         #append_scan_status(checksum, msg)
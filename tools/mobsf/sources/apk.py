@@ -1,9 +1,11 @@
 # -*- coding: utf_8 -*-
 """Android APK and Source Analysis."""
 from sources.common.common import logger, processControl, log_
-from sources.common.utils import file_size, hash_gen, unzip
+from sources.common.utils import file_size, unzip
+from sources.common.ingest import file_digests, ingest_file
 
 from sources.app import androguard_parse, aapt_parse, get_apk_name
+from sources.axml_decode import decode_res_xml
 from sources.cert_analysis import cert_info, get_hardcoded_cert_keystore
 from sources.manifest_analysis import (
     manifest_analysis,
@@ -29,6 +31,9 @@ from sources.converter import (
     dex_2_smali,
 )
 from sources.code_analysis import code_analysis
+from sources.scheduler import Stage, required_files, run_stages
+from sources.perf import perf_stage
+from sources.apk_vfs import ApkFS
 from sources.strings import (
     get_strings_metadata,
 )
@@ -41,7 +46,6 @@ from sources.db_interaction import (
     #get_context_from_db_entry,
     save_get_ctx,
 )
-import shutil
 import os
 
 
@@ -151,7 +155,8 @@ def initialize_app_dic(app_dic, file_ext):
     #app_dic['app_path'] = (app_dic['app_dir'] / app_dic['app_file']).as_posix()
     #app_dic['app_dir'] = app_dic['app_dir'].as_posix() + '/'
     app_dic['app_path'] = os.path.join(processControl.env['inputPath'], app_dic['app_file'])
-    shutil.copyfile(processControl.data['process']['filePath'], app_dic['app_path'])
+    # Hardlink/reflink when possible, the digests are already known
+    ingest_file(processControl.data['process']['filePath'], app_dic['app_path'])
     processControl.data['app_dic']['app_path'] = app_dic['app_path']
     return checksum
 
@@ -173,7 +178,9 @@ def get_size_and_hashes(app_dic):
     :raises Exception: If an error occurs during file size computation or hash generation.
     """
     app_dic['size'] = str(file_size(app_dic['app_path'])) + 'MB'
-    app_dic['sha1'], app_dic['sha256'] = hash_gen(app_dic['md5'], app_dic['app_path'])
+    # Computed in the same read that placed the file, see common/ingest.py
+    digests = file_digests(app_dic['app_path'])
+    app_dic['sha1'], app_dic['sha256'] = digests['sha1'], digests['sha256']
 
     processControl.data['app_dic']['size'] = app_dic['size']
     processControl.data['app_dic']['sha1'] = app_dic['sha1']
@@ -238,6 +245,11 @@ def clean_up(app_dic):
     app_dic['androguard_apk_resources'] = None
 '''
 
+# Certificate and keystore files looked up by get_hardcoded_cert_keystore
+KEYSTORE_FILES = tuple(f'*{ext}' for ext in (
+    '.cer', '.pem', '.cert', '.crt', '.pub', '.key', '.pfx', '.p12', '.der', '.jks', '.bks'))
+
+
 def apk_analysis_task(checksum, app_dic, rescan, queue=False):
     """
     Perform a comprehensive analysis of an APK file.
@@ -264,94 +276,140 @@ def apk_analysis_task(checksum, app_dic, rescan, queue=False):
     """
     context = {}
     try:
-        get_size_and_hashes(app_dic)
-        log_("info", logger, f"Extracting APK")
+        with perf_stage('hashes'):
+            get_size_and_hashes(app_dic)
         app_dic['zipped'] = 'apk'
-        # Extract APK and get files
         processControl.data['app_dic']['zipped'] = 'apk'
-        app_dic['files'] = unzip(
-            checksum,
-            app_dic['app_path'],
-            app_dic['app_dir'])
-        processControl.data['app_dic']['files'] = app_dic['files']
-        # Extract APK data with Androguard
-        androguard_parse(app_dic)
-        aapt_parse(app_dic)
-        get_hardcoded_cert_keystore(app_dic)
-        man_data_dic, man_analysis = get_manifest_data(app_dic)
-        get_apk_name(app_dic)
-        get_app_details(app_dic, man_data_dic)
-        mal_perms = permissions.check_malware_permission(
-            checksum,
-            man_data_dic['perm'])
-        man_analysis['malware_permissions'] = mal_perms
-        #get_icon_apk(app_dic)
-        elf_dict = library_analysis(
-            checksum,
-            app_dic['app_dir'],
-            'elf')
-        cert_dic = cert_info(app_dic, man_data_dic)
-        apkid_results = apkid.apkid_analysis(
-            checksum,
-            app_dic['app_path'])
+        # Stages read the archive entries through the APK virtual filesystem,
+        # falling back to the extracted tree if the APK can't be indexed
+        try:
+            app_dic['apk_fs'] = ApkFS(app_dic['app_path'])
+        except Exception as exp:
+            log_("warning", logger, f'Failed to index the APK entries: {exp}')
+            app_dic['apk_fs'] = None
+        apk_fs = app_dic['apk_fs']
+
+        def extract(res):
+            log_("info", logger, f"Extracting APK")
+            app_dic['files'] = unzip(
+                checksum,
+                app_dic['app_path'],
+                app_dic['app_dir'],
+                patterns)
+            processControl.data['app_dic']['files'] = app_dic['files']
+
+        def app_details(res):
+            man_data_dic = res['manifest'][0]
+            get_apk_name(app_dic)
+            get_app_details(app_dic, man_data_dic)
+
+        def strings(res):
+            get_strings_metadata(
+                app_dic,
+                res['elf']['elf_strings'],
+                ['.java'],
+                res['code'],
+                res['manifest'][0]['packagename'])
+
+        def firebase(res):
+            code_an_dic = res['code']
+            # Firebase DB Check
+            code_an_dic['firebase'] = firebase_analysis(
+                checksum,
+                code_an_dic)
+            """
+            # Domain Extraction and Malware Check
+            code_an_dic['domains'] = MalwareDomainCheck().scan(
+                checksum,
+                code_an_dic['urls_list'])
+            """
+            code_an_dic['domains'] = {}
+
+        # Stages only wait for the stages whose outputs they read,
+        # see sources/scheduler.py
+        stages = [
+            Stage('unzip', extract),
+            # Extract APK data with Androguard
+            Stage('androguard', lambda res: androguard_parse(app_dic)),
+            # aapt only fills app_dic['files'] when unzip did not
+            Stage('aapt', lambda res: aapt_parse(app_dic), ('unzip',)),
+            Stage('keystore', lambda res: get_hardcoded_cert_keystore(app_dic),
+                  ('unzip', 'androguard', 'aapt'), () if apk_fs else KEYSTORE_FILES),
+            # res/xml and the XML icons decoded from the archive, without apktool
+            Stage('axml', lambda res: decode_res_xml(app_dic), ('androguard',)),
+            Stage('manifest', lambda res: get_manifest_data(app_dic),
+                  ('androguard', 'aapt', 'axml'), ('AndroidManifest.xml', 'res/xml/*')),
+            Stage('details', app_details, ('manifest',)),
+            Stage('malware_perms', lambda res: permissions.check_malware_permission(
+                checksum,
+                res['manifest'][0]['perm']), ('manifest',)),
+            #get_icon_apk(app_dic)
+            Stage('elf', lambda res: library_analysis(
+                checksum,
+                app_dic['app_dir'],
+                'elf',
+                apk_fs), () if apk_fs else ('unzip',), () if apk_fs else ('*.so',)),
+            Stage('cert', lambda res: cert_info(app_dic, res['manifest'][0]),
+                  ('unzip', 'androguard', 'manifest'), ('META-INF/*',)),
+            Stage('apkid', lambda res: apkid.apkid_analysis(
+                checksum,
+                app_dic['app_path'])),
+            Stage('java', lambda res: apk_2_java(
+                checksum,
+                app_dic['app_path'],
+                app_dic['app_dir'],
+                #settings.DOWNLOADED_TOOLS_DIR
+                None)),
+            Stage('smali', lambda res: dex_2_smali(
+                checksum,
+                app_dic['app_dir'],
+                app_dic['tools_dir']), ('unzip',), ('*.dex',)),
+            Stage('code', lambda res: code_analysis(
+                checksum,
+                app_dic['app_dir'],
+                app_dic['zipped'],
+                app_dic['manifest_file'],
+                res['manifest'][0]['perm'],
+                res['manifest'][0]['packagename']), ('java', 'manifest'),
+                () if apk_fs else ('*.version',)),
+            Stage('strings', strings, ('code', 'elf', 'androguard', 'aapt')),
+            Stage('firebase', firebase, ('strings',)),
+        ]
+        # Only the entries read by the stages are written to disk,
+        # the rest are read from the archive on demand (sources.apk_vfs)
+        patterns = None
+        if processControl.settings.get('EXTRACT_MODE', 'full') == 'selective':
+            patterns = required_files(stages)
+        res = run_stages(stages, processControl.settings.get('STAGE_WORKERS', 4))
+
+        man_data_dic, man_analysis = res['manifest']
+        man_analysis['malware_permissions'] = res['malware_perms']
         trackers = {}
         """
         trackers = Trackers.Trackers(
             checksum,
             app_dic['app_dir'],
-            app_dic['tools_dir']).get_trackers()        
-        """
-        apk_2_java(
-            checksum,
-            app_dic['app_path'],
-            app_dic['app_dir'],
-            #settings.DOWNLOADED_TOOLS_DIR
-            None)
-
-        dex_2_smali(
-            checksum,
-            app_dic['app_dir'],
-            app_dic['tools_dir'])
-
-        code_an_dic = code_analysis(
-            checksum,
-            app_dic['app_dir'],
-            app_dic['zipped'],
-            app_dic['manifest_file'],
-            man_data_dic['perm'])
-
-        get_strings_metadata(
-            app_dic,
-            elf_dict['elf_strings'],
-            ['.java'],
-            code_an_dic)
-
-        # Firebase DB Check
-        code_an_dic['firebase'] = firebase_analysis(
-            checksum,
-            code_an_dic)
-        """
-        # Domain Extraction and Malware Check  
-        code_an_dic['domains'] = MalwareDomainCheck().scan(
-            checksum,
-            code_an_dic['urls_list'])        
+            app_dic['tools_dir']).get_trackers()
         """
-        code_an_dic['domains'] = {}
-
-        context = save_get_ctx(
-            app_dic,
-            man_data_dic,
-            man_analysis,
-            code_an_dic,
-            cert_dic,
-            elf_dict['elf_analysis'],
-            apkid_results,
-            trackers,
-            rescan,
-        )
+        with perf_stage('save'):
+            context = save_get_ctx(
+                app_dic,
+                man_data_dic,
+                man_analysis,
+                res['code'],
+                res['cert'],
+                res['elf']['elf_analysis'],
+                res['apkid'],
+                trackers,
+                rescan,
+            )
 
     except Exception as exp:
         return context, exp
+    finally:
+        if app_dic.get('apk_fs'):
+            app_dic['apk_fs'].close()
+            app_dic['apk_fs'] = None
 
     return context, None
 '''
@@ -373,7 +431,7 @@ def apk_analysis_task(checksum, app_dic, rescan, queue=False):
             app_dic['app_dir'])
         # Extract APK data with Androguard
         androguard_parse(app_dic)
-        # Populates androguard_apk, androguard_manifest_xml, androguard_string_resources
+        # Populates androguard_apk, androguard_apk_name, androguard_apk_icon, androguard_apk_resources
         # Extract APK data with AAPT/AAPT2
         aapt_parse(app_dic)  # Populates apk_features, files, apk_strings
         get_hardcoded_cert_keystore(app_dic)  # Populates file_analysis
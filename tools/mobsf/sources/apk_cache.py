@@ -0,0 +1,116 @@
+# -*- coding: utf_8 -*-
+"""Persistent cache of parsed androguard APK objects.
+
+The state of `tools.androguard4.apk.APK` (manifest, permissions, signing
+blocks...) is pickled, compressed with zlib and stored under env
+`cachePath`/androguard, keyed by the APK SHA-256 plus a fingerprint of the
+androguard sources. Values derived from the resources (app name and icon)
+are stored along. Rescans and triages of a known APK restore the object
+instead of parsing the APK again.
+"""
+from sources.common.common import logger, processControl, log_
+from sources.common.utils import atomic_write
+
+import hashlib
+import os
+import pickle
+import zlib
+from importlib import metadata
+from pathlib import Path
+
+from tools.androguard4 import apk
+
+# Bump when the layout of the stored entry changes
+APK_CACHE_SCHEMA = '1'
+
+APK_CACHE_DIR = 'androguard'
+
+# Sources that define the pickled state
+ANDROGUARD_FILES = (
+    'apk.py',
+    'axml.py',
+    'apkinspector/headers.py',
+)
+
+_fingerprint = None
+
+
+def get_fingerprint():
+    """Return the hash of the androguard sources and the lxml version."""
+    global _fingerprint
+    if _fingerprint:
+        return _fingerprint
+    sha = hashlib.sha256()
+    sha.update(f'schema={APK_CACHE_SCHEMA}\n'.encode())
+    base = Path(apk.__file__).parent
+    for source in ANDROGUARD_FILES:
+        sha.update(source.encode())
+        sha.update((base / source).read_bytes())
+    try:
+        sha.update(f'lxml={metadata.version("lxml")}\n'.encode())
+    except metadata.PackageNotFoundError:
+        pass
+    _fingerprint = sha.hexdigest()[:16]
+    return _fingerprint
+
+
+def get_cache_file(checksum):
+    """Return the cache file path for an APK SHA-256."""
+    return os.path.join(
+        processControl.env['cachePath'],
+        APK_CACHE_DIR,
+        checksum[:2],
+        f'{checksum}.{get_fingerprint()}.pkl.z')
+
+
+def get_cached_apk(checksum, app_path):
+    """
+    Return the parsed APK of a SHA-256, bound to the file in app_path.
+    Returns a tuple (APK, extras), (None, None) on a miss.
+    """
+    cache_file = get_cache_file(checksum)
+    try:
+        with open(cache_file, 'rb') as f:
+            entry = pickle.loads(zlib.decompress(f.read()))
+        state = entry['apk']
+        # The APK may live in another workspace than when it was stored
+        state['filename'] = app_path
+        a = apk.APK.__new__(apk.APK)
+        a.__setstate__(state)
+        log_("info", logger, f'Parsed APK cache hit: {cache_file}')
+        return a, entry['extras']
+    except FileNotFoundError:
+        return None, None
+    except Exception as exp:
+        log_("warning", logger, f'Discarding unreadable parsed APK cache entry {cache_file}: {exp}')
+        Path(cache_file).unlink(missing_ok=True)
+        return None, None
+
+
+def store_apk(checksum, a, extras):
+    """
+    Store a parsed APK and the values derived from it.
+    The signing blocks are parsed first, so that hits skip them too.
+    """
+    cache_file = get_cache_file(checksum)
+    try:
+        a.is_signed()
+        entry = {'apk': a.__getstate__(), 'extras': extras}
+        data = zlib.compress(pickle.dumps(entry, pickle.HIGHEST_PROTOCOL), 1)
+        atomic_write(cache_file, data)
+    except Exception as exp:
+        log_("warning", logger, f'Could not store parsed APK cache entry: {exp}')
+
+
+def load_apk(app_dic, testzip=False):
+    """
+    Return the androguard APK of a scan, from the cache when enabled.
+    Returns a tuple (APK, extras); extras is None when the APK was parsed.
+    testzip is the integrity policy applied when the APK is parsed, a cached
+    APK already passed it.
+    """
+    if processControl.settings.get('APK_CACHE_ENABLED', 0):
+        a, extras = get_cached_apk(app_dic['md5'], app_dic['app_path'])
+        if a is not None:
+            return a, extras
+    return apk.APK(app_dic['app_path'], testzip=testzip), None
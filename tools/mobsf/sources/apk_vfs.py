@@ -0,0 +1,187 @@
+# -*- coding: utf_8 -*-
+"""Read-only virtual filesystem over the entries of an APK.
+
+The central directory is parsed once with apkinspector and the entries are
+read straight from an mmap of the APK, so analyzers can glob, stat and read
+files without extracting them. ApkPath mimics the subset of pathlib.Path
+used by the analyzers (rglob, glob, read_bytes, read_text, open, stat...).
+"""
+from tools.androguard4.apkinspector.headers import (
+    LocalHeaderRecord,
+    ZipEntry,
+)
+from tools.androguard4.apkinspector.extract import extract_file_based_on_header_info
+
+import io
+import posixpath
+from fnmatch import fnmatchcase
+
+
+class ApkStat:
+    """Minimal os.stat_result of an archive entry."""
+
+    def __init__(self, size, compressed_size=0, crc32=0):
+        self.st_size = size
+        self.st_compressed_size = compressed_size
+        self.st_crc32 = crc32
+
+
+class ApkFS:
+    """Archive entries of an APK, indexed by their central directory name."""
+
+    def __init__(self, apk_path):
+        self.apk_path = apk_path
+        # Memory mapped, only the central directory is parsed
+        self.zip = ZipEntry.parse(apk_path, False)
+        self.entries = {}
+        self.dirs = {''}
+        for name, entry in self.zip.infolist().items():
+            name = name.lstrip('/')
+            if not name or name.endswith('/'):
+                continue
+            self.entries[name] = entry
+            parent = posixpath.dirname(name)
+            while parent not in self.dirs:
+                self.dirs.add(parent)
+                parent = posixpath.dirname(parent)
+        self.root = ApkPath(self, '')
+
+    def close(self):
+        self.zip.zip.close()
+
+    def read(self, name):
+        entry = self.entries[name]
+        # Encrypted entries can't be read, as in unzip()
+        if entry.general_purpose_bit_flag & 0x1:
+            raise PermissionError(f'Encrypted entry: {name}')
+        # Own cursor over the shared map, stages read concurrently
+        reader = self.zip.zip.reader()
+        local_header = LocalHeaderRecord.parse(reader, entry)
+        if local_header is None:
+            raise OSError(f'Invalid local header: {name}')
+        return extract_file_based_on_header_info(
+            reader, local_header.to_dict(), entry.to_dict())[0]
+
+    def names(self):
+        return list(self.entries)
+
+
+class ApkPath:
+    """pathlib.Path-like view of a file or directory of an ApkFS."""
+
+    def __init__(self, fs, name):
+        self.fs = fs
+        self.path = name.strip('/')
+
+    def __truediv__(self, other):
+        return ApkPath(self.fs, posixpath.join(self.path, str(other)))
+
+    def __str__(self):
+        return self.path
+
+    def __repr__(self):
+        return f'ApkPath({self.path!r})'
+
+    def __eq__(self, other):
+        return isinstance(other, ApkPath) and other.fs is self.fs and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    @property
+    def name(self):
+        return posixpath.basename(self.path)
+
+    @property
+    def suffix(self):
+        return posixpath.splitext(self.name)[1]
+
+    @property
+    def stem(self):
+        return posixpath.splitext(self.name)[0]
+
+    @property
+    def parent(self):
+        return ApkPath(self.fs, posixpath.dirname(self.path))
+
+    @property
+    def parts(self):
+        return tuple(self.path.split('/')) if self.path else ()
+
+    def as_posix(self):
+        return self.path
+
+    def relative_to(self, other):
+        base = other.path if isinstance(other, ApkPath) else str(other).strip('/')
+        if not base:
+            return ApkPath(self.fs, self.path)
+        if not self.path.startswith(base + '/'):
+            raise ValueError(f'{self.path!r} is not in the subpath of {base!r}')
+        return ApkPath(self.fs, self.path[len(base) + 1:])
+
+    def exists(self):
+        return self.is_file() or self.is_dir()
+
+    def is_file(self):
+        return self.path in self.fs.entries
+
+    def is_dir(self):
+        return self.path in self.fs.dirs
+
+    def stat(self):
+        entry = self.fs.entries.get(self.path)
+        if entry is None:
+            if self.is_dir():
+                return ApkStat(0)
+            raise FileNotFoundError(self.path)
+        return ApkStat(entry.uncompressed_size, entry.compressed_size,
+                       entry.crc32_of_uncompressed_data)
+
+    def read_bytes(self):
+        if not self.is_file():
+            raise FileNotFoundError(self.path)
+        return self.fs.read(self.path)
+
+    def read_text(self, encoding='utf-8', errors='strict'):
+        return self.read_bytes().decode(encoding, errors)
+
+    def open(self, mode='rb', encoding='utf-8', errors='strict'):
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise io.UnsupportedOperation('ApkFS is read-only')
+        data = io.BytesIO(self.read_bytes())
+        if 'b' in mode:
+            return data
+        return io.TextIOWrapper(data, encoding=encoding, errors=errors)
+
+    def _children(self):
+        prefix = self.path + '/' if self.path else ''
+        for name in list(self.fs.entries) + list(self.fs.dirs):
+            if name and name.startswith(prefix) and '/' not in name[len(prefix):]:
+                yield ApkPath(self.fs, name)
+
+    def iterdir(self):
+        if not self.is_dir():
+            raise NotADirectoryError(self.path)
+        return self._children()
+
+    def glob(self, pattern):
+        """Entries matching a relative pattern, one fnmatch per path segment."""
+        prefix = self.path + '/' if self.path else ''
+        segments = pattern.split('/')
+        if '**' in segments:
+            raise ValueError('Use rglob() for recursive patterns')
+        for name in self.fs.entries:
+            if not name.startswith(prefix):
+                continue
+            parts = name[len(prefix):].split('/')
+            if len(parts) == len(segments) and all(
+                    fnmatchcase(p, s) for p, s in zip(parts, segments)):
+                yield ApkPath(self.fs, name)
+
+    def rglob(self, pattern):
+        """Files below this directory whose name matches the pattern."""
+        prefix = self.path + '/' if self.path else ''
+        for name in self.fs.entries:
+            if name.startswith(prefix) and fnmatchcase(posixpath.basename(name), pattern):
+                yield ApkPath(self.fs, name)
+
@@ -1,14 +1,14 @@
 # -*- coding: utf_8 -*-
 """Module for apk analysis."""
-from sources.common.common import logger, log_
+from sources.common.common import logger, processControl, log_
 
 import os
 import re
 #import logging
 from pathlib import Path
 
-from tools.androguard4 import apk
 from sources import aapt
+from sources.apk_cache import load_apk, store_apk
 '''
 from mobsf.StaticAnalyzer.tools.androguard4 import (
     apk,
@@ -52,31 +52,46 @@ def androguard_parse(app_dict):
     """Extract features from APK using androguard."""
     checksum = app_dict['md5']
     app_dict['androguard_apk'] = None
-    app_dict['androguard_manifest_xml'] = None
     app_dict['androguard_apk_resources'] = None
     app_dict['androguard_apk_name'] = None
     app_dict['androguard_apk_icon'] = None
+    app_dict['files_types'] = {}
     try:
-        a = apk.APK(app_dict['app_path'])
+        a, extras = load_apk(app_dict)
         if not a:
             log_("error", logger, 'Failed to parse APK with androguard')
             return
         app_dict['androguard_apk'] = a
 
+        # Types of the APK entries from their first bytes, not their extensions.
+        # They are kept in the APK state, a cached APK does not read them again
         try:
-            app_dict['androguard_apk_name'] = a.get_app_name()
-        except Exception as exp:
-            log_("error", logger, 'Failed to get app name with androguard')
-
-        try:
-            app_dict['androguard_apk_icon'] = a.get_app_icon(max_dpi=0xFFFE - 1)
+            app_dict['files_types'] = a.get_files_types()
         except Exception as exp:
-            log_("error", logger, 'Failed to get app icon with androguard')
+            log_("error", logger, 'Failed to get file types with androguard')
 
-        try:
-            xml = a.get_android_manifest_axml().get_xml()
-            app_dict['androguard_manifest_xml'] = xml
-        except Exception as exp:
+        if extras and 'app_name' in extras:
+            app_dict['androguard_apk_name'] = extras['app_name']
+            app_dict['androguard_apk_icon'] = extras['app_icon']
+        else:
+            try:
+                app_dict['androguard_apk_name'] = a.get_app_name()
+            except Exception as exp:
+                log_("error", logger, 'Failed to get app name with androguard')
+
+            try:
+                app_dict['androguard_apk_icon'] = a.get_app_icon(max_dpi=0xFFFE - 1)
+            except Exception as exp:
+                log_("error", logger, 'Failed to get app icon with androguard')
+
+            if processControl.settings.get('APK_CACHE_ENABLED', 0):
+                store_apk(checksum, a, {
+                    'app_name': app_dict['androguard_apk_name'],
+                    'app_icon': app_dict['androguard_apk_icon'],
+                })
+
+        # The manifest lxml tree is read from androguard_apk (get_parsed_manifest)
+        if a.get_android_manifest_xml() is None:
             log_("error", logger, 'Failed to parse AndroidManifest.xml with androguard')
 
         try:
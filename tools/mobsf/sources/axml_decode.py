@@ -0,0 +1,155 @@
+# -*- coding: utf_8 -*-
+"""Batch decoding of the binary XML (AXML) resources of an APK.
+
+The res/xml resources (network security config, file provider paths...)
+and the XML icons (adaptive icons) are read straight from the archive and
+converted to XML with androguard AXMLPrinter in a thread pool, so they are
+available without an apktool decode. The files are found through
+resources.arsc, resource shrinkers rename them (res/xml/foo.xml -> r/a.xml),
+and the references to the app resources are written by name (@xml/foo) as
+apktool does.
+
+Threads, not processes: the stage runs in a scheduler thread and in batch
+workers, and forking a multithreaded process can deadlock on the locks
+held by the other threads (logging, ApkFS). The work per file is small.
+"""
+from sources.common.common import logger, processControl, log_
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
+
+from tools.androguard4.axml import AXMLPrinter
+
+# Used when the APK has no resources.arsc
+AXML_PATTERNS = (
+    'res/xml/*.xml',
+    'res/mipmap-anydpi*/*.xml',
+    'res/drawable-anydpi*/*.xml',
+)
+
+# Resource types whose XML files are decoded
+AXML_RESOURCE_TYPES = ('xml', 'mipmap')
+
+# Below this number of files the pool is not worth starting
+AXML_POOL_MIN_FILES = 32
+AXML_CHUNK_SIZE = 16
+
+REFERENCE_REGEX = re.compile(r'"@([0-9A-F]{8})"')
+RESOURCE_ID_REGEX = re.compile(r'@([0-9A-F]{8})')
+
+
+def decode_axml(data):
+    """Return the XML text of an AXML buffer, None if it can't be decoded."""
+    if data.lstrip()[:1] == b'<':
+        # Plain text XML
+        return data.decode('utf8', 'ignore')
+    try:
+        printer = AXMLPrinter(data)
+        if not printer.is_valid():
+            return None
+        return printer.get_xml().decode('utf8', 'ignore')
+    except Exception:
+        return None
+
+
+def _decode_batch(buffers):
+    return [decode_axml(data) for data in buffers]
+
+
+def decode_axml_entries(apk_fs, names, workers):
+    """
+    Decode AXML entries of the APK, in a thread pool when there are many.
+    Returns {name: xml text}, without the entries that can't be decoded.
+    """
+    read_names = []
+    buffers = []
+    for name in names:
+        try:
+            buffers.append(apk_fs.read(name))
+            read_names.append(name)
+        except Exception as exp:
+            log_("warning", logger, f'Failed to read {name} from the APK: {exp}')
+
+    decoded = None
+    if workers > 1 and len(buffers) >= AXML_POOL_MIN_FILES:
+        chunks = [buffers[i:i + AXML_CHUNK_SIZE]
+                  for i in range(0, len(buffers), AXML_CHUNK_SIZE)]
+        try:
+            with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+                decoded = [xml for batch in executor.map(_decode_batch, chunks) for xml in batch]
+        except Exception as exp:
+            log_("warning", logger, f'AXML decoding pool failed, decoding serially: {exp}')
+    if decoded is None:
+        decoded = _decode_batch(buffers)
+    return {name: xml for name, xml in zip(read_names, decoded) if xml}
+
+
+def resolve_references(xml, rsrc, package):
+    """Write the references to the app resources by name, as apktool."""
+    names = {}
+
+    def resolve(match):
+        rid = match.group(1)
+        if rid not in names:
+            try:
+                names[rid] = rsrc.get_resource_xml_name(int(rid, 16), package)
+            except Exception:
+                names[rid] = None
+        return f'"{names[rid]}"' if names[rid] else match.group(0)
+
+    return REFERENCE_REGEX.sub(resolve, xml)
+
+
+def get_resource_name(app_dic, value):
+    """Return the XML name (@xml/foo) of a resource reference (@7F120001)."""
+    rsrc = app_dic.get('androguard_apk_resources')
+    match = RESOURCE_ID_REGEX.fullmatch(value or '')
+    if not rsrc or not match:
+        return value
+    try:
+        package = rsrc.get_packages_names()[0]
+        return rsrc.get_resource_xml_name(int(match.group(1), 16), package) or value
+    except Exception:
+        return value
+
+
+def decode_res_xml(app_dic):
+    """
+    Decode the res/xml resources and the XML icons of the APK.
+    Populates decoded_xml {file name: xml text} and decoded_xml_names
+    {XML name: file name}.
+    """
+    app_dic['decoded_xml'] = {}
+    app_dic['decoded_xml_names'] = {}
+    apk_fs = app_dic.get('apk_fs')
+    if not apk_fs:
+        return
+    try:
+        rsrc = app_dic.get('androguard_apk_resources')
+        package = None
+        files = {}
+        if rsrc:
+            package = rsrc.get_packages_names()[0]
+            for type_name in AXML_RESOURCE_TYPES:
+                files.update(rsrc.get_resource_files(package, type_name))
+        else:
+            files = {name: None for name in apk_fs.names()
+                     if any(fnmatchcase(name, pattern) for pattern in AXML_PATTERNS)}
+        icon = app_dic.get('androguard_apk_icon')
+        if icon and icon not in files:
+            files[icon] = None
+        names = [name for name in files
+                 if name.endswith('.xml') and name in apk_fs.entries]
+
+        decoded = decode_axml_entries(
+            apk_fs, names, processControl.settings.get('AXML_WORKERS', 4))
+        if rsrc:
+            decoded = {name: resolve_references(xml, rsrc, package)
+                       for name, xml in decoded.items()}
+        app_dic['decoded_xml'] = decoded
+        app_dic['decoded_xml_names'] = {
+            files[name]: name for name in decoded if files[name]}
+        log_("info", logger, f'Decoded {len(decoded)}/{len(names)} binary XML resources from the APK')
+    except Exception:
+        log_("exception", logger, 'Failed to decode binary XML resources')
@@ -1,9 +1,12 @@
 # !/usr/bin/python
 # coding=utf-8
+import io
 import shutil
 import subprocess
+import tempfile
 
 import lief
+from sources.apk_vfs import ApkPath
 from sources.common.utils import (
     run_with_timeout, strings_on_binary
 )
@@ -42,11 +45,13 @@ class ELFChecksec:
     def __init__(self, elf_file, so_rel):
         self.elf_path = elf_file.as_posix()
         self.elf_rel = so_rel
+        # Libraries served from the APK (sources.apk_vfs) are parsed in memory
+        self.elf_raw = elf_file.read_bytes() if isinstance(elf_file, ApkPath) else None
         self.elf = run_with_timeout(
             lief.parse,
             10, #timeout adapted from below
             #settings.BINARY_ANALYSIS_TIMEOUT,
-            self.elf_path)
+            io.BytesIO(self.elf_raw) if self.elf_raw is not None else self.elf_path)
 
     def checksec(self):
         elf_dict = {}
@@ -260,6 +265,8 @@ class ELFChecksec:
         return elf_dict
 
     def is_elf(self, elf_path):
+        if self.elf_raw is not None:
+            return self.elf_raw[:4] == b'\x7fELF'
         return lief.is_elf(elf_path)
 
     def is_nx(self):
@@ -344,8 +351,15 @@ class ELFChecksec:
             return True
         except Exception:
             try:
-                return nm_is_debug_symbol_stripped(
-                    self.elf_path)
+                if self.elf_raw is None:
+                    return nm_is_debug_symbol_stripped(
+                        self.elf_path)
+                # Libraries read from the APK are not on disk,
+                # nm reads a temporary copy
+                with tempfile.NamedTemporaryFile(suffix='.so') as tmp:
+                    tmp.write(self.elf_raw)
+                    tmp.flush()
+                    return nm_is_debug_symbol_stripped(tmp.name)
             except Exception:
                 return True
 
@@ -370,7 +384,8 @@ class ELFChecksec:
         except Exception:
             elf_strings = None
         if not elf_strings:
-            elf_strings = strings_on_binary(self.elf_path)
+            elf_strings = strings_on_binary(
+                self.elf_raw if self.elf_raw is not None else self.elf_path)
         for i in elf_strings:
             if isinstance(i, bytes):
                 continue
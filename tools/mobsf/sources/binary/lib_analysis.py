@@ -32,8 +32,12 @@ logger = logging.getLogger(__name__)
 """
 
 
-def library_analysis(checksum, src, arch):
-    """Perform library binary analysis."""
+def library_analysis(checksum, src, arch, apk_fs=None):
+    """Perform library binary analysis.
+
+    With `apk_fs` (sources.apk_vfs.ApkFS) the libraries are read from the APK
+    instead of the extracted tree in `src`.
+    """
     # ini.
     #base_dir = Path(settings.UPLD_DIR) / checksum
     base_dir = processControl.env['outputPath']
@@ -67,10 +71,14 @@ def library_analysis(checksum, src, arch):
         log_("info", logger, msg)
         # Supports Static Library, Shared objects, Dynamic Library,
         # from APK, SO, AAR, JAR, IPA, DYLIB, and A
-        for libfile in Path(src).rglob(ext):
+        root = apk_fs.root if apk_fs else Path(src)
+        for libfile in root.rglob(ext):
             if '__MACOSX' in libfile.as_posix():
                 continue
-            rel_path = libfile.relative_to(base_dir).as_posix()
+            if apk_fs:
+                rel_path = libfile.as_posix()
+            else:
+                rel_path = libfile.relative_to(base_dir).as_posix()
             msg = f'Analyzing {rel_path}'
             #logger.info(msg)
             #append_scan_status(checksum, msg)
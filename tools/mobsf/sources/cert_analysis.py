@@ -1,12 +1,11 @@
 # -*- coding: utf_8 -*-
 """Module holding the functions for code analysis."""
 from sources.common.common import logger, processControl, log_
-from sources.common.utils import gen_sha256_hash, find_java_binary
+from sources.common.utils import gen_sha256_hash
 
 import hashlib
 import os
 import re
-import subprocess
 from pathlib import Path
 
 import asn1crypto
@@ -19,6 +18,7 @@ from cryptography.hazmat.primitives.asymmetric import (
     rsa,
 )
 from tools.androguard4 import (
+    apk,
     util,
 )
 """
@@ -46,6 +46,10 @@ HASH_FUNCS = {
     'sha256': hashlib.sha256,
     'sha512': hashlib.sha512,
 }
+# File types of tools.androguard4.apk.get_file_type reported whatever
+# the extension of the file
+CERT_FILE_TYPES = ('PEM', 'X509', 'PKCS12')
+KEYSTORE_FILE_TYPES = ('JKS', 'JCEKS', 'BKS')
 #init. custom function
 def escape(str):
     return str
@@ -57,6 +61,8 @@ def get_hardcoded_cert_keystore(app_dic):
     checksum = app_dic['md5']
     try:
         files = app_dic.get('files') or app_dic.get('apk_files')
+        if not files and app_dic.get('apk_fs'):
+            files = app_dic['apk_fs'].names()
         msg = 'Getting Hardcoded Certificates/Keystores'
         #logger.info(msg)
         #append_scan_status(checksum, msg)
@@ -66,14 +72,16 @@ def get_hardcoded_cert_keystore(app_dic):
         key_store = []
         if not files:
             return
+        # Types read from the APK entries by androguard, packers fake extensions
+        files_types = app_dic.get('files_types') or {}
         for file_name in files:
-            if '.' not in file_name:
-                continue
+            file_type = files_types.get(file_name)
             ext = Path(file_name).suffix
-            if ext in ('.cer', '.pem', '.cert', '.crt',
-                       '.pub', '.key', '.pfx', '.p12', '.der'):
+            if (ext in ('.cer', '.pem', '.cert', '.crt',
+                        '.pub', '.key', '.pfx', '.p12', '.der')
+                    or file_type in CERT_FILE_TYPES):
                 certz.append(escape(file_name))
-            if ext in ('.jks', '.bks'):
+            if ext in ('.jks', '.bks') or file_type in KEYSTORE_FILE_TYPES:
                 key_store.append(escape(file_name))
         if certz:
             desc = 'Certificate/Key files hardcoded inside the app.'
@@ -144,36 +152,36 @@ def get_pub_key_details(data):
     return certlist
 
 
-def get_signature_versions(checksum, app_path, tools_dir, signed):
-    """Get signature versions using apksigner."""
-    v1, v2, v3, v4 = False, False, False, False
+def get_signature_versions(checksum, app_path, signed, a=None):
+    """Get signature versions, verifying the v2/v3 signatures with androguard.
+
+    v1 is reported if a JAR signature is found, v2 and v3 if their signatures
+    and content digests verify. The digests are streamed from the memory mapped
+    APK. v4 signatures live in a separate .idsig file and are not checked.
+    """
+    v1, v2, v3, v4 = False, False, False, None
     try:
         if not signed:
             return v1, v2, v3, v4
         logger.info('Getting Signature Versions')
-        apksigner = Path(tools_dir) / 'apksigner.jar'
-        #init
-        apksigner = os.path.join(processControl.env['tools'], "apksigner.jar")
-
-        args = [find_java_binary(), '-Xmx1024M',
-                '-Djava.library.path=', '-jar',
-                #apksigner.as_posix(),   
-                apksigner,
-                'verify', '--verbose', app_path]
-        # EGA fin
-        out = subprocess.check_output(
-            args, stderr=subprocess.STDOUT)
-        out = out.decode('utf-8', 'ignore')
-        if re.findall(r'v1 scheme \(JAR signing\): true', out):
-            v1 = True
-        if re.findall(r'\(APK Signature Scheme v2\): true', out):
-            v2 = True
-        if re.findall(r'\(APK Signature Scheme v3\): true', out):
-            v3 = True
-        if re.findall(r'\(APK Signature Scheme v4\): true', out):
-            v4 = True
+        if a is None:
+            # Only the signing blocks are read
+            a = apk.APK(app_path, skip_analysis=True)
+        workers = processControl.settings.get('EXTRACT_WORKERS', 4) if processControl.settings else None
+        v1 = a.is_signed_v1()
+        v2 = a.verify_signature_v2(workers)
+        v3 = a.verify_signature_v3(workers)
+        if v2 is None or v3 is None:
+            # Only unsupported algorithms (e.g. verity), report the block
+            logger.info('Unsupported signature algorithm, fallback to androguard signature detection')
+            v2 = a.is_signed_v2() if v2 is None else v2
+            v3 = a.is_signed_v3() if v3 is None else v3
+        if a.is_signed_v2() and not v2:
+            log_("warning", logger, 'APK Signature Scheme v2 verification failed')
+        if a.is_signed_v3() and not v3:
+            log_("warning", logger, 'APK Signature Scheme v3 verification failed')
     except Exception as exp:
-        msg = 'Failed to get signature versions with apksigner'
+        msg = 'Failed to get signature versions with androguard'
         #logger.error(msg)
         #append_scan_status(checksum, msg, repr(exp))
         log_("exception", logger, msg)
@@ -236,10 +244,9 @@ def apksigtool_cert(checksum, apk_path, tools_dir):
         v1, v2, v3, v4 = get_signature_versions(
             checksum,
             apk_path,
-            tools_dir,
             signed)
         if signed and not (v1 or v2 or v3 or v4):
-            # apksigner.jar failed to get signature versions
+            # androguard failed to get signature versions
             logger.info('Fetching signature versions with apksigtool')
             v1, v2, v3, v4 = av1, av2, av3, av4
         certlist.append(f'v1 signature: {v1}')
@@ -265,7 +272,7 @@ def apksigtool_cert(checksum, apk_path, tools_dir):
     }
 
 
-def get_cert_data(checksum, a, app_path, tools_dir):
+def get_cert_data(checksum, a, app_path):
     """Get Human readable certificate."""
     certlist = []
     signed = False
@@ -278,12 +285,8 @@ def get_cert_data(checksum, a, app_path, tools_dir):
     v1, v2, v3, v4 = get_signature_versions(
         checksum,
         app_path,
-        tools_dir,
-        signed)
-    if signed and not (v1 or v2 or v3 or v4):
-        # apksigner.jar failed to get signature versions
-        logger.info('Fetching signature versions with androguard')
-        v1, v2, v3, v4 = a.is_signed_v1(), a.is_signed_v2(), a.is_signed_v3(), None
+        signed,
+        a)
     certlist.append(f'v1 signature: {v1}')
     certlist.append(f'v2 signature: {v2}')
     certlist.append(f'v3 signature: {v3}')
@@ -330,8 +333,7 @@ def cert_info(app_dic, man_dict):
         if a:
             cert_data = get_cert_data(
                 app_dic['md5'],
-                a, app_dic['app_path'],
-                app_dic['tools_dir'])
+                a, app_dic['app_path'])
         else:
             logger.warning('androguard certificate parsing failed,'
                            ' switching to apksigtool')
@@ -349,6 +351,11 @@ def cert_info(app_dic, man_dict):
         if manifestfile:
             with open(manifestfile, 'r', encoding='utf-8') as manifile:
                 manidat = manifile.read()
+        elif app_dic.get('apk_fs'):
+            # Not extracted, read it from the archive
+            manifest_entry = app_dic['apk_fs'].root / 'META-INF' / 'MANIFEST.MF'
+            if manifest_entry.is_file():
+                manidat = manifest_entry.read_text('utf-8', 'ignore')
         sha256_digest = bool(re.findall(r'SHA-256-Digest', manidat))
         findings = []
         if cert_data['signed']:
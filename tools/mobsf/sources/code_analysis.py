@@ -3,6 +3,7 @@
 from sources.common.common import logger, processControl, log_
 
 from sources.common.utils import get_android_src_dir, filename_from_path, url_n_email_extract
+from sources.perf import perf_stage
 
 import os
 import tempfile
@@ -15,6 +16,11 @@ from sources.sast_engine import (
 from sources import (
     sbom_analysis,
 )
+from sources.tpl_index import (
+    get_library_filter,
+    get_tpl_mode,
+    split_library_findings,
+)
 import yaml
 from sources.MalwareAnalyzer import (
     behaviour_analysis,
@@ -87,7 +93,7 @@ def permission_transform(perm_mappings):
     return mappings
 
 
-def code_analysis(checksum, app_dir, typ, manifest_file, android_permissions):
+def code_analysis(checksum, app_dir, typ, manifest_file, android_permissions, package=None):
     """Perform the code analysis."""
     result = {
         'api': {},
@@ -99,6 +105,7 @@ def code_analysis(checksum, app_dir, typ, manifest_file, android_permissions):
         'urls': [],
         'emails': [],
         'sbom': {},
+        'tpl': {},
     }
     try:
         # init
@@ -128,66 +135,31 @@ def code_analysis(checksum, app_dir, typ, manifest_file, android_permissions):
             #'ignore_paths': skp,
         }
         sast = SastEngine(options, src)
-        # Read data once and pass it to all the analysis
-        file_data = sast.read_files()
-
-        # SBOM Analysis
-        result['sbom'] = sbom_analysis.sbom(app_dir, file_data)
-        msg = 'Android SBOM Analysis Completed'
-        #logger.info(msg)
-        #append_scan_status(checksum, msg)
-        log_("info", logger, msg)
-
-        # Code Analysis
-        result['findings'] = sast.run_rules(
-            file_data, code_rules.as_posix())
-        msg = 'Android SAST Completed'
-        #logger.info(msg)
-        #append_scan_status(checksum, msg)
-        log_("info", logger, msg)
-
-        # API Analysis
-        msg = 'Android API Analysis Started'
-        #logger.info(msg)
-        #append_scan_status(checksum, msg)
-        log_("info", logger, msg)
-        sast = SastEngine(options, src)
-        result['api'] = sast.run_rules(
-            file_data, api_rules.as_posix())
-        msg = 'Android API Analysis Completed'
-        #logger.info(msg)
-        #append_scan_status(checksum, msg)
-        log_("info", logger, msg)
-
-        # Permission Mapping
-        rule_file = get_perm_rules(
-            checksum, perm_rules, android_permissions)
-        if rule_file:
-            msg = 'Android Permission Mapping Started'
-            #logger.info(msg)
-            #append_scan_status(checksum, msg)
-            log_("info", logger, msg)
-            sast = SastEngine(options, src)
-            result['perm_mappings'] = permission_transform(
-                sast.run_rules(file_data, rule_file.name))
-            msg = 'Android Permission Mapping Completed'
-            #logger.info(msg)
-            #append_scan_status(checksum, msg)
-            log_("info", logger, msg)
-            os.unlink(rule_file.name)
 
-        # Behavior Analysis
-        sast = SastEngine(options, src)
-        result['behaviour'] = behaviour_analysis.analyze(
-            checksum, sast, file_data)
+        # Code, API, Permission Mapping and Behaviour rules are matched
+        # in a single pass over the files and split back by rule file
+        rule_groups = {
+            'findings': code_rules.as_posix(),
+            'api': api_rules.as_posix(),
+        }
+        rule_file = None
+        if processControl.settings.get('SAST_CACHE_ENABLED', 0):
+            # All the permission rules, so that the rule set, and the SAST
+            # cache entries, are the same for every app
+            if android_permissions:
+                rule_groups['perm_mappings'] = perm_rules.as_posix()
+        else:
+            rule_file = get_perm_rules(
+                checksum, perm_rules, android_permissions)
+            if rule_file:
+                rule_groups['perm_mappings'] = rule_file.name
+        rule_groups['behaviour'] = behaviour_analysis.get_rules_path()
 
-        # NIAP Scan
+        # NIAP Scan, on the same batches of files
+        cengine = None
+        read_extensions = set(options['match_extensions'])
         #if settings_enabled('NIAP_ENABLED'):
         if processControl.settings['NIAP_ENABLED']:
-            msg = 'Running NIAP Analyzer'
-            #logger.info(msg)
-            #append_scan_status(checksum, msg)
-            log_("info", logger, msg)
             niap_options = {
                 'choice_rules': niap_rules.as_posix(),
                 'alternative_path': str(manifest_file) if manifest_file else '',
@@ -195,9 +167,82 @@ def code_analysis(checksum, app_dir, typ, manifest_file, android_permissions):
                 'ignore_paths': skp,
             }
             cengine = ChoiceEngine(niap_options, src)
-            file_data = cengine.read_files()
-            result['niap'] = cengine.run_rules(
-                file_data, niap_rules.as_posix())
+            cengine.start_batches()
+            read_extensions.update(niap_options['choice_extensions'])
+
+        # Third-party library sources, see sources/tpl_index.py
+        get_library = get_library_filter(src, package)
+        drop_libraries = get_library and get_tpl_mode() == 'drop'
+        libraries = {}
+
+        # The files are read in batches of up to SAST_MEMORY_LIMIT_MB of
+        # content, each batch is released before the next one is read
+        max_bytes = processControl.settings.get('SAST_MEMORY_LIMIT_MB', 0) * 1024 * 1024
+        packages = set()
+        files = 0
+        msg = 'Android SAST, API, Permission Mapping and Behaviour Analysis Started'
+        log_("info", logger, msg)
+        if cengine:
+            log_("info", logger, 'Running NIAP Analyzer')
+        finds = {}
+        try:
+            with perf_stage('code.sast'):
+                sast.start_rule_groups(rule_groups)
+                for batch in sast.read_file_batches(max_bytes, read_extensions):
+                    file_data = [(file_path, data) for file_path, data in batch
+                                 if file_path.suffix.lower() in options['match_extensions']]
+                    files += len(file_data)
+                    sbom_analysis.find_packages(file_data, packages)
+                    if get_library:
+                        for file_path, _data in file_data:
+                            library = get_library(file_path)
+                            if library:
+                                libraries[file_path.as_posix().replace(src, '', 1)] = library
+                    if drop_libraries:
+                        file_data = [(file_path, data) for file_path, data in file_data
+                                     if file_path.as_posix().replace(src, '', 1) not in libraries]
+                    # The rule groups that fail are left out by the engine,
+                    # the next batches are still read for the SBOM
+                    sast.scan_batch(file_data)
+                    if cengine:
+                        try:
+                            result['niap'] = cengine.scan_batch(batch)
+                        except Exception:
+                            log_("exception", logger, 'Failed to perform NIAP analysis')
+                            result['niap'] = {}
+                            cengine = None
+                    del batch, file_data
+                finds = sast.rule_groups_findings()
+            if get_library:
+                log_("info", logger, f'{len(libraries)}/{files} source files belong to known libraries')
+            if finds and libraries and get_tpl_mode() == 'summary':
+                result['tpl'] = split_library_findings(finds, libraries)
+        finally:
+            if rule_file:
+                os.unlink(rule_file.name)
+
+        # SBOM Analysis, *.version files read from the APK when possible
+        apk_fs = processControl.data.get('app_dic', {}).get('apk_fs')
+        with perf_stage('code.sbom'):
+            result['sbom'] = sbom_analysis.sbom(
+                apk_fs.root if apk_fs else app_dir, packages)
+        msg = 'Android SBOM Analysis Completed'
+        #logger.info(msg)
+        #append_scan_status(checksum, msg)
+        log_("info", logger, msg)
+
+        # Each rule group is kept if it finished, even if another one failed
+        result['findings'] = finds.get('findings', {})
+        result['api'] = finds.get('api', {})
+        if 'perm_mappings' in finds:
+            result['perm_mappings'] = permission_transform({
+                perm: details
+                for perm, details in finds['perm_mappings'].items()
+                if perm in android_permissions})
+        result['behaviour'] = finds.get('behaviour', {})
+        msg = 'Android SAST, API, Permission Mapping and Behaviour Analysis Completed'
+        log_("info", logger, msg)
+        if cengine:
             msg = 'NIAP Analysis Completed'
             #logger.info(msg)
             #append_scan_status(checksum, msg)
@@ -213,6 +258,7 @@ def code_analysis(checksum, app_dir, typ, manifest_file, android_permissions):
                 (pfile.suffix in ('.java', '.kt')
                     and any(skip_path in pfile.as_posix()
                             for skip_path in skp) is False
+                    and not (get_library and get_library(pfile))
                     and pfile.is_file())
             ):
                 content = None
@@ -0,0 +1,130 @@
+"""
+@Purpose: Single-read ingestion of APK files
+@Usage: ingest_file() places a working copy of an APK and file_digests() returns its
+        MD5/SHA-1/SHA-256. The file is read at most once: digests are computed while
+        copying (or in one mmap pass when the copy is a hardlink/reflink) and cached
+        by inode, so later lookups of the same file or of its hardlinks are free.
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import shutil
+import threading
+
+DIGESTS = ('md5', 'sha1', 'sha256')
+BUFFER_SIZE = 8 * 1024 * 1024
+# ioctl FICLONE: share the extents of the source (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _file_key(stat):
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _new_hashes():
+    return [hashlib.new(name) for name in DIGESTS]
+
+
+def _hexdigests(hashes):
+    return {name: h.hexdigest() for name, h in zip(DIGESTS, hashes)}
+
+
+def _remember(path, digests):
+    with _lock:
+        _cache[_file_key(os.stat(path))] = digests
+
+
+def _cached(path):
+    with _lock:
+        return _cache.get(_file_key(os.stat(path)))
+
+
+def _hash_file(path):
+    hashes = _new_hashes()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                for offset in range(0, size, BUFFER_SIZE):
+                    chunk = view[offset:offset + BUFFER_SIZE]
+                    for h in hashes:
+                        h.update(chunk)
+                    chunk.release()
+                view.release()
+    return _hexdigests(hashes)
+
+
+def _copy_and_hash(src, dst):
+    hashes = _new_hashes()
+    buf = bytearray(BUFFER_SIZE)
+    view = memoryview(buf)
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        while True:
+            n = fsrc.readinto(buf)
+            if not n:
+                break
+            chunk = view[:n]
+            for h in hashes:
+                h.update(chunk)
+            fdst.write(chunk)
+    shutil.copymode(src, dst)
+    return _hexdigests(hashes)
+
+
+def _link(src, dst):
+    """Place dst as a hardlink or a reflink of src. Returns False if not supported."""
+    try:
+        os.link(src, dst)
+        return True
+    except OSError:
+        pass
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+    return False
+
+
+def file_digests(path):
+    """
+    @Desc: Returns the MD5, SHA-1 and SHA-256 of a file, reading it at most once.
+    @Result: Dictionary {'md5': ..., 'sha1': ..., 'sha256': ...}
+    """
+    digests = _cached(path)
+    if digests is None:
+        digests = _hash_file(path)
+        _remember(path, digests)
+    return digests
+
+
+def ingest_file(src, dst):
+    """
+    @Desc: Places a working copy of src in dst (hardlink, reflink or copy, in that order)
+           computing the digests in the same read.
+    @Result: Dictionary with the digests of the file.
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    if os.path.exists(dst):
+        if os.path.samefile(src, dst):
+            return file_digests(src)
+        os.remove(dst)
+    digests = _cached(src)
+    if _link(src, dst):
+        digests = digests or file_digests(dst)
+    elif digests:
+        shutil.copyfile(src, dst)
+    else:
+        digests = _copy_and_hash(src, dst)
+        _remember(src, digests)
+    _remember(dst, digests)
+    return digests
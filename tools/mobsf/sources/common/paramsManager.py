@@ -13,15 +13,34 @@ from sources.common.utils import configLoader, dbTimestamp
 # Constants for parameter files
 JSON_PARMS = "config.json"
 
+# Settings that change the analysis results, hashed in the fingerprint of
+# the result cache (sources/scan_cache.py). Settings that only change the
+# speed (workers, extraction mode, caches, SAST batches) are left out, so
+# tuning them keeps the cached results. Add here any new setting that
+# changes the results.
+RESULT_SETTINGS = (
+    "NIAP_ENABLED",
+    "SAST_TIMEOUT",
+    "ZIP_INTEGRITY",
+    "TPL_MODE",
+)
+
 def manageArgs():
     """
     @Desc: Parse command-line arguments to configure the process.
     @Result: Returns parsed arguments as a Namespace object.
     """
     parser = argparse.ArgumentParser(description="Main process for APK Static Analyzer.")
-    parser.add_argument('--proc', type=str, help="Process type: FULL", default="FULL")
+    parser.add_argument('--proc', type=str, help="Process type: FULL or TRIAGE (manifest, permissions and certificate only)",
+                        choices=["FULL", "TRIAGE"], default="FULL")
     parser.add_argument('--source', type=str, help="APK Source path", default="")
     parser.add_argument('--result', type=str, help="Results path", default="")
+    parser.add_argument('--workers', type=int, help="Number of APKs analyzed in parallel (batch mode)", default=1)
+    parser.add_argument('--force', action='store_true', help="Ignore the result cache and rescan")
+    parser.add_argument('--invalidate', type=str, help="SHA-256 to drop from the result cache ('all' clears it)", default="")
+    parser.add_argument('--tpl', type=str, help="Known third-party libraries: scan them, drop them or summarize their findings "
+                        "(default: TPL_MODE setting)", choices=["scan", "drop", "summary"], default="")
+    parser.add_argument('--tpl-index', action='store_true', help="Build the third-party library index from the TPL metadata database")
     return parser.parse_args()
 
 
@@ -1,7 +1,9 @@
-from sources.common.common import processControl
+from sources.common.common import logger, processControl, log_
+from sources.common.ingest import file_digests
 import json
 
 import time
+import threading
 import re
 import os
 from os.path import isdir
@@ -9,6 +11,7 @@ import hashlib
 import zipfile
 from pathlib import Path
 import shutil
+from fnmatch import fnmatch
 from urllib.parse import urlparse
 import socket
 from concurrent.futures import (
@@ -19,6 +22,7 @@ from sources.entropy import (
     get_entropies,
 )
 import subprocess
+import tempfile
 import io
 import ntpath
 
@@ -36,6 +40,8 @@ RESERVED_FILE_NAMES = [
     'META-INF/CERT.RSA',
     'META-INF/CERT.DSA',
     'classes.dex']
+# Read size of the entries that are only verified
+CHUNK_SIZE = 1024 * 1024
 
 def mkdir(dir_path):
     """
@@ -129,7 +135,7 @@ def hash_gen(checksum, app_path) -> tuple:
 
 
 
-def unzip(checksum, app_path, ext_path):
+def unzip(checksum, app_path, ext_path, patterns=None):
     """Unzip APK.
 
     Unzip a APK archive while handling encrypted files, reserved file conflicts,
@@ -140,19 +146,39 @@ def unzip(checksum, app_path, ext_path):
         checksum (str): The checksum of the file.
         app_path (str): Path to the ZIP archive.
         ext_path (str): Path to extract the files.
+        patterns (iterable, optional): fnmatch patterns of the entries to extract.
+            Other entries stay in the archive (see ApkFS in sources/apk_vfs.py). All entries
+            are extracted when None.
+
+    The integrity policy (setting ZIP_INTEGRITY) is applied in the same pass:
+    zipfile checks the local header and the CRC32 of every extracted entry,
+    with 'cd' the local headers of the other entries are checked too and with
+    'full' they are also read to check their CRC32. Entries failing the check
+    are logged.
 
     Returns:
-        list: A list of files extracted or an empty list if an error occurs.
+        list: A list of the files in the archive or an empty list if an error occurs.
     """
 
     files = []
     original_ext_path = ext_path
+    integrity = processControl.settings.get('ZIP_INTEGRITY', 'cd') if processControl.settings else 'cd'
     try:
+        start = time.perf_counter()
+        tasks = []
+        checks = []
         with zipfile.ZipFile(app_path, 'r') as zipptr:
             files = zipptr.namelist()
             for fileinfo in zipptr.infolist():
                 ext_path = original_ext_path
 
+                # Selective extraction, the other entries are only verified
+                if patterns is not None and not any(
+                        fnmatch(fileinfo.filename, p) for p in patterns):
+                    if integrity != 'off' and not fileinfo.flag_bits & 0x1:
+                        checks.append(fileinfo.filename)
+                    continue
+
                 # Skip encrypted files
                 if fileinfo.flag_bits & 0x1:
                     #msg = ('Skipping encrypted file '
@@ -187,19 +213,88 @@ def unzip(checksum, app_path, ext_path):
                     fileinfo.external_attr = (0o100644 << 16) | (
                         fileinfo.external_attr & 0xFFFF)
 
-                # Extract the file
-                try:
-                    zipptr.extract(file_path, ext_path)
-                except Exception as e:
-                    raise Exception(f'Failed to extract file: {file_path}')
-                    #logger.warning(
-                    #    'Failed to extract %s', sanitize_for_logging(file_path))
+                tasks.append((file_path, ext_path, fileinfo.file_size))
+
+        # Extract the files, zlib releases the GIL so the entries are
+        # inflated in parallel, each thread with its own ZipFile handle
+        workers = processControl.settings.get('EXTRACT_WORKERS', 4) if processControl.settings else 1
+        workers = min(workers, os.cpu_count() or 1)
+        broken = extract_entries(app_path, tasks, workers, checks, integrity == 'full')
+        elapsed = time.perf_counter() - start
+        size = sum(task[2] for task in tasks) / (1024 * 1024)
+        log_("info", logger, f'Extracted {len(tasks)} of {len(files)} entries, '
+                             f'{size:.2f} MB in {elapsed:.2f}s ({size / max(elapsed, 1e-6):.1f} MB/s)')
+        if broken:
+            log_("error", logger, f'{len(broken)} APK entries failed the {integrity} integrity check: '
+                                  f'{", ".join(broken[:10])}')
     except Exception as exp:
+        log_("error", logger, f'Failed to extract the APK: {exp}')
         files = []
 
     return files
 
 
+def extract_entries(app_path, tasks, workers, checks=(), check_crc=False):
+    """
+    Extract (file_path, ext_path, size) entries of a ZIP archive on a thread pool.
+
+    The entries named in checks are not extracted, only their local header is
+    checked, and their CRC32 if check_crc. Returns the entries failing the check.
+    """
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def get_zipptr():
+        zipptr = getattr(local, 'zipptr', None)
+        if zipptr is None:
+            zipptr = local.zipptr = zipfile.ZipFile(app_path, 'r')
+            with handles_lock:
+                handles.append(zipptr)
+        return zipptr
+
+    def extract(task):
+        file_path, ext_path, _ = task
+        zipptr = get_zipptr()
+        try:
+            try:
+                zipptr.extract(file_path, ext_path)
+            except FileExistsError:
+                # Another thread created the same parent directory
+                zipptr.extract(file_path, ext_path)
+        except Exception as e:
+            raise Exception(f'Failed to extract file: {file_path}')
+            #logger.warning(
+            #    'Failed to extract %s', sanitize_for_logging(file_path))
+
+    def check(name):
+        # zipfile checks the local header on open and the CRC32 at EOF
+        try:
+            with get_zipptr().open(name) as entry:
+                while check_crc and entry.read(CHUNK_SIZE):
+                    pass
+        except Exception:
+            return name
+        return None
+
+    try:
+        if workers <= 1 or len(tasks) + len(checks) <= 1:
+            for task in tasks:
+                extract(task)
+            results = [check(name) for name in checks]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                extracted = executor.map(extract, tasks)
+                checked = executor.map(check, checks)
+                # list() propagates the first extraction error
+                list(extracted)
+                results = list(checked)
+    finally:
+        for zipptr in handles:
+            zipptr.close()
+    return [name for name in results if name]
+
+
 def is_reserved_file_conflict(file_path):
     """Check for reserved file conflict."""
     if any(file_path.startswith(i) and file_path != i for i in RESERVED_FILE_NAMES):
@@ -218,9 +313,32 @@ def is_path_traversal(user_input):
         return True
     return False
 
+def atomic_write(path, data, mode=None):
+    """
+    Write data (str or bytes) to path through a temporary file in the same
+    directory and a rename, so that concurrent readers never see a partial
+    file. The temporary file is removed if the write fails. mode is the
+    permission of the file, mkstemp creates it as 0600.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data.encode('utf-8') if isinstance(data, str) else data)
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
 def getChecksum(filePath):
-    apk_data = open(filePath, 'rb').read()  # Lee el archivo APK
-    return hashlib.sha256(apk_data).hexdigest()
+    # SHA-256 del APK, calculado una sola vez por fichero (ver common/ingest.py)
+    return file_digests(filePath)['sha256']
 
 def find_aapt(tool_name):
     """Find the specified tool (aapt or aapt2)."""
@@ -339,18 +457,25 @@ def gen_sha256_hash(msg):
     return hash_object.hexdigest()
 
 def strings_util(filename, minimum=6):
-    """Print out all connected series of readable chars longer than minimum."""
-    with io.open(filename, mode='rb') as f:
+    """Print out all connected series of readable chars longer than minimum.
+
+    `filename` may also be the raw bytes of the binary.
+    """
+    if isinstance(filename, bytes):
+        data = filename
+    else:
+        with io.open(filename, mode='rb') as f:
+            data = f.read()
+    result = ''
+    for c in data.decode('utf-8', 'ignore'):
+        if c in ('0123456789abcdefghijklmnopqrs'
+                 'tuvwxyzABCDEFGHIJKLMNOPQRSTUV'
+                 'WXYZ!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~ '):
+            result += c
+            continue
+        if len(result) >= minimum and result[0].isalnum():
+            yield '\'' + result + '\''
         result = ''
-        for c in f.read().decode('utf-8', 'ignore'):
-            if c in ('0123456789abcdefghijklmnopqrs'
-                     'tuvwxyzABCDEFGHIJKLMNOPQRSTUV'
-                     'WXYZ!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~ '):
-                result += c
-                continue
-            if len(result) >= minimum and result[0].isalnum():
-                yield '\'' + result + '\''
-            result = ''
 
 
 def get_os_strings(filename):
@@ -358,14 +483,18 @@ def get_os_strings(filename):
         strings_bin = shutil.which('strings')
         if not strings_bin:
             return None
-        strings = subprocess.check_output([strings_bin, filename])
+        if isinstance(filename, bytes):
+            # Raw binary, read by strings from stdin
+            strings = subprocess.check_output([strings_bin], input=filename)
+        else:
+            strings = subprocess.check_output([strings_bin, filename])
         return strings.decode('utf-8', 'ignore').splitlines()
     except Exception:
         return None
 
 
 def strings_on_binary(bin_path):
-    """Extract strings from binary."""
+    """Extract strings from binary, given its path or its raw bytes."""
     try:
         strings = get_os_strings(bin_path)
         if strings:
@@ -495,8 +624,8 @@ def is_secret_key(key):
     endswith_str = any(key_lower.endswith(i) for i in endswith)
     return (endswith_str or contains_str) and not not_contains_str
 
-def strings_and_entropies(checksum, src, exts):
-    """Get Strings and Entropies."""
+def strings_and_entropies(checksum, src, exts, skip=None):
+    """Get Strings and Entropies, skip tells the files to leave out."""
     msg = 'Extracting String values and entropies from Code'
     #logger.info(msg)
     #append_scan_status(checksum, msg)
@@ -512,6 +641,8 @@ def strings_and_entropies(checksum, src, exts):
         for p in src.rglob('*'):
             if p.suffix not in exts or not p.exists():
                 continue
+            if skip and skip(p):
+                continue
             matches = STRINGS_REGEX.finditer(
                 p.read_text(encoding='utf-8', errors='ignore'),
                 re.MULTILINE)
@@ -169,6 +169,7 @@ def get_context_from_analysis(app_dic,
             'secrets': code_an_dic['secrets'],
             'logs': get_scan_logs(app_dic['md5']),
             'sbom': code_an_dic['sbom'],
+            'tpl_analysis': code_an_dic.get('tpl', {}),
         }
         return context
     except Exception as exp:
@@ -235,6 +236,7 @@ def save_or_update(update_type,
             'network_security': man_an_dic['network_security'],
             'secrets': code_an_dic['secrets'],
             'sbom': code_an_dic['sbom'],
+            'tpl_analysis': code_an_dic.get('tpl', {}),
 
         }
         if not processControl.args.result:
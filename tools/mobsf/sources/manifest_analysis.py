@@ -9,6 +9,11 @@ from sources import (
 from sources import (
     network_security,
 )
+from sources.manifest_utils import (
+    CATEGORY_QUERY,
+    DATA_QUERY,
+    MANIFEST_QUERIES,
+)
 from concurrent.futures import ThreadPoolExecutor
 
 """
@@ -143,30 +148,30 @@ def get_browsable_activities(node, ns):
         path_patterns = []
         well_known = {}
         well_known_path = '/.well-known/assetlinks.json'
-        catg = node.getElementsByTagName('category')
+        catg = CATEGORY_QUERY(node)
         for cat in catg:
-            if cat.getAttribute(f'{ns}:name') == 'android.intent.category.BROWSABLE':
-                data_tag = node.getElementsByTagName('data')
+            if cat.get(f'{ns}name', '') == 'android.intent.category.BROWSABLE':
+                data_tag = DATA_QUERY(node)
                 for data in data_tag:
-                    scheme = data.getAttribute(f'{ns}:scheme')
+                    scheme = data.get(f'{ns}scheme', '')
                     if scheme and scheme not in schemes:
                         schemes.append(scheme)
-                    mime = data.getAttribute(f'{ns}:mimeType')
+                    mime = data.get(f'{ns}mimeType', '')
                     if mime and mime not in mime_types:
                         mime_types.append(mime)
-                    host = data.getAttribute(f'{ns}:host')
+                    host = data.get(f'{ns}host', '')
                     if host and host not in hosts:
                         hosts.append(host)
-                    port = data.getAttribute(f'{ns}:port')
+                    port = data.get(f'{ns}port', '')
                     if port and port not in ports:
                         ports.append(port)
-                    path = data.getAttribute(f'{ns}:path')
+                    path = data.get(f'{ns}path', '')
                     if path and path not in paths:
                         paths.append(path)
-                    path_prefix = data.getAttribute(f'{ns}:pathPrefix')
+                    path_prefix = data.get(f'{ns}pathPrefix', '')
                     if path_prefix and path_prefix not in path_prefixs:
                         path_prefixs.append(path_prefix)
-                    path_pattern = data.getAttribute(f'{ns}:pathPattern')
+                    path_pattern = data.get(f'{ns}pathPattern', '')
                     if path_pattern and path_pattern not in path_patterns:
                         path_patterns.append(path_pattern)
                     # Collect possible well-known paths
@@ -212,13 +217,12 @@ def manifest_analysis(app_dic, man_data_dic):
         #append_scan_status(checksum, msg)
         log_("info", logger, msg)
         exp_count = dict.fromkeys(['act', 'ser', 'bro', 'cnt'], 0)
-        applications = mfxml.getElementsByTagName('application')
-        data_tag = mfxml.getElementsByTagName('data')
-        intents = mfxml.getElementsByTagName('intent-filter')
-        actions = mfxml.getElementsByTagName('action')
-        granturipermissions = mfxml.getElementsByTagName(
-            'grant-uri-permission')
-        permissions = mfxml.getElementsByTagName('permission')
+        applications = MANIFEST_QUERIES['application'](mfxml)
+        data_tag = MANIFEST_QUERIES['data'](mfxml)
+        intents = MANIFEST_QUERIES['intent-filter'](mfxml)
+        actions = MANIFEST_QUERIES['action'](mfxml)
+        granturipermissions = MANIFEST_QUERIES['grant-uri-permission'](mfxml)
+        permissions = MANIFEST_QUERIES['permission'](mfxml)
         ret_value = []
         ret_list = []
         exported = []
@@ -228,9 +232,8 @@ def manifest_analysis(app_dic, man_data_dic):
         debuggable = False
         # PERMISSION
         for permission in permissions:
-            if permission.getAttribute(f'{ns}:protectionLevel'):
-                protectionlevel = permission.getAttribute(
-                    f'{ns}:protectionLevel')
+            if permission.get(f'{ns}protectionLevel', ''):
+                protectionlevel = permission.get(f'{ns}protectionLevel', '')
                 if protectionlevel == '0x00000000':
                     protectionlevel = 'normal'
                 elif protectionlevel == '0x00000001':
@@ -240,11 +243,9 @@ def manifest_analysis(app_dic, man_data_dic):
                 elif protectionlevel == '0x00000003':
                     protectionlevel = 'signatureOrSystem'
 
-                permission_dict[permission.getAttribute(
-                    f'{ns}:name')] = protectionlevel
-            elif permission.getAttribute(f'{ns}:name'):
-                permission_dict[permission.getAttribute(
-                    f'{ns}:name')] = 'normal'
+                permission_dict[permission.get(f'{ns}name', '')] = protectionlevel
+            elif permission.get(f'{ns}name', ''):
+                permission_dict[permission.get(f'{ns}name', '')] = 'normal'
         # GENERAL
         if man_data_dic['min_sdk'] and int(man_data_dic['min_sdk']) < ANDROID_8_0_LEVEL:
             minsdk = man_data_dic.get('min_sdk')
@@ -260,50 +261,49 @@ def manifest_analysis(app_dic, man_data_dic):
         for application in applications:
             # Esteve 23.07.2016 - begin - identify permission at the
             # application level
-            if application.getAttribute(f'{ns}:permission'):
+            if application.get(f'{ns}permission', ''):
                 perm_appl_level_exists = True
-                perm_appl_level = application.getAttribute(
-                    f'{ns}:permission')
+                perm_appl_level = application.get(f'{ns}permission', '')
             else:
                 perm_appl_level_exists = False
             # End
-            if application.getAttribute(f'{ns}:usesCleartextTraffic') == 'true':
+            if application.get(f'{ns}usesCleartextTraffic', '') == 'true':
                 ret_list.append(('clear_text_traffic', (), ()))
-            if application.getAttribute(f'{ns}:directBootAware') == 'true':
+            if application.get(f'{ns}directBootAware', '') == 'true':
                 ret_list.append(('direct_boot_aware', (), ()))
-            if application.getAttribute(f'{ns}:networkSecurityConfig'):
-                item = application.getAttribute(f'{ns}:networkSecurityConfig')
+            if application.get(f'{ns}networkSecurityConfig', ''):
+                item = application.get(f'{ns}networkSecurityConfig', '')
                 ret_list.append(('has_network_security', (item,), ()))
                 do_netsec = item
-            if application.getAttribute(f'{ns}:debuggable') == 'true':
+            if application.get(f'{ns}debuggable', '') == 'true':
                 ret_list.append(('app_is_debuggable', (), ()))
                 debuggable = True
-            if application.getAttribute(f'{ns}:allowBackup') == 'true':
+            if application.get(f'{ns}allowBackup', '') == 'true':
                 ret_list.append(('app_allowbackup', (), ()))
-            elif application.getAttribute(f'{ns}:allowBackup') == 'false':
+            elif application.get(f'{ns}allowBackup', '') == 'false':
                 backupDisabled = True
             else:
                 if not backupDisabled:
                     ret_list.append(('allowbackup_not_set', (), ()))
-            if application.getAttribute(f'{ns}:testOnly') == 'true':
+            if application.get(f'{ns}testOnly', '') == 'true':
                 ret_list.append(('app_in_test_mode', (), ()))
-            for node in application.childNodes:
+            for node in application:
                 an_or_a = ''
-                if node.nodeName == 'activity':
+                if node.tag == 'activity':
                     itemname = 'Activity'
                     cnt_id = 'act'
                     an_or_a = 'n'
-                elif node.nodeName == 'activity-alias':
+                elif node.tag == 'activity-alias':
                     itemname = 'Activity-Alias'
                     cnt_id = 'act'
                     an_or_a = 'n'
-                elif node.nodeName == 'provider':
+                elif node.tag == 'provider':
                     itemname = 'Content Provider'
                     cnt_id = 'cnt'
-                elif node.nodeName == 'receiver':
+                elif node.tag == 'receiver':
                     itemname = 'Broadcast Receiver'
                     cnt_id = 'bro'
-                elif node.nodeName == 'service':
+                elif node.tag == 'service':
                     itemname = 'Service'
                     cnt_id = 'ser'
                 else:
@@ -311,12 +311,11 @@ def manifest_analysis(app_dic, man_data_dic):
                 item = ''
                 # Checks for Activities
                 if itemname in ['Activity', 'Activity-Alias']:
-                    item = node.getAttribute(f'{ns}:name')
+                    item = node.get(f'{ns}name', '')
                     # Browsable Activities
                     browse_dic = get_browsable_activities(node, ns)
                     if browse_dic['browsable']:
-                        browsable_activities[node.getAttribute(
-                            f'{ns}:name')] = browse_dic
+                        browsable_activities[node.get(f'{ns}name', '')] = browse_dic
                     for finding in assetlinks_check(item, browse_dic['well_known']):
                         if not finding['status']:
                             ret_list.append(('well_known_assetlinks',
@@ -325,7 +324,7 @@ def manifest_analysis(app_dic, man_data_dic):
                                              finding['status_code'])))
 
                     # Task Affinity
-                    task_affinity = node.getAttribute(f'{ns}:taskAffinity')
+                    task_affinity = node.get(f'{ns}taskAffinity', '')
                     if (task_affinity):
                         ret_list.append(('task_affinity_set', (item,), ()))
 
@@ -336,7 +335,7 @@ def manifest_analysis(app_dic, man_data_dic):
                     except Exception:
                         # in case min_sdk is not defined we assume vulnerability
                         affected_sdk = True
-                    launchmode = node.getAttribute(f'{ns}:launchMode')
+                    launchmode = node.get(f'{ns}launchMode', '')
                     modes = ('singleTask', 'singleInstance')
                     if (affected_sdk
                             and launchmode in modes):
@@ -355,7 +354,7 @@ def manifest_analysis(app_dic, man_data_dic):
                         ret_list.append(('task_hijacking', (item,), (target_sdk,)))
 
                     # Android StrandHogg 2.0
-                    exported_act = node.getAttribute(f'{ns}:exported')
+                    exported_act = node.get(f'{ns}exported', '')
                     if (target_sdk < ANDROID_10_0_LEVEL
                             and exported_act == 'true'
                             and (launchmode != 'singleInstance' or task_affinity != '')):
@@ -372,20 +371,20 @@ def manifest_analysis(app_dic, man_data_dic):
                 protlevel = ''
                 # End
                 if itemname != 'NIL':
-                    if node.getAttribute(f'{ns}:exported') == 'true':
+                    if node.get(f'{ns}exported', '') == 'true':
                         perm = ''
-                        item = node.getAttribute(f'{ns}:name')
-                        if node.getAttribute(f'{ns}:permission'):
+                        item = node.get(f'{ns}name', '')
+                        if node.get(f'{ns}permission', ''):
                             # permission exists
                             perm = ('<strong>Permission: </strong>'
-                                    + node.getAttribute(f'{ns}:permission'))
+                                    + node.get(f'{ns}permission', ''))
                             is_perm_exist = True
                         if item != man_data_dic['mainactivity']:
                             if is_perm_exist:
                                 prot = ''
-                                if node.getAttribute(f'{ns}:permission') in permission_dict:
+                                if node.get(f'{ns}permission', '') in permission_dict:
                                     prot = ('</br><strong>protectionLevel: </strong>'
-                                            + permission_dict[node.getAttribute(f'{ns}:permission')])
+                                            + permission_dict[node.get(f'{ns}permission', '')])
                                     # Esteve 23.07.2016 - begin - take into account protection level of the permission when claiming that a component is protected by it;
                                     # - the permission might not be defined in the application being analysed, if so, the protection level is not known;
                                     # - activities (or activity-alias) that are exported and have an unknown or normal or dangerous protection level are
@@ -393,7 +392,7 @@ def manifest_analysis(app_dic, man_data_dic):
                                     # counted as exported.
                                     prot_level_exist = True
                                     protlevel = permission_dict[
-                                        node.getAttribute(f'{ns}:permission')]
+                                        node.get(f'{ns}permission', '')]
                                 if prot_level_exist:
                                     if protlevel == 'normal':
                                         ret_list.append(
@@ -478,27 +477,27 @@ def manifest_analysis(app_dic, man_data_dic):
                                             cnt_id] + 1
                                 # Esteve 24.07.2016 - end
 
-                    elif node.getAttribute(f'{ns}:exported') != 'false':
+                    elif node.get(f'{ns}exported', '') != 'false':
                         # Check for Implicitly Exported
                         # Logic to support intent-filter
-                        intentfilters = node.childNodes
+                        intentfilters = node
                         for i in intentfilters:
-                            inf = i.nodeName
+                            inf = i.tag
                             if inf == 'intent-filter':
                                 is_inf = True
                         if is_inf:
-                            item = node.getAttribute(f'{ns}:name')
-                            if node.getAttribute(f'{ns}:permission'):
+                            item = node.get(f'{ns}name', '')
+                            if node.get(f'{ns}permission', ''):
                                 # permission exists
                                 perm = ('<strong>Permission: </strong>'
-                                        + node.getAttribute(f'{ns}:permission'))
+                                        + node.get(f'{ns}permission', ''))
                                 is_perm_exist = True
                             if item != man_data_dic['mainactivity']:
                                 if is_perm_exist:
                                     prot = ''
-                                    if node.getAttribute(f'{ns}:permission') in permission_dict:
+                                    if node.get(f'{ns}permission', '') in permission_dict:
                                         prot = ('</br><strong>protectionLevel: </strong>'
-                                                + permission_dict[node.getAttribute(f'{ns}:permission')])
+                                                + permission_dict[node.get(f'{ns}permission', '')])
                                         # Esteve 24.07.2016 - begin - take into account protection level of the permission when claiming that a component is protected by it;
                                         # - the permission might not be defined in the application being analysed, if so, the protection level is not known;
                                         # - activities (or activity-alias) that are exported and have an unknown or normal or dangerous protection level are
@@ -506,7 +505,7 @@ def manifest_analysis(app_dic, man_data_dic):
                                         #  counted as exported.
                                         prot_level_exist = True
                                         protlevel = permission_dict[
-                                            node.getAttribute(f'{ns}:permission')]
+                                            node.get(f'{ns}permission', '')]
                                         if prot_level_exist:
                                             if protlevel == 'normal':
                                                 ret_list.append(
@@ -602,20 +601,20 @@ def manifest_analysis(app_dic, man_data_dic):
                             if man_data_dic['min_sdk'] and man_data_dic['target_sdk'] and int(man_data_dic['min_sdk']) < ANDROID_4_2_LEVEL:
                                 if itemname == 'Content Provider' and int(man_data_dic['target_sdk']) < ANDROID_4_2_LEVEL:
                                     perm = ''
-                                    item = node.getAttribute(f'{ns}:name')
-                                    if node.getAttribute(f'{ns}:permission'):
+                                    item = node.get(f'{ns}name', '')
+                                    if node.get(f'{ns}permission', ''):
                                         # permission exists
                                         perm = ('<strong>Permission: </strong>'
-                                                + node.getAttribute(f'{ns}:permission'))
+                                                + node.get(f'{ns}permission', ''))
                                         is_perm_exist = True
                                     if is_perm_exist:
                                         prot = ''
-                                        if node.getAttribute(f'{ns}:permission') in permission_dict:
+                                        if node.get(f'{ns}permission', '') in permission_dict:
                                             prot = ('</br><strong>protectionLevel: </strong>'
-                                                    + permission_dict[node.getAttribute(f'{ns}:permission')])
+                                                    + permission_dict[node.get(f'{ns}permission', '')])
                                             prot_level_exist = True
                                             protlevel = permission_dict[
-                                                node.getAttribute(f'{ns}:permission')]
+                                                node.get(f'{ns}permission', '')]
                                         if prot_level_exist:
                                             if protlevel == 'normal':
                                                 ret_list.append(
@@ -682,21 +681,20 @@ def manifest_analysis(app_dic, man_data_dic):
                                 else:
                                     if itemname == 'Content Provider' and int(man_data_dic['target_sdk']) >= 17:
                                         perm = ''
-                                        item = node.getAttribute(
-                                            f'{ns}:name')
-                                        if node.getAttribute(f'{ns}:permission'):
+                                        item = node.get(f'{ns}name', '')
+                                        if node.get(f'{ns}permission', ''):
                                             # permission exists
                                             perm = ('<strong>Permission: </strong>'
-                                                    + node.getAttribute(f'{ns}:permission'))
+                                                    + node.get(f'{ns}permission', ''))
                                             is_perm_exist = True
                                         if is_perm_exist:
                                             prot = ''
-                                            if node.getAttribute(f'{ns}:permission') in permission_dict:
+                                            if node.get(f'{ns}permission', '') in permission_dict:
                                                 prot = ('</br><strong>protectionLevel: </strong>'
-                                                        + permission_dict[node.getAttribute(f'{ns}:permission')])
+                                                        + permission_dict[node.get(f'{ns}permission', '')])
                                                 prot_level_exist = True
                                                 protlevel = permission_dict[
-                                                    node.getAttribute(f'{ns}:permission')]
+                                                    node.get(f'{ns}permission', '')]
                                             if prot_level_exist:
                                                 if protlevel == 'normal':
                                                     ret_list.append(
@@ -760,27 +758,27 @@ def manifest_analysis(app_dic, man_data_dic):
 
         # GRANT-URI-PERMISSIONS
         for granturi in granturipermissions:
-            if granturi.getAttribute(f'{ns}:pathPrefix') == '/':
+            if granturi.get(f'{ns}pathPrefix', '') == '/':
                 ret_list.append(
                     ('improper_provider_permission', ('pathPrefix=/',), ()))
-            elif granturi.getAttribute(f'{ns}:path') == '/':
+            elif granturi.get(f'{ns}path', '') == '/':
                 ret_list.append(('improper_provider_permission', ('path=/',), ()))
-            elif granturi.getAttribute(f'{ns}:pathPattern') == '*':
+            elif granturi.get(f'{ns}pathPattern', '') == '*':
                 ret_list.append(('improper_provider_permission', ('path=*',), ()))
         # DATA
         for data in data_tag:
-            if data.getAttribute(f'{ns}:scheme') == 'android_secret_code':
-                xmlhost = data.getAttribute(f'{ns}:host')
+            if data.get(f'{ns}scheme', '') == 'android_secret_code':
+                xmlhost = data.get(f'{ns}host', '')
                 ret_list.append(('dialer_code_found', (xmlhost,), ()))
 
-            elif data.getAttribute(f'{ns}:port'):
-                dataport = data.getAttribute(f'{ns}:port')
+            elif data.get(f'{ns}port', ''):
+                dataport = data.get(f'{ns}port', '')
                 ret_list.append(('sms_receiver_port_found', (dataport,), ()))
         # INTENTS
         processed_priorities = {}
         for intent in intents:
-            if intent.getAttribute(f'{ns}:priority').isdigit():
-                value = intent.getAttribute(f'{ns}:priority')
+            if intent.get(f'{ns}priority', '').isdigit():
+                value = intent.get(f'{ns}priority', '')
                 if int(value) > 100:
                     if value not in processed_priorities:
                         processed_priorities[value] = 1
@@ -791,8 +789,8 @@ def manifest_analysis(app_dic, man_data_dic):
                 ('high_intent_priority_found', (priority, count,), ()))
         # ACTIONS
         for action in actions:
-            if action.getAttribute(f'{ns}:priority').isdigit():
-                value = action.getAttribute(f'{ns}:priority')
+            if action.get(f'{ns}priority', '').isdigit():
+                value = action.get(f'{ns}priority', '')
                 if int(value) > 100:
                     ret_list.append(
                         ('high_action_priority_found', (value,), ()))
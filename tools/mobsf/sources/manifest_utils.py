@@ -1,15 +1,17 @@
 # -*- coding: utf_8 -*-
 """Android manifest analysis utils."""
 from sources.common.common import logger, log_
-import re
+import copy
 from pathlib import Path
 
-from defusedxml.minidom import parseString
+from lxml import etree
 from sources.dvm_permissions import DVM_PERMISSIONS
 from sources.converter import (
     run_apktool,
 )
 from bs4 import BeautifulSoup
+from tools.androguard4.apk import NS_ANDROID, NS_ANDROID_URI
+from sources.axml_decode import RESOURCE_ID_REGEX
 """
 from bs4 import BeautifulSoup
 
@@ -33,6 +35,100 @@ ANDROID_5_0_LEVEL = 21
 ANDROID_8_0_LEVEL = 26
 ANDROID_MANIFEST_FILE = 'AndroidManifest.xml'
 
+# Manifest files are parsed without entities or network access
+XML_PARSER = etree.XMLParser(resolve_entities=False, no_network=True)
+
+# Precompiled queries over the manifest tree, shared by
+# extract_manifest_data() and manifest_analysis()
+MANIFEST_QUERIES = {
+    tag: etree.XPath(f'//{tag}') for tag in (
+        'manifest',
+        'application',
+        'uses-permission',
+        'uses-permission-sdk-23',
+        'permission',
+        'activity',
+        'service',
+        'provider',
+        'receiver',
+        'uses-library',
+        'uses-sdk',
+        'category',
+        'intent-filter',
+        'action',
+        'data',
+        'grant-uri-permission',
+    )
+}
+# Queries below a component
+ACTION_QUERY = etree.XPath('.//action')
+CATEGORY_QUERY = etree.XPath('.//category')
+DATA_QUERY = etree.XPath('.//data')
+
+# Names of the enum and flag values of the manifest attributes, from the
+# framework attrs_manifest.xml. androguard leaves them as integers, the
+# analysis expects them decoded by name as apktool does
+MANIFEST_ENUMS = {
+    'launchMode': {
+        0: 'standard', 1: 'singleTop', 2: 'singleTask',
+        3: 'singleInstance', 4: 'singleInstancePerTask'},
+    'screenOrientation': {
+        -1: 'unspecified', 0: 'landscape', 1: 'portrait', 2: 'user',
+        3: 'behind', 4: 'sensor', 5: 'nosensor', 6: 'sensorLandscape',
+        7: 'sensorPortrait', 8: 'reverseLandscape', 9: 'reversePortrait',
+        10: 'fullSensor', 11: 'userLandscape', 12: 'userPortrait',
+        13: 'fullUser', 14: 'locked'},
+    'installLocation': {0: 'auto', 1: 'internalOnly', 2: 'preferExternal'},
+    'documentLaunchMode': {
+        0: 'none', 1: 'intoExisting', 2: 'always', 3: 'never'},
+    'persistableMode': {
+        0: 'persistRootOnly', 1: 'persistNever', 2: 'persistAcrossReboots'},
+    'lockTaskMode': {
+        0: 'normal', 1: 'never', 2: 'always', 3: 'if_whitelisted'},
+    'uiOptions': {0: 'none', 1: 'splitActionBarWhenNarrow'},
+    'colorMode': {0: 'default', 1: 'wideColorGamut', 2: 'hdr'},
+    'gwpAsanMode': {-1: 'default', 0: 'never', 1: 'always'},
+    'memtagMode': {-1: 'default', 0: 'off', 1: 'async', 2: 'sync'},
+}
+MANIFEST_FLAGS = {
+    'protectionLevel': (
+        ('normal', 0x0), ('dangerous', 0x1), ('signature', 0x2),
+        ('signatureOrSystem', 0x3), ('internal', 0x4),
+        ('privileged', 0x10), ('system', 0x10), ('development', 0x20),
+        ('appop', 0x40), ('pre23', 0x80), ('installer', 0x100),
+        ('verifier', 0x200), ('preinstalled', 0x400), ('setup', 0x800),
+        ('instant', 0x1000), ('ephemeral', 0x1000), ('runtime', 0x2000),
+        ('oem', 0x4000), ('vendorPrivileged', 0x8000),
+        ('textClassifier', 0x10000), ('wellbeing', 0x20000),
+        ('documenter', 0x40000), ('configurator', 0x80000),
+        ('incidentReportApprover', 0x100000), ('appPredictor', 0x200000),
+        ('module', 0x400000), ('companion', 0x800000),
+        ('retailDemo', 0x1000000), ('recents', 0x2000000),
+        ('role', 0x4000000), ('knownSigner', 0x8000000)),
+    'configChanges': (
+        ('mcc', 0x1), ('mnc', 0x2), ('locale', 0x4), ('touchscreen', 0x8),
+        ('keyboard', 0x10), ('keyboardHidden', 0x20), ('navigation', 0x40),
+        ('orientation', 0x80), ('screenLayout', 0x100), ('uiMode', 0x200),
+        ('screenSize', 0x400), ('smallestScreenSize', 0x800),
+        ('density', 0x1000), ('layoutDirection', 0x2000),
+        ('colorMode', 0x4000), ('grammaticalGender', 0x8000),
+        ('fontWeightAdjustment', 0x10000000), ('fontScale', 0x40000000)),
+    'windowSoftInputMode': (
+        ('stateUnspecified', 0x0), ('stateUnchanged', 0x1),
+        ('stateHidden', 0x2), ('stateAlwaysHidden', 0x3),
+        ('stateVisible', 0x4), ('stateAlwaysVisible', 0x5),
+        ('adjustUnspecified', 0x0), ('adjustResize', 0x10),
+        ('adjustPan', 0x20), ('adjustNothing', 0x30)),
+    'foregroundServiceType': (
+        ('dataSync', 0x1), ('mediaPlayback', 0x2), ('phoneCall', 0x4),
+        ('location', 0x8), ('connectedDevice', 0x10),
+        ('mediaProjection', 0x20), ('camera', 0x40), ('microphone', 0x80),
+        ('health', 0x100), ('remoteMessaging', 0x200),
+        ('systemExempted', 0x400), ('shortService', 0x800),
+        ('fileManagement', 0x1000), ('mediaProcessing', 0x2000),
+        ('specialUse', 0x40000000)),
+}
+
 
 def get_manifest_file(app_dic):
     """Get AndroidManifest.xml file path.
@@ -46,7 +142,6 @@ def get_manifest_file(app_dic):
         tools_dir = Path(app_dic['tools_dir'])
         typ = app_dic['zipped']
         checksum = app_dic['md5']
-        androguard_xml = app_dic.get('androguard_manifest_xml')
 
         if typ == 'aar':
             logger.info('Getting AndroidManifest.xml from AAR')
@@ -61,6 +156,7 @@ def get_manifest_file(app_dic):
             manifest.parent.mkdir(parents=True, exist_ok=True)
             run_apktool(app_path, app_dir, tools_dir)
 
+            androguard_xml = get_androguard_manifest_xml(app_dic)
             if not manifest.exists() and androguard_xml:
                 logger.warning(
                     'apktool failed to extract AndroidManifest.xml,'
@@ -88,32 +184,138 @@ def get_manifest_file(app_dic):
     return manifest
 
 
-def get_xml_namespace(xml_str):
-    """Get namespace."""
-    match = re.search(r'manifest (.{1,250}?):', xml_str)
-    if not match:
-        logger.warning('XML namespace not found')
+def decode_flags(value, flags):
+    """Name the flags of a value as apktool, None if some bits have no name."""
+    if value == 0:
+        return '|'.join(name for name, flag in flags if flag == 0) or None
+    names = []
+    used = 0
+    # Flags of several bits first, a flag already covered is skipped
+    for name, flag in sorted(flags, key=lambda item: -bin(item[1]).count('1')):
+        if flag and value & flag == flag and used & flag != flag:
+            names.append(name)
+            used |= flag
+    return '|'.join(names) if used == value else None
+
+
+def decode_attribute(name, value, resolve_reference):
+    """Decode an android attribute value of the androguard tree."""
+    match = RESOURCE_ID_REGEX.fullmatch(value)
+    if match:
+        return resolve_reference(match.group(1)) or value
+    if name in MANIFEST_ENUMS or name in MANIFEST_FLAGS:
+        try:
+            number = int(value, 0)
+        except ValueError:
+            # Already a name
+            return value
+        if name in MANIFEST_ENUMS:
+            return MANIFEST_ENUMS[name].get(number, value)
+        return decode_flags(number, MANIFEST_FLAGS[name]) or value
+    return value
+
+
+def decode_manifest(root, rsrc=None):
+    """
+    Return a copy of the androguard manifest tree with the values as apktool
+    writes them: enum and flag attributes by name and references to the app
+    resources as @type/name.
+    """
+    root = copy.deepcopy(root)
+    package = None
+    if rsrc:
+        try:
+            package = rsrc.get_packages_names()[0]
+        except Exception:
+            logger.exception('Reading the resources package')
+    names = {}
+
+    def resolve_reference(rid):
+        if rid not in names:
+            names[rid] = None
+            if package:
+                try:
+                    names[rid] = rsrc.get_resource_xml_name(int(rid, 16), package)
+                except Exception:
+                    pass
+        return names[rid]
+
+    prefix = get_xml_namespace(root)
+    for node in root.iter():
+        for key, value in node.attrib.items():
+            if key.startswith(prefix):
+                decoded = decode_attribute(key[len(prefix):], value, resolve_reference)
+                if decoded != value:
+                    node.set(key, decoded)
+    return root
+
+
+def get_androguard_manifest(app_dic):
+    """Get the androguard manifest lxml tree with decoded values, None if missing."""
+    if 'androguard_manifest' in app_dic:
+        return app_dic['androguard_manifest']
+    a = app_dic.get('androguard_apk')
+    if not a:
         return None
+    root = a.get_android_manifest_xml()
+    if root is not None:
+        try:
+            rsrc = a.get_android_resources()
+        except Exception:
+            logger.exception('Parsing resources to decode AndroidManifest.xml')
+            rsrc = None
+        root = decode_manifest(root, rsrc)
+    app_dic['androguard_manifest'] = root
+    return root
 
-    namespace = match.group(1)
 
-    # Handle standard and non-standard namespaces
-    if namespace == 'xmlns':
-        namespace = 'android'
-    elif namespace != 'android':
-        logger.warning('Non-standard XML namespace: %s', namespace)
+def get_androguard_manifest_xml(app_dic):
+    """Serialize the androguard manifest tree, None if missing."""
+    try:
+        root = get_androguard_manifest(app_dic)
+        if root is not None:
+            return etree.tostring(root, encoding='utf-8', pretty_print=True)
+    except Exception:
+        logger.exception('Serializing androguard AndroidManifest.xml')
+    return None
 
-    return namespace
+
+def get_xml_namespace(root):
+    """Get the namespace of the android attributes, as an lxml {uri} prefix."""
+    uri = root.nsmap.get('android')
+    if not uri:
+        uris = [i for i in root.nsmap.values() if i]
+        if NS_ANDROID_URI in uris:
+            uri = NS_ANDROID_URI
+        elif uris:
+            # Handle non-standard namespaces
+            uri = uris[0]
+            logger.warning('Non-standard XML namespace: %s', uri)
+        else:
+            logger.warning('XML namespace not found')
+            return NS_ANDROID
+    return f'{{{uri}}}'
+
+
+def parse_xml(xml):
+    """Parse an XML manifest (bytes) with lxml."""
+    return etree.fromstring(xml, XML_PARSER)
 
 
 def get_fallback():
-    return parseString(
-        (r'<?xml version="1.0" encoding="utf-8"?><manifest xmlns:android='
-         r'"http://schemas.android.com/apk/res/android" '
-         r'android:versionCode="Failed"  '
-         r'android:versionName="Failed" package="Failed"  '
-         r'platformBuildVersionCode="Failed" '
-         r'platformBuildVersionName="Failed XML Parsing" ></manifest>'))
+    return parse_xml(
+        (b'<?xml version="1.0" encoding="utf-8"?><manifest xmlns:android='
+         b'"http://schemas.android.com/apk/res/android" '
+         b'android:versionCode="Failed"  '
+         b'android:versionName="Failed" package="Failed"  '
+         b'platformBuildVersionCode="Failed" '
+         b'platformBuildVersionName="Failed XML Parsing" ></manifest>'))
+
+
+def set_parsed_manifest(app_dic, root):
+    """Hand the manifest tree and its namespace to the analysis."""
+    app_dic['manifest_namespace'] = get_xml_namespace(root)
+    app_dic['manifest_parsed_xml'] = root
 
 
 def bs4_xml_parser(xml_str):
@@ -128,49 +330,43 @@ def bs4_xml_parser(xml_str):
 
 
 def get_parsed_manifest(app_dic):
-    """Get the parsed manifest XML, file path and namespace."""
+    """Get the parsed manifest XML, file path and namespace.
+
+    APKs use the lxml tree decoded by androguard, the manifest file is still
+    written for NIAP and the reports. The file is only parsed for source code,
+    AAR or if androguard failed.
+    """
     checksum = app_dic['md5']
-    parsed_xml = None
+    xml = None
     manifest_file = None
     app_dic['manifest_file'] = None
-    app_dic['manifest_namespace'] = 'android'
+    app_dic['manifest_namespace'] = NS_ANDROID
     app_dic['manifest_parsed_xml'] = get_fallback()
     try:
         manifest_file = get_manifest_file(app_dic)
+        app_dic['manifest_file'] = manifest_file
+        root = get_androguard_manifest(app_dic)
+        if root is not None:
+            set_parsed_manifest(app_dic, root)
+            return
         if not (manifest_file and manifest_file.exists()):
             logger.warning('APK AndroidManifest.xml file not found')
-            app_dic['manifest_file'] = manifest_file
             return
 
-        app_dic['manifest_file'] = manifest_file
         msg = 'Parsing AndroidManifest.xml'
         #logger.info(msg)
         #append_scan_status(checksum, msg)
         log_("info", logger, msg)
 
-        # Parse manifest XML
-        xml_str = manifest_file.read_text('utf-8', 'ignore')
-        app_dic['manifest_namespace'] = get_xml_namespace(xml_str)
         # apktool generated AndroidManifest.xml for APK
-        parsed_xml = parseString(xml_str)
-        app_dic['manifest_parsed_xml'] = parsed_xml
+        xml = manifest_file.read_bytes()
+        set_parsed_manifest(app_dic, parse_xml(xml))
         return
     except Exception:
+        log_("warning", logger, 'Failed parsing AndroidManifest.xml, fallback to bs4')
         try:
-            #logger.warning('Failed parsing AndroidManifest.xml, fallback to androguard')
-            log_("warning", logger, 'Failed parsing AndroidManifest.xml, fallback to androguard')
-            parsed_xml = parseString(app_dic['androguard_manifest_xml'])
-            # Overwrite the file with androguard generated XML
-            manifest_file.write_bytes(app_dic['androguard_manifest_xml'])
-            app_dic['manifest_parsed_xml'] = parsed_xml
-            return
-        except Exception:
-            logger.warning('Failed parsing androguard AndroidManifest.xml'
-                           ', fallback to bs4')
-            log_("warning", logger, 'Failed parsing androguard AndroidManifest.xml, fallback to bs4')
-        try:
-            parsed_xml = parseString(bs4_xml_parser(xml_str))
-            app_dic['manifest_parsed_xml'] = parsed_xml
+            xml_str = xml.decode('utf-8', 'ignore')
+            set_parsed_manifest(app_dic, parse_xml(bs4_xml_parser(xml_str)))
             return
         except Exception as exp:
             msg = 'Parsing AndroidManifest.xml using all methods'
@@ -208,83 +404,83 @@ def extract_manifest_data(app_dic):
         mainact = ''
         androidversioncode = ''
         androidversionname = ''
-        applications = mfxml.getElementsByTagName('application')
-        permissions = mfxml.getElementsByTagName('uses-permission')
-        permsdk23 = mfxml.getElementsByTagName('uses-permission-sdk-23')
+        applications = MANIFEST_QUERIES['application'](mfxml)
+        permissions = MANIFEST_QUERIES['uses-permission'](mfxml)
+        permsdk23 = MANIFEST_QUERIES['uses-permission-sdk-23'](mfxml)
         if permsdk23:
             permissions.extend(permsdk23)
-        manifest = mfxml.getElementsByTagName('manifest')
-        activities = mfxml.getElementsByTagName('activity')
-        services = mfxml.getElementsByTagName('service')
-        providers = mfxml.getElementsByTagName('provider')
-        receivers = mfxml.getElementsByTagName('receiver')
-        libs = mfxml.getElementsByTagName('uses-library')
-        sdk = mfxml.getElementsByTagName('uses-sdk')
-        categories = mfxml.getElementsByTagName('category')
+        manifest = MANIFEST_QUERIES['manifest'](mfxml)
+        activities = MANIFEST_QUERIES['activity'](mfxml)
+        services = MANIFEST_QUERIES['service'](mfxml)
+        providers = MANIFEST_QUERIES['provider'](mfxml)
+        receivers = MANIFEST_QUERIES['receiver'](mfxml)
+        libs = MANIFEST_QUERIES['uses-library'](mfxml)
+        sdk = MANIFEST_QUERIES['uses-sdk'](mfxml)
+        categories = MANIFEST_QUERIES['category'](mfxml)
         for node in sdk:
-            minsdk = node.getAttribute(f'{ns}:minSdkVersion')
-            maxsdk = node.getAttribute(f'{ns}:maxSdkVersion')
+            minsdk = node.get(f'{ns}minSdkVersion', '')
+            maxsdk = node.get(f'{ns}maxSdkVersion', '')
             # Esteve 08.08.2016 - begin - If android:targetSdkVersion
             # is not set, the default value is the one of the
             # minSdkVersiontargetsdk
             if app_dic.get('apk_features', {}).get('target_sdk_version'):
                 targetsdk = app_dic['apk_features']['target_sdk_version']
-            elif node.getAttribute(f'{ns}:targetSdkVersion'):
-                targetsdk = node.getAttribute(f'{ns}:targetSdkVersion')
+            elif node.get(f'{ns}targetSdkVersion', ''):
+                targetsdk = node.get(f'{ns}targetSdkVersion', '')
             else:
-                targetsdk = node.getAttribute(f'{ns}:minSdkVersion')
+                targetsdk = node.get(f'{ns}minSdkVersion', '')
         for node in manifest:
-            package = node.getAttribute('package')
-            androidversioncode = node.getAttribute(f'{ns}:versionCode')
-            androidversionname = node.getAttribute(f'{ns}:versionName')
+            package = node.get('package', '')
+            androidversioncode = node.get(f'{ns}versionCode', '')
+            androidversionname = node.get(f'{ns}versionName', '')
         alt_main = ''
         for activity in activities:
-            act_2 = activity.getAttribute(f'{ns}:name')
+            act_2 = activity.get(f'{ns}name', '')
             act.append(act_2)
             if not mainact:
                 # ^ Some manifest has more than one MAIN, take only
                 # the first occurrence.
-                for sitem in activity.getElementsByTagName('action'):
-                    val = sitem.getAttribute(f'{ns}:name')
+                for sitem in ACTION_QUERY(activity):
+                    val = sitem.get(f'{ns}name', '')
                     if val == 'android.intent.action.MAIN':
-                        mainact = activity.getAttribute(f'{ns}:name')
+                        mainact = activity.get(f'{ns}name', '')
                 # Manifest has no MAIN, look for launch activity.
-                for sitem in activity.getElementsByTagName('category'):
-                    val = sitem.getAttribute(f'{ns}:name')
+                for sitem in CATEGORY_QUERY(activity):
+                    val = sitem.get(f'{ns}name', '')
                     if val == 'android.intent.category.LAUNCHER':
-                        alt_main = activity.getAttribute(f'{ns}:name')
+                        alt_main = activity.get(f'{ns}name', '')
         if not mainact and alt_main:
             mainact = alt_main
 
         for service in services:
-            service_name = service.getAttribute(f'{ns}:name')
+            service_name = service.get(f'{ns}name', '')
             svc.append(service_name)
 
         for provider in providers:
-            provider_name = provider.getAttribute(f'{ns}:name')
+            provider_name = provider.get(f'{ns}name', '')
             cnp.append(provider_name)
 
         for receiver in receivers:
-            rec = receiver.getAttribute(f'{ns}:name')
+            rec = receiver.get(f'{ns}name', '')
             brd.append(rec)
 
         for _lib in libs:
-            library = _lib.getAttribute(f'{ns}:name')
+            library = _lib.get(f'{ns}name', '')
             lib.append(library)
 
         for category in categories:
-            cat.append(category.getAttribute(f'{ns}:name'))
+            cat.append(category.get(f'{ns}name', ''))
 
         for application in applications:
             try:
-                icon_path = application.getAttribute(f'{ns}:icon')
+                icon_path = application.get(f'{ns}icon', '')
                 icons.append(icon_path)
             except Exception:
                 continue  # No icon attribute?
 
         android_permission_tags = ('com.google.', 'android.', 'com.google.')
         for permission in permissions:
-            perm.append(permission.getAttribute(f'{ns}:name'))
+            perm.append(permission.get(f'{ns}name', ''))
         if not perm and app_dic.get('apk_features', {}).get('permissions'):
             perm = app_dic['apk_features']['permissions']
         for full_perm in perm:
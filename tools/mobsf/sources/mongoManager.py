@@ -123,6 +123,30 @@ def storeAnalisys(values):
         raise Exception(f"storeAnalisys failed: {e}")
 
 
+def storeTriage(values):
+    """
+    Insert or update the triage result of an APK, keyed by its checksum.
+    """
+    try:
+        mongo = Mongodb(
+            processControl.env['mongo']['MONGO_TRIAGE_COL'],
+            processControl.env['mongo']['MONGO_ANALISIS_DB']
+        )
+        result = mongo.getOneRecord({"md5": values["md5"]})
+        if result:
+            result, message = mongo.updateOne({'_id': result['_id']}, {"$set": values})
+            if not result:
+                raise Exception(f"Update failed: {message}")
+        else:
+            result = mongo.insertRecord(values)
+        return result
+
+    except KeyError as e:
+        raise Exception(f"Missing required key: {e}")
+    except Exception as e:
+        raise Exception(f"storeTriage failed: {e}")
+
+
 def getDataEstatico(checksum):
     try:
         mongo = Mongodb(
@@ -1,7 +1,9 @@
 # -*- coding: utf_8 -*-
 """Module for network security analysis."""
-from sources.common.common import logger, log_
+from sources.common.common import logger, processControl, log_
 from sources.common.utils import is_path_traversal
+from sources.axml_decode import get_resource_name
+from tools.androguard4.axml import AXMLPrinter
 
 from pathlib import Path
 
@@ -28,6 +30,11 @@ def read_netsec_config(checksum, app_dir, config, src_type):
     msg = 'Reading Network Security config'
     try:
         config_file = None
+        if src_type != 'studio':
+            # Decoded from the APK by sources.axml_decode, without apktool
+            decoded = read_netsec_config_decoded(config)
+            if decoded:
+                return decoded
         config = config.replace('@xml/', '', 1)
         base = Path(app_dir)
         if src_type == 'studio':
@@ -51,7 +58,7 @@ def read_netsec_config(checksum, app_dir, config, src_type):
                 config_file = xml
                 break
         if not config_file:
-            return None
+            return read_netsec_config_from_apk(config)
         desc = f'{msg} from {config_file.name}'
         #logger.info(desc)
         #append_scan_status(checksum, desc)
@@ -64,6 +71,48 @@ def read_netsec_config(checksum, app_dir, config, src_type):
     return None
 
 
+def read_netsec_config_decoded(config):
+    """Read the config from the XML resources decoded from the APK."""
+    app_dic = processControl.data.get('app_dic', {})
+    decoded = app_dic.get('decoded_xml')
+    if not decoded:
+        return None
+    names = app_dic.get('decoded_xml_names', {})
+    # The manifest may hold the resource id instead of the name
+    name = get_resource_name(app_dic, config)
+    config_file = names.get(name) or f'res/xml/{name.replace("@xml/", "", 1)}.xml'
+    if config_file not in decoded:
+        # Couldn't find the file defined in manifest
+        config_file = next(
+            (f for n, f in names.items() if n.startswith('@xml/') and 'network_security' in n),
+            None)
+    if not config_file:
+        config_file = next(
+            (f for f in decoded if f.startswith('res/xml/') and 'network_security' in f),
+            None)
+    if not config_file:
+        return None
+    log_("info", logger, f'Reading Network Security config from {config_file} ({name}) in the APK')
+    return decoded[config_file]
+
+
+def read_netsec_config_from_apk(config):
+    """Decode the config straight from the APK when apktool output is missing."""
+    apk_fs = processControl.data.get('app_dic', {}).get('apk_fs')
+    if not apk_fs or is_path_traversal(config):
+        return None
+    xml_dir = apk_fs.root / 'res' / 'xml'
+    config_file = xml_dir / f'{config}.xml'
+    if not config_file.is_file():
+        config_file = next(
+            (x for x in xml_dir.glob('*.xml') if 'network_security' in x.stem),
+            None)
+    if not config_file:
+        return None
+    log_("info", logger, f'Reading Network Security config from {config_file.as_posix()} in the APK')
+    return AXMLPrinter(config_file.read_bytes()).get_xml().decode('utf8', 'ignore')
+
+
 def analysis(checksum, app_dir, config, is_debuggable, src_type):
     """Perform Network Security Analysis."""
     try:
@@ -0,0 +1,172 @@
+# -*- coding: utf_8 -*-
+"""Per-stage timing and resource instrumentation.
+
+Every analysis stage is wrapped in `perf_stage(name)`, which records:
+
+- wall: elapsed seconds.
+- cpu: CPU seconds of the thread running the stage plus CPU seconds of
+  child processes (JADX, apktool, libsast workers) reaped meanwhile.
+  Children are accounted process-wide, so stages running at the same
+  time may share part of it.
+- peak_rss_kb: high-water mark of the process and its children when the
+  stage finished.
+- read_bytes / write_bytes: bytes read and written by the process, its
+  threads and the child processes reaped meanwhile (rchar/wchar from
+  /proc/self/io, 0 where not available). Like the children CPU, stages
+  running at the same time share them.
+
+The recorder of the running scan lives in processControl.data['perf'].
+Its summary goes to the result JSON under `perf` and is added to the
+counters of a single Prometheus textfile under env `metricsPath`, shared
+by the batch workers and kept across runs, so node_exporter sees them
+between runs too. The counters are kept in a JSON file next to it and
+merged under a file lock.
+"""
+from sources.common.common import logger, processControl, log_
+from sources.common.utils import atomic_write
+
+import fcntl
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+PROCESS_IO = '/proc/self/io'
+# <name>.prom, the counters in <name>.json and the lock <name>.lock
+TEXTFILE_NAME = 'mobsf_static'
+
+_lock = threading.Lock()
+
+
+def _process_io():
+    # Includes the threads and the reaped children of the process
+    try:
+        with open(PROCESS_IO, 'rb') as f:
+            values = dict(line.split(b':') for line in f.read().splitlines())
+        return int(values[b'rchar']), int(values[b'wchar'])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def _children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _peak_rss_kb():
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+class PerfRecorder:
+    """Collects the measures of the stages of one scan."""
+
+    def __init__(self):
+        self.stages = {}
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        children = _children_cpu()
+        rchar, wchar = _process_io()
+        try:
+            yield
+        finally:
+            end_rchar, end_wchar = _process_io()
+            measure = {
+                'wall': time.perf_counter() - wall,
+                'cpu': time.thread_time() - cpu + _children_cpu() - children,
+                'peak_rss_kb': _peak_rss_kb(),
+                'read_bytes': end_rchar - rchar,
+                'write_bytes': end_wchar - wchar,
+            }
+            with self.lock:
+                self.stages[name] = measure
+
+    def as_dict(self):
+        """Summary stored in the result JSON."""
+        with self.lock:
+            stages = {name: {k: round(v, 4) if isinstance(v, float) else v
+                             for k, v in measure.items()}
+                      for name, measure in self.stages.items()}
+        return {
+            'wall': round(time.perf_counter() - self.start, 4),
+            'peak_rss_kb': _peak_rss_kb(),
+            'stages': stages,
+        }
+
+
+def perf_stage(name):
+    """Measure a stage of the running scan, if a recorder is active."""
+    recorder = processControl.data.get('perf') if processControl.data else None
+    if recorder is None:
+        return nullcontext()
+    return recorder.stage(name)
+
+
+def _load_totals(state_path):
+    """Counters accumulated so far by every process, empty if unreadable."""
+    try:
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
+        return int(state['apks']), dict(state['stages'])
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError, TypeError) as exp:
+        log_("warning", logger, f'Resetting the Prometheus counters, unreadable state: {exp}')
+    return 0, {}
+
+
+def _textfile_lines(apks, totals):
+    lines = [
+        '# HELP mobsf_apks_analyzed_total APKs analyzed.',
+        '# TYPE mobsf_apks_analyzed_total counter',
+        f'mobsf_apks_analyzed_total {apks}',
+    ]
+    for metric, key, kind, desc, scale in (
+            ('mobsf_stage_runs_total', 'runs', 'counter', 'Executions of the stage.', 1),
+            ('mobsf_stage_wall_seconds_total', 'wall', 'counter', 'Wall time spent in the stage.', 1),
+            ('mobsf_stage_cpu_seconds_total', 'cpu', 'counter', 'CPU time spent in the stage.', 1),
+            ('mobsf_stage_read_bytes_total', 'read_bytes', 'counter', 'Bytes read during the stage.', 1),
+            ('mobsf_stage_write_bytes_total', 'write_bytes', 'counter', 'Bytes written during the stage.', 1),
+            ('mobsf_stage_peak_rss_bytes', 'peak_rss_kb', 'gauge',
+             'Peak RSS at the end of the last run of the stage.', 1024)):
+        lines.append(f'# HELP {metric} {desc}')
+        lines.append(f'# TYPE {metric} {kind}')
+        for name, total in sorted(totals.items()):
+            lines.append(f'{metric}{{stage="{name}"}} {total[key] * scale}')
+    return lines
+
+
+def export_metrics(recorder):
+    """Add the scan measures to the counters and rewrite the Prometheus textfile."""
+    metrics_path = processControl.env.get('metricsPath')
+    if not metrics_path:
+        return
+    textfile = os.path.join(metrics_path, f'{TEXTFILE_NAME}.prom')
+    state_path = os.path.join(metrics_path, f'{TEXTFILE_NAME}.json')
+    try:
+        os.makedirs(metrics_path, exist_ok=True)
+        # The batch workers and the next runs add to the same counters
+        with _lock, open(os.path.join(metrics_path, f'{TEXTFILE_NAME}.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            apks, totals = _load_totals(state_path)
+            apks += 1
+            for name, measure in recorder.stages.items():
+                total = totals.setdefault(name, {
+                    'runs': 0, 'wall': 0.0, 'cpu': 0.0,
+                    'read_bytes': 0, 'write_bytes': 0, 'peak_rss_kb': 0})
+                total['runs'] += 1
+                for key in ('wall', 'cpu', 'read_bytes', 'write_bytes'):
+                    total[key] += measure[key]
+                total['peak_rss_kb'] = measure['peak_rss_kb']
+            atomic_write(state_path, json.dumps({'apks': apks, 'stages': totals}))
+            # node_exporter may read the file at any time
+            atomic_write(textfile, '\n'.join(_textfile_lines(apks, totals)) + '\n', 0o644)
+    except Exception as exp:
+        log_("warning", logger, f'Could not export Prometheus metrics: {exp}')
@@ -0,0 +1,248 @@
+# -*- coding: utf_8 -*-
+"""Persistent cache of the SAST matches of each source file.
+
+Decompiled apps share most of their sources (androidx, Play Services,
+OkHttp, Kotlin...). The matches of a file are stored under env
+`cachePath`/sast, keyed by the hash of the rules of the scan and the hash
+of the file content, so a file already seen in any APK is not matched
+again. The stored matches don't have the file path, the findings are
+built with the path of the file in the current scan.
+
+The entries are JSON, never unpickled, since the cache directory may be
+shared. The cache is pruned at most once per SAST_CACHE_PRUNE_INTERVAL:
+the rule sets not used in `SAST_CACHE_MAX_AGE_DAYS` days are removed,
+then the least recently used entries above `SAST_CACHE_MAX_MB`.
+"""
+from sources.common.common import logger, processControl, log_
+from sources.common.utils import atomic_write
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from importlib import metadata
+
+# Bump when the layout of the stored entry changes
+SAST_CACHE_SCHEMA = '2'
+
+SAST_CACHE_DIR = 'sast'
+
+# Seconds between two prunes of the cache, by any process
+SAST_CACHE_PRUNE_INTERVAL = 3600
+PRUNE_MARKER = '.pruned'
+
+_prune_checked = False
+
+
+def get_ruleset_hash(rules):
+    """Return the hash of the matching keys of the rules and the libsast version."""
+    sha = hashlib.sha256()
+    sha.update(f'schema={SAST_CACHE_SCHEMA}\n'.encode())
+    try:
+        sha.update(f'libsast={metadata.version("libsast")}\n'.encode())
+    except metadata.PackageNotFoundError:
+        pass
+    # The metadata of the findings is taken from the rules of the scan
+    keys = [[rule.get(k) for k in ('id', 'type', 'pattern', 'input_case')]
+            for rule in rules]
+    sha.update(json.dumps(keys, default=str).encode())
+    return sha.hexdigest()[:16]
+
+
+def get_content_hash(file_path, data):
+    """
+    Return the hash of a file content. The suffix is part of the key
+    because libsast strips the comments by suffix.
+    """
+    sha = hashlib.sha256()
+    sha.update(file_path.suffix.lower().encode())
+    sha.update(b'\0')
+    sha.update(data.encode('utf-8', 'surrogatepass'))
+    return sha.hexdigest()
+
+
+def get_cache_file(ruleset, content_hash):
+    """Return the cache file path of a file content for a rule set."""
+    return os.path.join(
+        processControl.env['cachePath'],
+        SAST_CACHE_DIR,
+        ruleset,
+        content_hash[:2],
+        f'{content_hash}.json')
+
+
+def _rule_id(rule_id):
+    # The ids of the rule groups are (group, id) tuples, lists in JSON
+    return tuple(rule_id) if isinstance(rule_id, list) else rule_id
+
+
+def load_matches(ruleset, content_hash):
+    """Return the stored [(rule id, matches)] of a file, None on a miss."""
+    cache_file = get_cache_file(ruleset, content_hash)
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+        # Used entries are the last ones pruned
+        os.utime(cache_file)
+        return [(_rule_id(rule_id), [(match_string, tuple(position), tuple(lines))
+                                     for match_string, position, lines in matches])
+                for rule_id, matches in entry]
+    except FileNotFoundError:
+        return None
+    except Exception as exp:
+        log_("warning", logger, f'Discarding unreadable SAST cache entry {cache_file}: {exp}')
+        try:
+            os.unlink(cache_file)
+        except OSError:
+            pass
+        return None
+
+
+def store_matches(ruleset, content_hash, matches):
+    """Store the [(rule id, matches)] of a file."""
+    cache_file = get_cache_file(ruleset, content_hash)
+    try:
+        atomic_write(cache_file, json.dumps(matches, separators=(',', ':')))
+    except Exception as exp:
+        log_("warning", logger, f'Could not store SAST cache entry: {exp}')
+
+
+def _remove(path):
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+    except OSError as exp:
+        log_("warning", logger, f'Could not prune SAST cache {path}: {exp}')
+
+
+def prune_cache(ruleset):
+    """
+    Remove the rule sets not used in SAST_CACHE_MAX_AGE_DAYS days, then the
+    least recently used entries until the cache is below SAST_CACHE_MAX_MB.
+    The rule set of the running scan is kept.
+    """
+    cache_dir = os.path.join(processControl.env['cachePath'], SAST_CACHE_DIR)
+    max_age = processControl.settings.get('SAST_CACHE_MAX_AGE_DAYS', 30) * 86400
+    max_bytes = processControl.settings.get('SAST_CACHE_MAX_MB', 2048) * 1024 * 1024
+    now = time.time()
+    removed = 0
+    entries = []
+    with os.scandir(cache_dir) as rulesets:
+        for ruleset_dir in rulesets:
+            if not ruleset_dir.is_dir():
+                continue
+            if ruleset_dir.name != ruleset and now - ruleset_dir.stat().st_mtime > max_age:
+                _remove(ruleset_dir.path)
+                removed += 1
+                continue
+            for root, _dirs, files in os.walk(ruleset_dir.path):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+    size = sum(entry[1] for entry in entries)
+    pruned = 0
+    if max_bytes and size > max_bytes:
+        # Down to 90% so that the next scans don't prune again
+        entries.sort()
+        for _mtime, entry_size, path in entries:
+            if size <= max_bytes * 0.9:
+                break
+            _remove(path)
+            size -= entry_size
+            pruned += 1
+    log_("info", logger, f'SAST cache pruned: {removed} old rule sets and {pruned} entries removed, '
+                         f'{size / 1024 / 1024:.1f}MB in use')
+
+
+def maybe_prune_cache(ruleset):
+    """Prune the cache once per process and SAST_CACHE_PRUNE_INTERVAL."""
+    global _prune_checked
+    cache_dir = os.path.join(processControl.env['cachePath'], SAST_CACHE_DIR)
+    ruleset_dir = os.path.join(cache_dir, ruleset)
+    try:
+        # The age of a rule set is the last time it was used
+        os.makedirs(ruleset_dir, exist_ok=True)
+        os.utime(ruleset_dir)
+        if _prune_checked:
+            return
+        _prune_checked = True
+        marker = os.path.join(cache_dir, PRUNE_MARKER)
+        try:
+            if time.time() - os.stat(marker).st_mtime < SAST_CACHE_PRUNE_INTERVAL:
+                return
+        except FileNotFoundError:
+            pass
+        # Claim the prune before walking the cache, so that the other
+        # workers skip it
+        with open(marker, 'w'):
+            pass
+        prune_cache(ruleset)
+    except Exception as exp:
+        log_("warning", logger, f'Could not prune SAST cache: {exp}')
+
+
+def _matches_by_file(findings):
+    """Regroup libsast findings as {file path: {rule id: matches}}."""
+    by_file = {}
+    for rule_id, details in findings.items():
+        for file_meta in details['files']:
+            rules = by_file.setdefault(file_meta['file_path'], {})
+            rules.setdefault(rule_id, []).append((
+                file_meta['match_string'],
+                file_meta['match_position'],
+                file_meta['match_lines']))
+    return by_file
+
+
+def cached_regex_scan(pattern_matcher, file_contents):
+    """
+    Run the loaded rules of a PatternMatcher on the files not in the cache
+    and build the findings of all the files, in the same order as
+    PatternMatcher.regex_scan.
+    """
+    rules = pattern_matcher.scan_rules
+    if not (rules and file_contents):
+        return pattern_matcher.regex_scan(file_contents)
+    ruleset = get_ruleset_hash(rules)
+    maybe_prune_cache(ruleset)
+    keys = [get_content_hash(file_path, data)
+            for file_path, data in file_contents]
+    cached = [load_matches(ruleset, key) for key in keys]
+    misses = [file_data for file_data, entry in zip(file_contents, cached)
+              if entry is None]
+    log_("info", logger, f'SAST cache: {len(file_contents) - len(misses)}/{len(file_contents)} files already matched')
+
+    by_file = {}
+    pattern_matcher.findings = {}
+    if misses:
+        by_file = _matches_by_file(pattern_matcher.regex_scan(misses))
+
+    rule_by_id = {}
+    rule_order = {}
+    for idx, rule in enumerate(rules):
+        rule_by_id.setdefault(rule['id'], rule)
+        rule_order.setdefault(rule['id'], idx)
+    results = []
+    for (file_path, _data), key, entry in zip(file_contents, keys, cached):
+        path = file_path.as_posix()
+        if entry is None:
+            entry = sorted(by_file.get(path, {}).items(),
+                           key=lambda item: rule_order[item[0]])
+            store_matches(ruleset, key, entry)
+        results.append([{
+            'file': path,
+            'rule': rule_by_id[rule_id],
+            'matches': set(matches),
+        } for rule_id, matches in entry if rule_id in rule_by_id])
+    pattern_matcher.findings = {}
+    pattern_matcher.add_finding(results)
+    return pattern_matcher.findings
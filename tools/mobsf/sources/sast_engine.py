@@ -4,11 +4,20 @@ from sources.common.common import logger, processControl, log_
 from sources.common.utils import run_with_timeout
 #import logging
 
+import time
+from operator import itemgetter
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
 from libsast import Scanner
 from libsast.core_matcher.pattern_matcher import PatternMatcher
-from libsast.core_matcher.choice_matcher import ChoiceMatcher
+from libsast.core_matcher.helpers import get_rules, is_file_valid, strip_comments
 from libsast.common import get_worker_count
 
+from sources.sast_pool import PoolChoiceMatcher, PoolPatternMatcher
+from sources.sast_prefilter import PrefilterPatternMatcher
+from sources.sast_cache import cached_regex_scan
+
 """
 from django.conf import settings
 
@@ -39,6 +48,7 @@ def get_multiprocessing_strategy():
         mp = 'default'
     return mp    
     """
+    # The default strategy matches on the pool of sources.sast_pool
     return 'default'
 
 
@@ -55,7 +65,10 @@ class SastEngine:
             #    'Multiprocessing strategy set to %s with (%d) CPU cores', mp, cpu_core)
             log_("info", logger, f'Multiprocessing strategy set to {mp} with {cpu_core} CPU cores')
         self.scan_paths = Scanner(options, [path]).get_scan_files()
-        self.pattern_matcher = PatternMatcher(options)
+        if processControl.settings.get('SAST_PREFILTER', 1):
+            self.pattern_matcher = PrefilterPatternMatcher(options)
+        else:
+            self.pattern_matcher = PoolPatternMatcher(options)
         self.user = None
 
 
@@ -74,17 +87,172 @@ class SastEngine:
         log_("info", logger, f'Reading file contents for SAST')
         return self.pattern_matcher.read_file_contents(self.scan_paths)
 
+    def regex_scan(self, file_contents):
+        """
+        Run the loaded rules, on the files not in the SAST cache when enabled.
+        Returns the findings of these files only.
+        """
+        matcher = self.pattern_matcher
+        # The matcher is pickled to the workers with every file, so the
+        # findings of previous batches are kept out of it
+        findings = matcher.findings
+        matcher.findings = {}
+        try:
+            if processControl.settings.get('SAST_CACHE_ENABLED', 0):
+                return cached_regex_scan(matcher, file_contents)
+            return matcher.regex_scan(file_contents)
+        finally:
+            matcher.findings = findings
+
+    def add_findings(self, finds):
+        """Add the findings of a batch to the findings of the previous ones."""
+        findings = self.pattern_matcher.findings
+        for rule_id, details in finds.items():
+            if rule_id not in findings:
+                findings[rule_id] = details
+                continue
+            files = findings[rule_id]['files']
+            files.extend(details['files'])
+            # Same order as PatternMatcher.add_finding
+            files.sort(key=itemgetter('file_path', 'match_string', 'match_lines'))
+
     def run_rules(self, file_contents, rule_path):
         """Run the rules."""
+        self.pattern_matcher.scan_rules = get_rules(rule_path)
         finds = run_with_timeout(
-            self.pattern_matcher.regex_scan,
+            self.regex_scan,
             #settings.SAST_TIMEOUT,
             processControl.settings['SAST_TIMEOUT'],
-            file_contents,
-            rule_path)
+            file_contents)
         a = self.format_findings(finds)
         return a
 
+    def read_file_batches(self, max_bytes, extensions=None):
+        """
+        Read the files in batches of up to max_bytes of content, the next
+        batch is read once the previous one is released. All the files are
+        read in one batch when max_bytes is 0.
+        Yields lists of (file path, content).
+        """
+        exts = extensions or self.pattern_matcher.exts
+        batch = []
+        size = 0
+        for sfile in sorted(self.scan_paths):
+            if not is_file_valid(sfile, exts, 5):
+                continue
+            fsize = sfile.stat().st_size
+            if max_bytes and batch and size + fsize > max_bytes:
+                yield self._read_batch(batch)
+                batch = []
+                size = 0
+            batch.append(sfile)
+            size += fsize
+        if batch:
+            yield self._read_batch(batch)
+
+    @staticmethod
+    def _read_batch(paths):
+        with ThreadPoolExecutor() as io_executor:
+            return list(io_executor.map(
+                PatternMatcher._read_file_content, paths))
+
+    def start_rule_groups(self, rule_groups):
+        """
+        Load several rule files to be matched in a single pass over the
+        files, rule_groups is {group: rule path}. The files are matched with
+        scan_batch, in one or more batches, and the findings are returned
+        by rule_groups_findings.
+        """
+        self.rule_groups = list(rule_groups)
+        self.group_rules = {}
+        self.failed_groups = set()
+        for group, rule_path in rule_groups.items():
+            try:
+                # The ids are only unique within a rule file
+                self.group_rules[group] = [
+                    dict(rule, id=(group, rule['id']))
+                    for rule in get_rules(rule_path) or []]
+            except Exception as exp:
+                self.fail_group(group, exp)
+        self.pattern_matcher.findings = {}
+        # Same time budget as one run_rules per rule file
+        self.time_left = dict.fromkeys(
+            self.group_rules, processControl.settings['SAST_TIMEOUT'])
+
+    def fail_group(self, group, exp):
+        """Leave a rule group out of the scan, its findings are dropped."""
+        log_("error", logger, f'SAST of the {group} rules failed: {exp!r}')
+        self.failed_groups.add(group)
+
+    def scan_groups(self, groups, file_contents):
+        """Match the rules of groups on a batch of files, within their time left."""
+        self.pattern_matcher.scan_rules = [
+            rule for group in groups for rule in self.group_rules[group]]
+        start = time.monotonic()
+        finds = run_with_timeout(
+            self.regex_scan,
+            max(sum(self.time_left[group] for group in groups), 0),
+            file_contents)
+        # A failed scan is not charged, the groups are retried one by one
+        elapsed = (time.monotonic() - start) / len(groups)
+        for group in groups:
+            self.time_left[group] -= elapsed
+        self.add_findings(finds)
+
+    def scan_batch(self, file_contents):
+        """
+        Match the loaded rules on a batch of files. When the single pass
+        fails or times out, the rule groups are matched one by one and
+        only the groups that fail are left out.
+        """
+        groups = [group for group, rules in self.group_rules.items()
+                  if rules and group not in self.failed_groups]
+        if not (groups and file_contents):
+            return
+        try:
+            self.scan_groups(groups, file_contents)
+            return
+        except Exception as exp:
+            if len(groups) == 1:
+                self.fail_group(groups[0], exp)
+                return
+            log_("warning", logger, f'SAST single pass failed, matching the rule files one by one: {exp!r}')
+        for group in groups:
+            try:
+                self.scan_groups([group], file_contents)
+            except Exception as exp:
+                self.fail_group(group, exp)
+
+    def rule_groups_findings(self):
+        """
+        Return the findings of the batches by group, {group: findings}.
+        The groups that failed are left out.
+        """
+        by_group = {group: {} for group in self.rule_groups}
+        for (group, rule_id), details in self.pattern_matcher.findings.items():
+            by_group[group][rule_id] = details
+        results = {}
+        for group, finds in by_group.items():
+            if group in self.failed_groups:
+                continue
+            try:
+                results[group] = self.format_findings(finds)
+            except Exception as exp:
+                self.fail_group(group, exp)
+        return results
+
+    def run_rule_groups(self, file_contents, rule_groups):
+        """
+        Run several rule files in a single pass over the files.
+        rule_groups is {group: rule path}, returns {group: findings}
+        without the groups that failed.
+        The comments of each file are stripped once and all the rules are
+        matched in the same worker pool.
+        """
+        self.start_rule_groups(rule_groups)
+        self.scan_batch(file_contents)
+        return self.rule_groups_findings()
+
     def format_findings(self, findings):
         """Format the findings."""
         for details in findings.values():
@@ -118,7 +286,7 @@ class ChoiceEngine:
         options['cpu_core'] = get_worker_count()
         options['multiprocessing'] = get_multiprocessing_strategy()
         self.scan_paths = Scanner(options, [path]).get_scan_files()
-        self.choice_matcher = ChoiceMatcher(options)
+        self.choice_matcher = PoolChoiceMatcher(options)
 
     def read_files(self):
         """Read the files."""
@@ -133,3 +301,45 @@ class ChoiceEngine:
             5,
             file_contents,
             rule_path)
+
+    def start_batches(self):
+        """Prepare a scan of the files in batches with scan_batch."""
+        self.choice_matcher.findings = {}
+        self.alternative = None
+        self.time_left = 5
+
+    def scan_batch(self, file_contents):
+        """
+        Run the rules on a batch of (file path, content), as read by
+        SastEngine.read_file_batches. The comments of each file are stripped
+        once for all the rules. Returns the findings of the batches so far.
+        """
+        matcher = self.choice_matcher
+        data = [strip_comments(content, file_path.suffix.lower())
+                for file_path, content in file_contents
+                if file_path.suffix.lower() in matcher.exts]
+        choice_args = []
+        for rule in matcher.scan_rules:
+            if rule['type'] != 'code' and matcher.alternative_path:
+                # Scan only alternative path
+                if self.alternative is None:
+                    self.alternative = matcher._read_file_contents(
+                        ([Path(matcher.alternative_path)], rule))
+                choice_args.append([(content, rule) for content, _rule in self.alternative])
+            else:
+                choice_args.append([(content, rule) for content in data])
+        # As in SastEngine.regex_scan, the findings are not sent to the workers
+        findings = matcher.findings
+        matcher.findings = {}
+        start = time.monotonic()
+        try:
+            finds = run_with_timeout(
+                matcher.regex_scan,
+                max(self.time_left, 0),
+                choice_args)
+        finally:
+            matcher.findings = findings
+        self.time_left -= time.monotonic() - start
+        # The last file wins for each rule, as in ChoiceMatcher.add_finding
+        findings.update(finds)
+        return findings
@@ -0,0 +1,107 @@
+# -*- coding: utf_8 -*-
+"""Process pool of the SAST and NIAP matchers.
+
+The code analysis runs in a scheduler thread while other stages are still
+running, and libsast forks a new ProcessPoolExecutor for every regex_scan.
+Forking a multithreaded process can deadlock the child on a lock held by
+another thread (logging, ApkFS, ZipEntry...). The matchers below map the
+files on a single pool per process instead, started from a forkserver (or
+spawn) context, so the workers never inherit the locks of the analysis,
+and reused by all the batches and rule files.
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from libsast.core_matcher.pattern_matcher import PatternMatcher
+from libsast.core_matcher.choice_matcher import ChoiceMatcher
+from libsast.core_matcher.helpers import get_rules
+
+# Tasks per worker of each map, each task pickles the matcher once
+CHUNKS_PER_WORKER = 4
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_start_method():
+    """forkserver when available (POSIX), spawn otherwise."""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return 'forkserver'
+    return 'spawn'
+
+
+def get_sast_pool(workers):
+    """Return the SAST pool of this process, it is created on first use."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        # A forked batch worker never uses the pool of its parent
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, workers),
+                mp_context=multiprocessing.get_context(get_start_method()))
+            _pool_pid = os.getpid()
+            atexit.register(shutdown_sast_pool, True)
+        return _pool
+
+
+def shutdown_sast_pool(wait=False):
+    """Stop the workers of the SAST pool, a new one is created when needed."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+        owned = _pool_pid == os.getpid()
+    if pool is not None and owned:
+        pool.shutdown(wait=wait, cancel_futures=True)
+
+
+def map_in_pool(func, items, workers):
+    """
+    Map func over items on the SAST pool, the results keep the order of
+    items. A broken pool is dropped so that the next map starts a new one.
+    """
+    workers = max(1, workers or 1)
+    chunksize = max(1, len(items) // (workers * CHUNKS_PER_WORKER))
+    try:
+        return list(get_sast_pool(workers).map(func, items, chunksize=chunksize))
+    except BrokenProcessPool:
+        shutdown_sast_pool()
+        raise
+
+
+class PoolPatternMatcher(PatternMatcher):
+    """PatternMatcher that matches the files on the SAST pool."""
+
+    def regex_scan(self, file_contents: list, rules=None) -> dict:
+        """Scan file(s) content."""
+        if rules:
+            self.scan_rules = get_rules(rules)
+        if not (self.scan_rules and file_contents):
+            return {}
+        self.validate_rules()
+        if self.multiprocessing == 'thread':
+            return super().regex_scan(file_contents)
+        results = map_in_pool(self.pattern_matcher, file_contents, self.cpu)
+        self.add_finding(results)
+        return self.findings
+
+
+class PoolChoiceMatcher(ChoiceMatcher):
+    """ChoiceMatcher that matches the files on the SAST pool."""
+
+    def regex_scan(self, file_contents: list, rules=None) -> dict:
+        """Process regex matches on the file contents."""
+        if rules:
+            self.scan_rules = get_rules(rules)
+        if not (self.scan_rules and file_contents):
+            return {}
+        self.validate_rules()
+        if self.multiprocessing == 'thread':
+            return super().regex_scan(file_contents)
+        results = map_in_pool(self.choice_matcher, file_contents, self.cpu)
+        self.add_finding(results)
+        return self.findings
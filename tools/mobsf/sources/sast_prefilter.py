@@ -0,0 +1,173 @@
+# -*- coding: utf_8 -*-
+"""Literal prefilter for the SAST pattern rules.
+
+Most rules can only match a file that contains some fixed text, a class
+or method name (android\\.webkit\\.WebView, \\.getDeviceId\\(...). Those
+literals are extracted from the parsed regexes of each rule when the rules
+are loaded, and a rule is only evaluated on the files that contain them.
+A file is checked once per literal, the checks are shared by all the rules.
+Rules whose literals can't be worked out (case insensitive, alternations
+without literals...) are always evaluated.
+"""
+import re
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+from libsast.core_matcher.helpers import get_rules
+from libsast import exceptions
+
+from sources.sast_pool import PoolPatternMatcher
+
+_REPEATS = tuple(
+    getattr(sre_parse, name) for name in
+    ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+    if hasattr(sre_parse, name))
+_ATOMIC_GROUP = getattr(sre_parse, 'ATOMIC_GROUP', None)
+
+
+def _better(current, candidate):
+    """Return the literal set whose shortest literal is the longest."""
+    if not candidate:
+        return current
+    if not current:
+        return candidate
+    if min(map(len, candidate)) > min(map(len, current)):
+        return candidate
+    return current
+
+
+def _required_literals(subpattern):
+    """
+    Return a set of literals, at least one of them is in every match of
+    the parsed regex. None when there is no such set.
+    """
+    best = None
+    run = []
+    for op, av in subpattern:
+        if op is sre_parse.LITERAL:
+            run.append(chr(av))
+            continue
+        if run:
+            best = _better(best, frozenset((''.join(run),)))
+            run = []
+        required = None
+        if op is sre_parse.SUBPATTERN:
+            _group, add_flags, _del_flags, sub = av
+            if not add_flags & re.IGNORECASE:
+                required = _required_literals(sub)
+        elif op is sre_parse.BRANCH:
+            branches = [_required_literals(sub) for sub in av[1]]
+            if all(branches):
+                required = frozenset().union(*branches)
+        elif op in _REPEATS:
+            if av[0] >= 1:
+                required = _required_literals(av[2])
+        elif op is _ATOMIC_GROUP:
+            required = _required_literals(av)
+        best = _better(best, required)
+    if run:
+        best = _better(best, frozenset((''.join(run),)))
+    return best
+
+
+def get_regex_literals(regex):
+    """Return the literals required by a regex, None if unknown."""
+    try:
+        parsed = sre_parse.parse(regex)
+    except Exception:
+        return None
+    state = getattr(parsed, 'state', None) or getattr(parsed, 'pattern', None)
+    if state is None or state.flags & re.IGNORECASE:
+        return None
+    return _required_literals(parsed)
+
+
+def _any_regex_literals(regexes):
+    """Literals of a set of alternative regexes, None if one is unknown."""
+    literals = [get_regex_literals(regex) for regex in regexes]
+    if literals and all(literals):
+        return frozenset().union(*literals)
+    return None
+
+
+def get_rule_literals(rule):
+    """
+    Return the literals required by a rule as a tuple of literal sets,
+    the file must contain one literal of every set. An empty tuple means
+    the rule is always evaluated.
+    """
+    if rule.get('input_case', 'exact') != 'exact':
+        return ()
+    typ = rule['type']
+    pattern = rule['pattern']
+    patterns = pattern if isinstance(pattern, list) else [pattern]
+    if typ == 'Regex':
+        required = [get_regex_literals(pattern)]
+    elif typ == 'RegexAnd':
+        required = [get_regex_literals(regex) for regex in patterns]
+    elif typ == 'RegexOr':
+        required = [_any_regex_literals(patterns)]
+    elif typ == 'RegexAndNot':
+        required = [get_regex_literals(patterns[0])]
+    elif typ == 'RegexAndOr':
+        required = [
+            get_regex_literals(patterns[0]),
+            _any_regex_literals(patterns[1]),
+        ]
+    else:
+        return ()
+    return tuple(literals for literals in required if literals)
+
+
+class PrefilterPatternMatcher(PoolPatternMatcher):
+    """PatternMatcher that skips the rules whose literals are not in a file."""
+
+    def __init__(self, options: dict) -> None:
+        super().__init__(options)
+        self.rule_literals = None
+
+    def regex_scan(self, file_contents: list, rules=None) -> dict:
+        """Scan file(s) content."""
+        if rules:
+            self.scan_rules = get_rules(rules)
+        self.rule_literals = []
+        for rule in self.scan_rules or []:
+            try:
+                self.rule_literals.append(get_rule_literals(rule))
+            except Exception:
+                # Invalid rules are reported by validate_rules
+                self.rule_literals.append(())
+        return super().regex_scan(file_contents)
+
+    def pattern_matcher(self, file_data):
+        """Static Analysis Pattern Matcher."""
+        file_path, data = file_data
+        results = []
+        try:
+            fmt_data = self._format_content(data, file_path.suffix.lower())
+            found = {}
+
+            def contains(literal):
+                present = found.get(literal)
+                if present is None:
+                    present = found[literal] = literal in fmt_data
+                return present
+
+            for rule, literals in zip(self.scan_rules, self.rule_literals):
+                if not all(any(contains(literal) for literal in options)
+                           for options in literals):
+                    continue
+                matches = self.matcher._find_match(rule['type'], fmt_data, rule)
+                if matches:
+                    results.append({
+                        'file': file_path.as_posix(),
+                        'rule': rule,
+                        'matches': matches,
+                    })
+        except Exception as e:
+            msg = f'Error processing rule for {file_path}: {e}'
+            raise exceptions.RuleProcessingError(msg)
+        return results
@@ -27,21 +27,24 @@ def merge_common_packages(items):
     return merged
 
 
-def extract_packages(file_data):
-    """Extract package names from file data."""
-    packages = set()
+def find_packages(file_data, packages):
+    """Add the package names of file data to the packages set."""
     try:
         for item in file_data:
             # tuple has file path and file content
             # we are interested in file content's first line
-            pkg = item[1].split('\n')[0]
+            pkg = item[1].split('\n', 1)[0]
             match = PKG_REGEX.search(pkg)
             if match and match.group(1) != '_COROUTINE':
                 packages.add(match.group(1))
-        packages = merge_common_packages(packages)
     except Exception:
         logger.exception('Extracting packages from file data')
-    return sorted(packages)
+    return packages
+
+
+def extract_packages(file_data):
+    """Extract package names from file data."""
+    return sorted(merge_common_packages(find_packages(file_data, set())))
 
 
 def get_group_name(file_name, group):
@@ -76,9 +79,12 @@ def android_sbom(app_dir):
     return sorted(sbom)
 
 
-def sbom(app_dir, file_data):
-    """Extract SBOM from version files and decompiled source code."""
+def sbom(app_dir, packages):
+    """
+    Extract SBOM from version files and the packages of the decompiled
+    source code, see find_packages.
+    """
     return {
         'sbom_versioned': android_sbom(app_dir),
-        'sbom_packages': extract_packages(file_data),
+        'sbom_packages': sorted(merge_common_packages(packages)),
     }
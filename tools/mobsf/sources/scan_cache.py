@@ -0,0 +1,124 @@
+# -*- coding: utf_8 -*-
+"""Content-addressed cache of static analysis results.
+
+Results are stored as JSON files keyed by the APK SHA-256 plus a
+fingerprint of everything that can change the output of a scan: the
+rule files, the versions of the analysis tools and the settings listed
+in RESULT_SETTINGS (sources/common/paramsManager.py). Changing any of
+them yields a different fingerprint, so stale entries are never served.
+"""
+from sources.common.common import logger, processControl, log_
+from sources.common.utils import atomic_write
+from sources.common.paramsManager import RESULT_SETTINGS
+from sources.converter import JADX_VERSION
+from sources.tpl_index import get_tpl_fingerprint
+
+import hashlib
+import json
+import os
+from importlib import metadata
+from pathlib import Path
+
+# Bump when the layout of the stored context changes
+CACHE_SCHEMA = '1'
+
+# Keys that depend on the storage backend or the run, not on the scan
+VOLATILE_KEYS = ('_id', 'apkId', 'perf')
+
+RULE_FILES = (
+    'androidRules/android_rules.yaml',
+    'androidRules/android_apis.yaml',
+    'androidRules/android_permissions.yaml',
+    'androidRules/android_niap.yaml',
+    'MalwareAnalyzer/behaviour_rules.yaml',
+)
+
+_fingerprint = None
+
+
+def _package_version(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return ''
+
+
+def get_fingerprint():
+    """Return the hash of rules, tool versions and result settings of a scan."""
+    global _fingerprint
+    if _fingerprint:
+        return _fingerprint
+    sha = hashlib.sha256()
+    sha.update(f'schema={CACHE_SCHEMA}\n'.encode())
+    base = Path(__file__).parent
+    for rule_file in RULE_FILES:
+        sha.update(rule_file.encode())
+        rule_path = base / rule_file
+        if rule_path.exists():
+            sha.update(rule_path.read_bytes())
+    for tool, version in (('jadx', JADX_VERSION),
+                          ('apkid', _package_version('apkid')),
+                          ('libsast', _package_version('libsast')),
+                          ('lief', _package_version('lief'))):
+        sha.update(f'{tool}={version}\n'.encode())
+    settings = {k: processControl.settings.get(k) for k in RESULT_SETTINGS}
+    sha.update(json.dumps(settings, sort_keys=True).encode())
+    # TPL mode of the scan and TPL index
+    sha.update(f'tpl={get_tpl_fingerprint()}\n'.encode())
+    _fingerprint = sha.hexdigest()[:16]
+    return _fingerprint
+
+
+def get_cache_file(checksum):
+    """Return the cache file path for an APK SHA-256."""
+    return os.path.join(
+        processControl.env['cachePath'],
+        checksum[:2],
+        f'{checksum}.{get_fingerprint()}.json')
+
+
+def get_cached_result(checksum):
+    """Return the stored context for an APK, or None on a miss."""
+    cache_file = get_cache_file(checksum)
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            context = json.load(f)
+        log_("info", logger, f'Result cache hit: {cache_file}')
+        return context
+    except FileNotFoundError:
+        return None
+    except Exception as exp:
+        log_("warning", logger, f'Discarding unreadable cache entry {cache_file}: {exp}')
+        invalidate_result(checksum)
+        return None
+
+
+def store_result(checksum, context):
+    """Store the context of a finished scan."""
+    cache_file = get_cache_file(checksum)
+    try:
+        values = {k: v for k, v in context.items() if k not in VOLATILE_KEYS}
+        atomic_write(cache_file, json.dumps(values))
+    except Exception as exp:
+        log_("warning", logger, f'Could not store result cache entry: {exp}')
+
+
+def invalidate_result(checksum=None):
+    """
+    Remove cache entries for an APK SHA-256, for every fingerprint.
+    Without a checksum the whole cache is cleared.
+    Returns the number of entries removed.
+    """
+    cache_root = Path(processControl.env['cachePath'])
+    if not cache_root.exists():
+        return 0
+    if checksum:
+        entries = (cache_root / checksum[:2]).glob(f'{checksum}.*.json')
+    else:
+        entries = cache_root.glob('*/*.json')
+    removed = 0
+    for entry in entries:
+        entry.unlink(missing_ok=True)
+        removed += 1
+    log_("info", logger, f'Removed {removed} result cache entries')
+    return removed
@@ -0,0 +1,103 @@
+# -*- coding: utf_8 -*-
+"""Dependency-aware scheduler for the analysis stages.
+
+Each stage declares the stages it requires. Stages whose requirements are
+satisfied run concurrently on a thread pool, so the wall time of a scan is
+bounded by its critical path instead of the sum of all the stages.
+Threads are used because stages share the in-memory app_dic (androguard
+objects are not picklable) and the slow ones spend their time in external
+tools (JADX, apktool) or in C extensions.
+"""
+from sources.common.common import logger, log_
+from sources.perf import perf_stage
+
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    wait,
+)
+
+
+class Stage:
+    """
+    Analysis stage: `func(results)` returns the value stored under `name`.
+    `files` are fnmatch patterns of the APK entries the stage reads from disk.
+    """
+
+    def __init__(self, name, func, requires=(), files=()):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+        self.files = tuple(files)
+
+    def __repr__(self):
+        return f'Stage({self.name})'
+
+
+def required_files(stages):
+    """Patterns of the archive entries needed by the stages."""
+    return sorted({pattern for stage in stages for pattern in stage.files})
+
+
+def _run_stage(stage, results):
+    with perf_stage(stage.name):
+        return stage.func(results)
+
+
+def check_graph(stages):
+    """Validate names, dependencies and the absence of cycles."""
+    names = [stage.name for stage in stages]
+    if len(names) != len(set(names)):
+        raise ValueError(f'Duplicated stage names in {names}')
+    for stage in stages:
+        missing = set(stage.requires) - set(names)
+        if missing:
+            raise ValueError(f'Stage {stage.name} requires unknown stages {sorted(missing)}')
+    done = set()
+    pending = list(stages)
+    while pending:
+        ready = [s for s in pending if set(s.requires) <= done]
+        if not ready:
+            raise ValueError(f'Cyclic dependencies between {[s.name for s in pending]}')
+        done.update(s.name for s in ready)
+        pending = [s for s in pending if s not in ready]
+
+
+def run_stages(stages, workers=4, results=None):
+    """
+    Run the stages honouring their dependencies.
+
+    :param stages: List of `Stage` objects.
+    :param workers: Maximum number of stages running at the same time.
+    :param results: Optional dictionary with precomputed results.
+    :return: Dictionary with the value returned by every stage.
+    :raises Exception: The first exception raised by a stage. Stages already
+        running are allowed to finish, no new stage is started.
+    """
+    check_graph(stages)
+    results = {} if results is None else results
+    pending = {stage.name: stage for stage in stages}
+    running = {}
+    error = None
+    with ThreadPoolExecutor(max_workers=max(1, workers),
+                            thread_name_prefix='stage') as executor:
+        while pending or running:
+            if not error:
+                ready = [s for s in pending.values()
+                         if all(r in results for r in s.requires)]
+                for stage in ready:
+                    del pending[stage.name]
+                    running[executor.submit(_run_stage, stage, results)] = stage
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    results[stage.name] = future.result()
+                except Exception as exp:
+                    log_("error", logger, f'Stage {stage.name} failed: {exp}')
+                    error = error or exp
+    if error:
+        raise error
+    return results
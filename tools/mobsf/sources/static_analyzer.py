@@ -4,6 +4,10 @@ from sources.common.common import logger, processControl, log_
 
 from sources.common.utils import getChecksum
 from sources.apk import apk_analysis
+from sources.triage import apk_triage
+from sources.mongoManager import storeAnalisys, storeTriage
+from sources.scan_cache import get_cached_result, store_result
+from sources.perf import PerfRecorder, export_metrics
 import os
 import json
 import zipfile
@@ -89,11 +93,14 @@ def static_analyzer(request, checksum="", api=False):
 
     This function analyzes an APK file based on its checksum or filename. If no checksum is provided,
     it calculates it from the specified file path. The function then sets up the analysis environment,
-    logs the process, and calls the `apk_analysis` function.
+    logs the process, and calls the `apk_analysis` function. A previous result for the same
+    checksum, rules and tool versions is served from the result cache unless `--force` is given.
+    With `--proc TRIAGE` only the manifest, permissions and certificate are analyzed and the
+    compact result is saved instead (not cached, it is cheaper than a cache lookup).
 
     :param request: The filename of the APK to be analyzed.
     :type request: str
-    :param checksum: The MD5 checksum of the APK file. If not provided, it will be computed.
+    :param checksum: The SHA-256 checksum of the APK file. If not provided, it will be computed.
     :type checksum: str, optional
     :param api: Flag to indicate whether the analysis is performed via an API request.
     :type api: bool, optional
@@ -109,7 +116,9 @@ def static_analyzer(request, checksum="", api=False):
     en request estoy pasando el fileName
     """
     filename = request
-    rescan = False
+    rescan = processControl.args.force
+    triage = processControl.args.proc == 'TRIAGE'
+    useCache = processControl.settings.get('RESULT_CACHE_ENABLED', 0) and not triage
 
     try:
         normalizeApk(processControl.data['process']['filePath'])
@@ -131,21 +140,44 @@ def static_analyzer(request, checksum="", api=False):
         log_("info", logger, f'Scan Hash: {checksum}')
         log_("info", logger, f"start analysis {app_dic['app_name']}")
         processControl.data['app_dic'] = app_dic
-        context = apk_analysis(request, app_dic, rescan, api)
+        processControl.data['perf'] = PerfRecorder()
+        context = None
+        if triage:
+            context = apk_triage(app_dic)
+            if context and not processControl.args.result:
+                storeTriage(context)
+        elif useCache and not rescan:
+            context = get_cached_result(checksum)
+            if context and not processControl.args.result:
+                storeAnalisys(context)
+        if not context and not triage:
+            context = apk_analysis(request, app_dic, rescan, api)
+            if context and useCache:
+                store_result(checksum, context)
+        if context:
+            context['perf'] = processControl.data['perf'].as_dict()
+            export_metrics(processControl.data['perf'])
 
         if processControl.args.result:
             if "apkId" in context:
                 del context["apkId"]
-            jsonResultsPath = os.path.join(processControl.args.result, f"{filename}.json")
-            with open(jsonResultsPath, "w", encoding="utf-8") as f:
-                json.dump(context, f, indent=4)
+            if triage:
+                # One compact line per APK
+                jsonResultsPath = os.path.join(processControl.args.result, f"{filename}.triage.json")
+                with open(jsonResultsPath, "w", encoding="utf-8") as f:
+                    json.dump(context, f, separators=(',', ':'))
+            else:
+                jsonResultsPath = os.path.join(processControl.args.result, f"{filename}.json")
+                with open(jsonResultsPath, "w", encoding="utf-8") as f:
+                    json.dump(context, f, indent=4)
 
             log_("info", logger, f"Archivo JSON guardado correctamente. {jsonResultsPath}")
 
         fileSourcePath = os.path.join(processControl.env['inputPath'], processControl.data['process']['filename'])
         os.remove(fileSourcePath)
         filePath = os.path.join(processControl.env['inputPath'], fileProcessPath)
-        os.remove(filePath)
+        if os.path.exists(filePath):
+            os.remove(filePath)
 
         return checksum
 
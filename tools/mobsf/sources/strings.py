@@ -14,6 +14,7 @@ from sources.common.utils import (
 from sources.entropy import (
     get_entropies,
 )
+from sources.tpl_index import get_library_filter
 from pathlib import Path
 
 """
@@ -84,34 +85,35 @@ def strings_from_apk(checksum, app_dic):
         rsrc = app_dic.get('androguard_apk_resources')
         if rsrc:
             pkg = rsrc.get_packages_names()[0]
-            rsrc.get_strings_resources()
+            # Deduplicated (key, value) pairs of every locale
+            keys, values = rsrc.get_string_index(pkg)
 
-            # Iterate over resource strings
-            for _res_key, res_value in rsrc.values.get(pkg, {}).items():
-                res_string = res_value.get('string')
-                if not res_string:
+            # Single pass over resource strings
+            res_values = []
+            for key, value in zip(keys, values):
+                if not value:
                     continue
 
-                for key, value in res_string:
-                    if not value:
-                        continue
-
-                    # Extract Firebase credentials
-                    if key == 'google_api_key' and GOOGLE_API_KEY_REGEX.match(value):
-                        results['firebase_creds']['google_api_key'] = value
-                    elif key == 'google_app_id' and GOOGLE_APP_ID_REGEX.match(value):
-                        results['firebase_creds']['google_app_id'] = value
-
-                    # Format and collect strings
-                    formatted_str = f'"{key}" : "{value}"'
-                    results['strings'].append(formatted_str)
-
-                    # Check for possible secrets
-                    if is_secret_key(key) and ' ' not in value:
-                        results['secrets'].append(formatted_str)
+                # Extract Firebase credentials
+                if key == 'google_api_key' and GOOGLE_API_KEY_REGEX.match(value):
+                    results['firebase_creds']['google_api_key'] = value
+                elif key == 'google_app_id' and GOOGLE_APP_ID_REGEX.match(value):
+                    results['firebase_creds']['google_app_id'] = value
+
+                # Format and collect strings
+                formatted_str = f'"{key}" : "{value}"'
+                results['strings'].append(formatted_str)
+                res_values.append(value)
+
+                # Check for possible secrets
+                if is_secret_key(key) and ' ' not in value:
+                    results['secrets'].append(formatted_str)
+            # URLs and Emails are only found in the values
+            res_text = '\n'.join(res_values)
         elif app_dic.get('apk_strings'):
             # No secret key check for APK strings
-            results['strings'] = app_dic['apk_strings']
+            results['strings'] = list(set(app_dic['apk_strings']))
+            res_text = ''.join(results['strings'])
         else:
             msg = 'Failed to extract String data from APK'
             logger.warning(msg)
@@ -119,9 +121,8 @@ def strings_from_apk(checksum, app_dic):
             return results
 
         # Extract URLs and Emails from collected strings
-        results['strings'] = list(set(results['strings']))
         ul, u_nf, e_nf = url_n_email_extract(
-            ''.join(results['strings']), 'Android String Resource')
+            res_text, 'Android String Resource')
         results['urls_list'], results['urls_nf'], results['emails_nf'] = ul, u_nf, e_nf
 
     except Exception as exp:
@@ -132,7 +133,7 @@ def strings_from_apk(checksum, app_dic):
     return results
 
 
-def strings_from_code(checksum, src_dir, typ, exts):
+def strings_from_code(checksum, src_dir, typ, exts, package=None):
     """Extract Strings and Secrets from Java/Kotlin code."""
     msg = 'Extracting String data from Code'
     logger.info(msg)
@@ -143,7 +144,10 @@ def strings_from_code(checksum, src_dir, typ, exts):
     }
     try:
         src_dir = get_android_src_dir(Path(src_dir), typ)
-        data = strings_and_entropies(checksum, src_dir, exts)
+        # Known third-party libraries are skipped, see sources/tpl_index.py
+        data = strings_and_entropies(
+            checksum, src_dir, exts,
+            get_library_filter(src_dir, package))
     except Exception as exp:
         msg = 'Failed to extract String data from Code'
         logger.exception(msg)
@@ -151,7 +155,7 @@ def strings_from_code(checksum, src_dir, typ, exts):
     return data
 
 
-def get_strings_metadata(app_dic, elf_strings, exts, code_dic):
+def get_strings_metadata(app_dic, elf_strings, exts, code_dic, package=None):
     """Get Strings, secrets, entropies, URLs, emails."""
     checksum = app_dic['md5']
     typ = app_dic['zipped']
@@ -165,7 +169,7 @@ def get_strings_metadata(app_dic, elf_strings, exts, code_dic):
     urls_n_files = []
     emails_n_files = []
     secrets = []
-    if app_dic.get('androguard_string_resources') or app_dic.get('apk_strings'):
+    if app_dic.get('androguard_apk_resources') or app_dic.get('apk_strings'):
         # APK
         apk_res = strings_from_apk(checksum, app_dic)
         code_dic['firebase_creds'] = apk_res['firebase_creds']
@@ -190,7 +194,7 @@ def get_strings_metadata(app_dic, elf_strings, exts, code_dic):
 
     if exts:
         # Source Code
-        code_res = strings_from_code(checksum, app_dir, typ, exts)
+        code_res = strings_from_code(checksum, app_dir, typ, exts, package)
         strings['strings_code'] = list(code_res['strings'])
         secrets.extend(code_res['secrets'])
 
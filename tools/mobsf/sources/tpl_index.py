@@ -0,0 +1,190 @@
+# -*- coding: utf_8 -*-
+"""Skip index of third-party library (TPL) packages.
+
+appcollector stores the Maven artifacts of the known TPLs in the `tpls`
+collection of the metadata database, the group id of an artifact is, for
+most of them, the Java package of its classes (androidx.appcompat,
+com.google.android.gms, com.squareup.okhttp3...). `main.py --tpl-index`
+dumps those packages to env `cachePath`/tpl_index.json and the scans load
+them into a package-prefix trie, used to find the decompiled sources that
+belong to a library. With the TPL mode (setting `TPL_MODE`, `--tpl`):
+
+- scan: the libraries are analysed as the app code.
+- drop: the libraries are not analysed (SAST, URLs, strings).
+- summary: the SAST findings of the libraries are summarized by library,
+  apart from the app findings. URLs and strings are not extracted.
+
+The sources under the app package are never taken for a library.
+"""
+from sources.common.common import logger, processControl, log_
+from sources.common.utils import atomic_write
+
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+
+TPL_INDEX_FILE = 'tpl_index.json'
+
+TPL_MODES = ('scan', 'drop', 'summary')
+
+# Group ids of hosting services, shared by unrelated projects
+GENERIC_GROUPS = (
+    'com.github',
+    'io.github',
+    'com.gitlab',
+    'io.gitlab',
+    'org.bitbucket',
+    'com.bitbucket',
+    'io.jitpack',
+    'net.sourceforge',
+    'com.example',
+    'org.example',
+)
+
+# Packages shorter than this are too broad to be skipped
+MIN_PACKAGE_PARTS = 2
+
+IDENTIFIER_REGEX = re.compile(r'^[A-Za-z_$][\w$]*$')
+
+_trie = None
+_index_hash = None
+
+
+class PackageTrie:
+    """Trie of Java packages split by dots."""
+
+    def __init__(self, packages=()):
+        self.root = {}
+        for package in packages:
+            self.add(package)
+
+    def add(self, package):
+        node = self.root
+        for part in package.split('.'):
+            node = node.setdefault(part, {})
+        # None is never a package part
+        node[None] = package
+
+    def match(self, parts):
+        """Return the longest package that prefixes the parts, None if any."""
+        node = self.root
+        found = None
+        for part in parts:
+            node = node.get(part)
+            if node is None:
+                break
+            found = node.get(None, found)
+        return found
+
+
+def is_valid_package(package):
+    """Check that a group id can be used as a package prefix."""
+    parts = package.split('.')
+    if len(parts) < MIN_PACKAGE_PARTS:
+        return False
+    if not all(IDENTIFIER_REGEX.match(part) for part in parts):
+        return False
+    generic = '.'.join(parts[:2])
+    return generic not in GENERIC_GROUPS or len(parts) > 2
+
+
+def get_index_file():
+    """Return the path of the TPL index file."""
+    return os.path.join(processControl.env['cachePath'], TPL_INDEX_FILE)
+
+
+def build_tpl_index():
+    """
+    Dump the packages of the TPLs of the metadata database to the index file.
+    Returns the number of packages.
+    """
+    from sources.mongoManager import Mongodb
+    mongo = Mongodb(
+        processControl.env['mongo']['MONGO_TPL_COL'],
+        processControl.env['mongo']['MONGO_METADATA_DB'])
+    packages = sorted({package.strip() for package in mongo.collection.distinct('package')
+                       if isinstance(package, str) and is_valid_package(package.strip())})
+    index_file = get_index_file()
+    atomic_write(index_file, json.dumps({'packages': packages}, indent=0))
+    log_("info", logger, f'TPL index built with {len(packages)} packages: {index_file}')
+    return len(packages)
+
+
+def load_tpl_index():
+    """Return the trie of the TPL index, None when there is no index."""
+    global _trie, _index_hash
+    if _index_hash is not None:
+        return _trie
+    _index_hash = ''
+    try:
+        data = Path(get_index_file()).read_bytes()
+        _trie = PackageTrie(json.loads(data)['packages'])
+        _index_hash = hashlib.sha256(data).hexdigest()[:16]
+    except FileNotFoundError:
+        pass
+    except Exception as exp:
+        log_("warning", logger, f'Could not load the TPL index: {exp}')
+    return _trie
+
+
+def get_tpl_mode():
+    """Return the TPL mode of the scan, the --tpl argument over the setting."""
+    mode = getattr(processControl.args, 'tpl', '') or processControl.settings.get('TPL_MODE', 'scan')
+    return mode if mode in TPL_MODES else 'scan'
+
+
+def get_tpl_fingerprint():
+    """Return the values that change the results of a scan: mode and index."""
+    mode = get_tpl_mode()
+    if mode == 'scan':
+        return mode
+    load_tpl_index()
+    return f'{mode}:{_index_hash}'
+
+
+def get_library_filter(src, package):
+    """
+    Return a function giving the TPL package of a source file of src,
+    None for the app code. Returns None when the libraries are scanned.
+    """
+    if get_tpl_mode() == 'scan':
+        return None
+    trie = load_tpl_index()
+    if not trie:
+        return None
+    root = Path(src)
+    app_parts = tuple(package.split('.')) if package else ()
+
+    def get_library(path):
+        try:
+            parts = Path(path).relative_to(root).parts[:-1]
+        except ValueError:
+            return None
+        if app_parts and parts[:len(app_parts)] == app_parts:
+            return None
+        return trie.match(parts)
+
+    return get_library
+
+
+def split_library_findings(findings, libraries):
+    """
+    Move the findings of the library files out of findings {group: {rule: details}}.
+    libraries is {file path: TPL package} with the paths of the findings.
+    Returns {TPL package: {'files': scanned files, group: {rule: files}}}.
+    """
+    summary = {}
+    for library in libraries.values():
+        summary.setdefault(library, {'files': 0})['files'] += 1
+    for group, group_findings in findings.items():
+        for rule_id in list(group_findings):
+            files = group_findings[rule_id]['files']
+            for file_path in [f for f in files if f in libraries]:
+                del files[file_path]
+                rules = summary[libraries[file_path]].setdefault(group, {})
+                rules[rule_id] = rules.get(rule_id, 0) + 1
+            if not files:
+                del group_findings[rule_id]
+    return summary
@@ -0,0 +1,200 @@
+# -*- coding: utf_8 -*-
+"""Fast triage of an APK: manifest, permissions and signer.
+
+Runs only the androguard manifest parsing, the manifest analysis, the
+malware permission check and the certificate analysis, reading everything
+straight from the archive (no extraction, no apktool, JADX or SAST). The
+compact result is meant to pre-filter large corpora and queue only the
+interesting APKs for the full scan (`--proc FULL`).
+"""
+from sources.common.common import logger, processControl, log_
+
+from sources.apk import initialize_app_dic, get_size_and_hashes
+from sources.apk_cache import load_apk, store_apk
+from sources.apk_vfs import ApkFS
+from sources.axml_decode import decode_res_xml
+from sources.cert_analysis import cert_info
+from sources.manifest_analysis import manifest_analysis
+from sources.manifest_utils import (
+    extract_manifest_data,
+    get_androguard_manifest,
+    get_fallback,
+    set_parsed_manifest,
+)
+from sources.MalwareAnalyzer import permissions
+from sources.perf import perf_stage
+
+import asn1crypto
+from tools.androguard4 import util
+
+TRIAGE_SCHEMA = '2'
+
+
+def parse_manifest(app_dic):
+    """
+    Parse AndroidManifest.xml with androguard, its lxml tree is the manifest DOM.
+
+    Populates the keys read by extract_manifest_data() and manifest_analysis():
+    androguard_apk, manifest_parsed_xml and manifest_namespace. The parsed APK
+    comes from the parsed APK cache when enabled, and is stored on a miss.
+
+    :param app_dic: Dictionary containing metadata and paths related to the APK file.
+    :type app_dic: dict
+    """
+    app_dic['androguard_apk'] = None
+    app_dic['manifest_file'] = None
+    app_dic['manifest_namespace'] = 'android'
+    app_dic['manifest_parsed_xml'] = get_fallback()
+    try:
+        # Nothing is extracted, so the integrity policy is applied by androguard
+        a, extras = load_apk(
+            app_dic,
+            processControl.settings.get('ZIP_INTEGRITY', 'cd'))
+        app_dic['androguard_apk'] = a
+        # With the 'cd' policy broken local headers don't abort the triage
+        problems = getattr(a, 'integrity_problems', [])
+        if problems:
+            log_("warning", logger, f'{len(problems)} APK entries failed the central directory check: '
+                                    f'{", ".join(problems[:10])}')
+        if extras is None and processControl.settings.get('APK_CACHE_ENABLED', 0):
+            # App name and icon are left to the full scan
+            store_apk(app_dic['md5'], a, {})
+        set_parsed_manifest(app_dic, get_androguard_manifest(app_dic))
+    except Exception:
+        log_("exception", logger, 'Failed to parse AndroidManifest.xml with androguard')
+
+
+def get_signers(a):
+    """
+    Subject and SHA-256 of the signing certificates (v1, v2 and v3).
+
+    :param a: androguard APK object.
+    :return: List of dictionaries with `subject` and `sha256`.
+    """
+    signers = []
+    if not a:
+        return signers
+    try:
+        certs = set(a.get_certificates_der_v3() + a.get_certificates_der_v2()
+                    + [a.get_certificate_der(x)
+                       for x in a.get_signature_names()])
+        for data in sorted(certs):
+            x509_cert = asn1crypto.x509.Certificate.load(data)
+            signers.append({
+                'subject': util.get_certificate_name_string(x509_cert.subject, short=True),
+                'sha256': x509_cert.sha256.hex(),
+            })
+    except Exception:
+        log_("exception", logger, 'Failed to read the signing certificates')
+    return signers
+
+
+def _severity_summary(findings):
+    summary = {}
+    for finding in findings:
+        summary[finding['severity']] = summary.get(finding['severity'], 0) + 1
+    return summary
+
+
+def triage_context(app_dic, man_data_dic, man_an_dic, mal_perms, cert_dic):
+    """
+    Build the compact triage result.
+
+    `zip_integrity` holds the central directory problems found by androguard
+    with the 'cd' policy, the first ten of them and their count.
+    `review` is True when the manifest, the network security config or the
+    certificate have high severity findings, the hint to queue a full scan.
+    """
+    findings = man_an_dic.get('manifest_anal', [])
+    manifest_summary = _severity_summary(findings)
+    network_summary = man_an_dic.get('network_security', {}).get('network_summary', {})
+    cert_summary = cert_dic.get('certificate_summary', {})
+    review = bool(manifest_summary.get('high')
+                  or network_summary.get('high')
+                  or cert_summary.get('high'))
+    a = app_dic.get('androguard_apk')
+    problems = getattr(a, 'integrity_problems', [])
+    return {
+        'triage_schema': TRIAGE_SCHEMA,
+        'file_name': app_dic['app_name'],
+        'size': app_dic['size'],
+        'md5': app_dic['md5'],
+        'sha1': app_dic['sha1'],
+        'sha256': app_dic['sha256'],
+        'package_name': man_data_dic['packagename'],
+        'version_name': man_data_dic['androvername'],
+        'version_code': man_data_dic['androver'],
+        'min_sdk': man_data_dic['min_sdk'],
+        'target_sdk': man_data_dic['target_sdk'],
+        'max_sdk': man_data_dic['max_sdk'],
+        'main_activity': man_data_dic['mainactivity'],
+        'permissions': sorted(man_data_dic['perm']),
+        'malware_permissions': {
+            'top_malware_permissions': mal_perms['top_malware_permissions'],
+            'other_abused_permissions': mal_perms['other_abused_permissions'],
+        },
+        'exported_components': man_an_dic.get('exported_act', []),
+        'exported_count': man_an_dic.get('exported_cnt', {}),
+        'manifest_findings': [[f['severity'], f['rule'], f['name']] for f in findings],
+        'manifest_summary': manifest_summary,
+        'network_summary': network_summary,
+        'signed': bool(a and a.is_signed()),
+        'signers': get_signers(a),
+        'certificate_findings': cert_dic.get('certificate_findings', []),
+        'certificate_summary': cert_summary,
+        'zip_integrity': {
+            'policy': processControl.settings.get('ZIP_INTEGRITY', 'cd'),
+            'problems': len(problems),
+            'entries': problems[:10],
+        },
+        'review': review,
+    }
+
+
+def apk_triage(app_dic):
+    """
+    Triage an APK reading only its manifest and signature blocks.
+
+    :param app_dic: Dictionary containing metadata and paths related to the APK file.
+    :type app_dic: dict
+
+    :return: The compact triage result, or False if an error occurs.
+    :rtype: dict or bool
+    """
+    initialize_app_dic(app_dic, 'apk')
+    checksum = app_dic['md5']
+    app_dic['zipped'] = 'apk'
+    try:
+        with perf_stage('hashes'):
+            get_size_and_hashes(app_dic)
+        # The network security config and MANIFEST.MF are read from the archive
+        try:
+            app_dic['apk_fs'] = ApkFS(app_dic['app_path'])
+        except Exception as exp:
+            log_("warning", logger, f'Failed to index the APK entries: {exp}')
+            app_dic['apk_fs'] = None
+        with perf_stage('androguard'):
+            parse_manifest(app_dic)
+        with perf_stage('axml'):
+            # The network security config, found through resources.arsc
+            # (only the xml type is parsed)
+            if app_dic['androguard_apk']:
+                app_dic['androguard_apk_resources'] = app_dic['androguard_apk'].get_android_resources()
+            decode_res_xml(app_dic)
+        with perf_stage('manifest'):
+            man_data_dic = extract_manifest_data(app_dic)
+            man_an_dic = manifest_analysis(app_dic, man_data_dic) or {}
+        with perf_stage('malware_perms'):
+            mal_perms = permissions.check_malware_permission(
+                checksum,
+                man_data_dic['perm'])
+        with perf_stage('cert'):
+            cert_dic = cert_info(app_dic, man_data_dic)
+        return triage_context(app_dic, man_data_dic, man_an_dic, mal_perms, cert_dic)
+    except Exception as exp:
+        log_("exception", logger, f'Error triage {exp}')
+        return False
+    finally:
+        if app_dic.get('apk_fs'):
+            app_dic['apk_fs'].close()
+            app_dic['apk_fs'] = None
@@ -0,0 +1,110 @@
+# -*- coding: utf_8 -*-
+"""
+Memory benchmark of the androguard ARSC parser on a synthetic resources.arsc.
+
+    python tests/bench_arsc_memory.py [--entries 200000] [--tree <checkout>]
+
+The table has one package with --entries string resources spread over four
+types, each entry with its own key and value string. The parse, _analyse()
+and get_resolved_strings() are measured with tracemalloc: retained is the
+memory still allocated afterwards, peak the high-water mark. --tree runs
+the parser of another checkout of the tool (e.g. before a change), so both
+numbers come from the same synthetic table.
+"""
+import argparse
+import gc
+import os
+import struct
+import sys
+import time
+import tracemalloc
+
+TYPE_NAMES = ('string', 'id', 'drawable', 'layout')
+PACKAGE_ID = 0x7F
+PACKAGE_NAME = 'com.example.synth'
+
+
+def string_pool(strings):
+    """UTF-8 string pool chunk, strings shorter than 128 characters."""
+    data = bytearray()
+    offsets = []
+    for string in strings:
+        encoded = string.encode('utf-8')
+        offsets.append(len(data))
+        data += bytes((len(string), len(encoded))) + encoded + b'\0'
+    while len(data) % 4:
+        data += b'\0'
+    header_size = 28
+    strings_start = header_size + 4 * len(strings)
+    return (struct.pack('<HHIIIIII', 0x0001, header_size, strings_start + len(data),
+                        len(strings), 0, 0x100, strings_start, 0)
+            + struct.pack(f'<{len(strings)}I', *offsets) + bytes(data))
+
+
+def build_arsc(entries):
+    """A resources.arsc with entries string resources, spread over the types."""
+    values = string_pool([f'value {i}' for i in range(entries)])
+    types = string_pool(TYPE_NAMES)
+    keys = string_pool([f'key_{i}' for i in range(entries)])
+    # The entry index of a resource id is 16 bits
+    per_type = entries // len(TYPE_NAMES)
+    chunks = bytearray()
+    for index in range(len(TYPE_NAMES)):
+        type_id = index + 1
+        chunks += (struct.pack('<HHI', 0x0202, 16, 16 + 4 * per_type)
+                   + struct.pack('<BBHI', type_id, 0, 0, per_type)
+                   + b'\0' * (4 * per_type))
+        config = struct.pack('<I', 64) + b'\0' * 60
+        header_size = 20 + len(config)
+        base = index * per_type
+        # Simple entries pointing to a string of the value pool
+        table_entries = b''.join(
+            struct.pack('<HHI', 8, 0, base + i) + struct.pack('<HBBI', 8, 0, 0x03, base + i)
+            for i in range(per_type))
+        offsets = struct.pack(f'<{per_type}I', *range(0, 16 * per_type, 16))
+        chunks += (struct.pack('<HHI', 0x0201, header_size,
+                               header_size + len(offsets) + len(table_entries))
+                   + struct.pack('<BBHII', type_id, 0, 0, per_type, header_size + len(offsets))
+                   + config + offsets + table_entries)
+    name = PACKAGE_NAME.encode('utf-16-le').ljust(256, b'\0')
+    header_size = 288
+    body = types + keys + bytes(chunks)
+    package = (struct.pack('<HHII', 0x0200, header_size, header_size + len(body), PACKAGE_ID)
+               + name + struct.pack('<IIIII', header_size, 0, header_size + len(types), 0, 0)
+               + body)
+    table = values + package
+    return struct.pack('<HHII', 0x0002, 12, 12 + len(table), 1) + table
+
+
+def measure(raw):
+    from tools.androguard4.axml import ARSCParser
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    parser = ARSCParser(raw)
+    parser._analyse()
+    strings = parser.get_resolved_strings()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    resolved = sum(len(values) for configs in strings.values() for values in configs.values())
+    return retained, peak, elapsed, resolved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--entries', type=int, default=200000)
+    parser.add_argument('--tree', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help='checkout of the tool whose parser is measured')
+    args = parser.parse_args()
+    sys.path.insert(0, os.path.abspath(args.tree))
+    raw = build_arsc(args.entries)
+    retained, peak, elapsed, resolved = measure(raw)
+    print(f'entries={args.entries} arsc={len(raw) / 2**20:.1f}MB '
+          f'retained={retained / 2**20:.1f}MB peak={peak / 2**20:.1f}MB '
+          f'time={elapsed:.2f}s resolved={resolved}')
+
+
+if __name__ == '__main__':
+    main()
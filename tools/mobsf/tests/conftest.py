@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The sources are imported as in main.py, from the tool directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
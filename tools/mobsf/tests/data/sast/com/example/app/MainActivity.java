@@ -0,0 +1,49 @@
+package com.example.app;
+
+import android.app.Activity;
+import android.content.Context;
+import android.content.Intent;
+import android.database.sqlite.SQLiteDatabase;
+import android.os.Bundle;
+import android.telephony.TelephonyManager;
+import android.util.Log;
+import android.webkit.WebSettings;
+import android.webkit.WebView;
+import java.io.File;
+import java.security.MessageDigest;
+import java.util.Random;
+import javax.crypto.Cipher;
+
+public class MainActivity extends Activity {
+    private static final String PASSWORD = "hunter2";
+    private String api_key = "AIzaSyD-1234567890abcdefghijklmnop";
+
+    @Override
+    protected void onCreate(Bundle savedInstanceState) {
+        super.onCreate(savedInstanceState);
+        WebView webView = new WebView(this);
+        WebSettings settings = webView.getSettings();
+        settings.setJavaScriptEnabled(true);
+        settings.setAllowFileAccess(true);
+        webView.addJavascriptInterface(new Object(), "bridge");
+        webView.loadUrl("http://example.com/index.html");
+        TelephonyManager tm = (TelephonyManager) getSystemService(Context.TELEPHONY_SERVICE);
+        String imei = tm.getDeviceId();
+        Log.d("MainActivity", "imei " + imei);
+        SQLiteDatabase db = openOrCreateDatabase("app.db", MODE_PRIVATE, null);
+        db.rawQuery("SELECT * FROM users WHERE name = '" + imei + "'", null);
+        db.execSQL("DELETE FROM users WHERE id = " + imei);
+        File tmp = File.createTempFile("cache", ".tmp");
+        getSharedPreferences("prefs", MODE_WORLD_READABLE);
+        Random random = new Random();
+        random.nextInt();
+        sendBroadcast(new Intent("com.example.ACTION"));
+    }
+
+    byte[] hash(byte[] data) throws Exception {
+        MessageDigest md = MessageDigest.getInstance("MD5");
+        Cipher cipher = Cipher.getInstance("AES/ECB/PKCS5Padding");
+        Cipher des = Cipher.getInstance("DES");
+        return md.digest(data);
+    }
+}
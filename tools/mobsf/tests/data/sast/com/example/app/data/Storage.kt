@@ -0,0 +1,23 @@
+package com.example.app.data
+
+import android.content.ClipboardManager
+import android.content.Context
+import android.location.LocationManager
+import android.os.Environment
+import android.provider.Settings
+import android.util.Base64
+import java.io.File
+
+class Storage(private val context: Context) {
+    fun save(data: String) {
+        val dir = Environment.getExternalStorageDirectory()
+        File(dir, "dump.txt").writeText(data)
+        val encoded = Base64.encodeToString(data.toByteArray(), Base64.DEFAULT)
+        val clipboard = context.getSystemService(Context.CLIPBOARD_SERVICE) as ClipboardManager
+        clipboard.primaryClip
+        val id = Settings.Secure.getString(context.contentResolver, Settings.Secure.ANDROID_ID)
+        val lm = context.getSystemService(Context.LOCATION_SERVICE) as LocationManager
+        lm.getLastKnownLocation(LocationManager.GPS_PROVIDER)
+        System.loadLibrary("native")
+    }
+}
@@ -0,0 +1,35 @@
+package com.example.app.net;
+
+import java.io.InputStream;
+import java.net.HttpURLConnection;
+import java.net.Socket;
+import java.net.URL;
+import java.security.cert.X509Certificate;
+import javax.net.ssl.HostnameVerifier;
+import javax.net.ssl.HttpsURLConnection;
+import javax.net.ssl.SSLSession;
+import javax.net.ssl.TrustManager;
+import javax.net.ssl.X509TrustManager;
+import org.apache.http.conn.ssl.SSLSocketFactory;
+
+public class Client {
+    public InputStream get(String address) throws Exception {
+        URL url = new URL(address);
+        HttpURLConnection connection = (HttpURLConnection) url.openConnection();
+        HttpsURLConnection.setDefaultHostnameVerifier(new HostnameVerifier() {
+            public boolean verify(String hostname, SSLSession session) {
+                return true;
+            }
+        });
+        SSLSocketFactory.ALLOW_ALL_HOSTNAME_VERIFIER.toString();
+        TrustManager[] trustAll = new TrustManager[] {new X509TrustManager() {
+            public void checkClientTrusted(X509Certificate[] chain, String authType) {}
+            public void checkServerTrusted(X509Certificate[] chain, String authType) {}
+            public X509Certificate[] getAcceptedIssuers() { return null; }
+        }};
+        Socket socket = new Socket("10.0.0.1", 8080);
+        Runtime.getRuntime().exec("su -c id");
+        Class.forName("dalvik.system.DexClassLoader");
+        return connection.getInputStream();
+    }
+}
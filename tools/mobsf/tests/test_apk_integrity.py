@@ -0,0 +1,38 @@
+# -*- coding: utf_8 -*-
+"""Tests of the integrity policies of the androguard APK."""
+import io
+import struct
+import zipfile
+
+import pytest
+
+from tools.androguard4.apk import APK, BrokenAPKError
+
+
+def broken_zip():
+    """ZIP whose second central directory entry points past its local header."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zipptr:
+        zipptr.writestr('AndroidManifest.xml', b'manifest')
+        zipptr.writestr('classes.dex', b'dex\n035\x00')
+    data = bytearray(buffer.getvalue())
+    cd_start = struct.unpack_from('<I', data, data.rfind(b'PK\x05\x06') + 16)[0]
+    second = data.index(b'PK\x01\x02', cd_start + 4)
+    # Relative offset of the local header, moved into the central directory
+    struct.pack_into('<I', data, second + 42, cd_start + 1)
+    return bytes(data)
+
+
+def test_cd_policy_records_problems():
+    a = APK(broken_zip(), raw=True, skip_analysis=True, testzip='cd')
+    assert a.integrity_problems == ['no local header for classes.dex']
+
+
+def test_full_policy_raises():
+    with pytest.raises(BrokenAPKError):
+        APK(broken_zip(), raw=True, skip_analysis=True, testzip='full')
+
+
+def test_off_policy_skips_the_check():
+    a = APK(broken_zip(), raw=True, skip_analysis=True, testzip='off')
+    assert a.integrity_problems == []
@@ -0,0 +1,156 @@
+# -*- coding: utf_8 -*-
+"""Tests of the v2/v3 signature verification of the androguard APK."""
+import datetime
+import hashlib
+import io
+import os
+import struct
+import zipfile
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.x509.oid import NameOID
+
+from tools.androguard4.apk import APK
+
+V2 = 0x7109871A
+V3 = 0xF05368C0
+CHUNK_SIZE = 1024 * 1024
+SHA512_ALGORITHMS = (0x0102, 0x0104, 0x0202)
+# Verity digests are not supported by the verifier
+VERITY_SHA256 = 0x0421
+
+
+def lp(data):
+    """Length prefixed, as every field of the APK signing block."""
+    return struct.pack('<I', len(data)) + data
+
+
+def content_digest(hash_name, sections):
+    """Digest of the chunks of the sections, as defined by the v2 scheme."""
+    digests = []
+    for section in sections:
+        for offset in range(0, len(section), CHUNK_SIZE):
+            chunk = section[offset:offset + CHUNK_SIZE]
+            digests.append(hashlib.new(
+                hash_name, b'\xa5' + struct.pack('<I', len(chunk)) + chunk).digest())
+    return hashlib.new(
+        hash_name, b'\x5a' + struct.pack('<I', len(digests)) + b''.join(digests)).digest()
+
+
+def sign(key, algorithm, data):
+    digest = hashes.SHA512() if algorithm in SHA512_ALGORITHMS else hashes.SHA256()
+    if isinstance(key, ec.EllipticCurvePrivateKey):
+        return key.sign(data, ec.ECDSA(digest))
+    if algorithm in (0x0101, 0x0102):
+        return key.sign(data, padding.PSS(mgf=padding.MGF1(digest), salt_length=digest.digest_size), digest)
+    return key.sign(data, padding.PKCS1v15(), digest)
+
+
+def unsigned_apk():
+    """A small APK, with a stored entry spanning several 1 MB chunks."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zipptr:
+        zipptr.writestr('AndroidManifest.xml', b'manifest')
+        zipptr.writestr(zipfile.ZipInfo('assets/blob'), os.urandom(3 * CHUNK_SIZE + 123))
+    return buffer.getvalue()
+
+
+def signed_apk(key, algorithms, scheme=V3, tamper=False):
+    """Insert an APK signing block with one signer before the central directory."""
+    data = unsigned_apk()
+    eocd_start = data.rfind(b'PK\x05\x06')
+    cd_start = struct.unpack_from('<I', data, eocd_start + 16)[0]
+    content, cdir, eocd = data[:cd_start], data[cd_start:eocd_start], data[eocd_start:]
+
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'test')])
+    cert = (x509.CertificateBuilder()
+            .subject_name(name).issuer_name(name)
+            .public_key(key.public_key()).serial_number(1)
+            .not_valid_before(datetime.datetime(2020, 1, 1))
+            .not_valid_after(datetime.datetime(2040, 1, 1))
+            .sign(key, hashes.SHA256()))
+    public_key = key.public_key().public_bytes(
+        serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+    sdk = struct.pack('<II', 24, 0x7FFFFFFF) if scheme == V3 else b''
+
+    # The digests are over the EOCD pointing to the signing block
+    hashed_eocd = bytearray(eocd)
+    hashed_eocd[16:20] = struct.pack('<I', len(content))
+    digests = b''.join(
+        lp(struct.pack('<I', algorithm) + lp(content_digest(
+            'sha512' if algorithm in SHA512_ALGORITHMS else 'sha256',
+            (content, cdir, hashed_eocd))))
+        for algorithm in algorithms)
+    signed_data = lp(digests) + lp(lp(cert.public_bytes(serialization.Encoding.DER))) + sdk + lp(b'')
+    signatures = b''.join(
+        lp(struct.pack('<I', algorithm) + lp(sign(key, algorithm, signed_data)))
+        for algorithm in algorithms)
+    signer = lp(signed_data) + sdk + lp(signatures) + lp(public_key)
+    value = lp(lp(signer))
+    pair = struct.pack('<QI', len(value) + 4, scheme) + value
+    size = len(pair) + 24
+    block = struct.pack('<Q', size) + pair + struct.pack('<Q', size) + b'APK Sig Block 42'
+
+    eocd = bytearray(eocd)
+    eocd[16:20] = struct.pack('<I', len(content) + len(block))
+    content = bytearray(content)
+    if tamper:
+        # Inside the stored entry, the ZIP stays readable
+        content[len(content) // 2] ^= 1
+    return bytes(content) + block + cdir + bytes(eocd)
+
+
+@pytest.fixture(scope='module')
+def ec_key():
+    return ec.generate_private_key(ec.SECP256R1())
+
+
+@pytest.fixture(scope='module')
+def rsa_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+@pytest.mark.parametrize('key_name, algorithms', [
+    ('ec_key', [0x0201, 0x0202]),
+    ('rsa_key', [0x0101]),
+    ('rsa_key', [0x0102, 0x0103]),
+    ('rsa_key', [0x0104]),
+])
+@pytest.mark.parametrize('scheme', [V2, V3], ids=['v2', 'v3'])
+def test_valid_signature_verifies(request, key_name, algorithms, scheme):
+    data = signed_apk(request.getfixturevalue(key_name), algorithms, scheme)
+    a = APK(data, raw=True, skip_analysis=True)
+    if scheme == V2:
+        assert a.verify_signature_v2() is True
+        assert a.verify_signature_v3() is False
+    else:
+        assert a.verify_signature_v3() is True
+        assert a.verify_signature_v2() is False
+
+
+@pytest.mark.parametrize('scheme', [V2, V3], ids=['v2', 'v3'])
+def test_tampered_content_fails(ec_key, scheme):
+    data = signed_apk(ec_key, [0x0201], scheme, tamper=True)
+    a = APK(data, raw=True, skip_analysis=True)
+    verify = a.verify_signature_v2 if scheme == V2 else a.verify_signature_v3
+    assert verify() is False
+
+
+def test_unsupported_algorithm_is_unknown(ec_key):
+    data = signed_apk(ec_key, [VERITY_SHA256])
+    a = APK(data, raw=True, skip_analysis=True)
+    assert a.verify_signature_v3() is None
+
+
+@pytest.mark.parametrize('tamper', [False, True])
+def test_workers_give_the_same_result(rsa_key, tamper):
+    data = signed_apk(rsa_key, [0x0103, 0x0104], tamper=tamper)
+    results = []
+    for workers in (1, 4):
+        a = APK(data, raw=True, skip_analysis=True)
+        results.append((a.verify_signature_v3(workers), a._content_digests))
+    assert results[0] == results[1]
+    assert results[0][0] is not tamper
@@ -0,0 +1,17 @@
+# -*- coding: utf_8 -*-
+"""The synthetic resources.arsc of the memory benchmark parses as expected."""
+from bench_arsc_memory import PACKAGE_NAME, TYPE_NAMES, build_arsc
+
+from tools.androguard4.axml import ARSCParser
+
+
+def test_synthetic_arsc():
+    parser = ARSCParser(build_arsc(400))
+    assert parser.get_packages_names() == [PACKAGE_NAME]
+    assert set(TYPE_NAMES) <= set(parser.get_types(PACKAGE_NAME))
+    # Only the string type is resolved
+    strings = parser.get_resolved_strings()[PACKAGE_NAME]['DEFAULT']
+    assert len(strings) == 100
+    assert strings[0x7F010000] == 'value 0'
+    assert parser.get_resource_xml_name(0x7F010000) == '@com.example.synth:string/key_0'
+    assert parser.get_resource_xml_name(0x7F040063) == '@com.example.synth:layout/key_399'
@@ -0,0 +1,86 @@
+# -*- coding: utf_8 -*-
+"""Tests of the decoding of the androguard manifest tree."""
+from lxml import etree
+
+from sources.manifest_analysis import manifest_analysis
+from sources.manifest_utils import (
+    decode_manifest,
+    extract_manifest_data,
+    set_parsed_manifest,
+)
+from tools.androguard4.apk import NS_ANDROID
+
+# Values as androguard leaves them: enums and flags as integers and
+# references by resource id
+RAW_MANIFEST = b'''<?xml version="1.0" encoding="utf-8"?>
+<manifest xmlns:android="http://schemas.android.com/apk/res/android"
+    package="com.example.app" android:versionCode="1" android:versionName="1.0">
+  <uses-sdk android:minSdkVersion="19" android:targetSdkVersion="26"/>
+  <permission android:name="com.example.app.PERM" android:protectionLevel="0x00000012"/>
+  <application android:icon="@7F0C0001"
+      android:networkSecurityConfig="@7F120001" android:theme="@android:01030010">
+    <activity android:name=".MainActivity" android:launchMode="2"
+        android:configChanges="0x000004B4" android:windowSoftInputMode="0x00000010"
+        android:screenOrientation="1" android:exported="true">
+      <intent-filter>
+        <action android:name="android.intent.action.MAIN"/>
+        <category android:name="android.intent.category.LAUNCHER"/>
+      </intent-filter>
+    </activity>
+  </application>
+</manifest>'''
+
+
+class Resources:
+    """Resources of the app, as the androguard ARSCParser."""
+
+    NAMES = {
+        0x7F0C0001: '@mipmap/ic_launcher',
+        0x7F120001: '@xml/network_security_config',
+    }
+
+    def get_packages_names(self):
+        return ['com.example.app']
+
+    def get_resource_xml_name(self, r_id, package=None):
+        return self.NAMES.get(r_id)
+
+
+def get_decoded():
+    return decode_manifest(etree.fromstring(RAW_MANIFEST), Resources())
+
+
+def test_decode_enums_flags_and_references():
+    root = get_decoded()
+    activity = root.find('application/activity')
+    assert activity.get(f'{NS_ANDROID}launchMode') == 'singleTask'
+    assert activity.get(f'{NS_ANDROID}screenOrientation') == 'portrait'
+    assert activity.get(f'{NS_ANDROID}windowSoftInputMode') == 'adjustResize'
+    assert activity.get(f'{NS_ANDROID}configChanges') == (
+        'locale|keyboard|keyboardHidden|orientation|screenSize')
+    assert root.find('permission').get(f'{NS_ANDROID}protectionLevel') == 'signature|privileged'
+    application = root.find('application')
+    assert application.get(f'{NS_ANDROID}icon') == '@mipmap/ic_launcher'
+    assert application.get(f'{NS_ANDROID}networkSecurityConfig') == '@xml/network_security_config'
+    # Framework references are left as they are
+    assert application.get(f'{NS_ANDROID}theme') == '@android:01030010'
+
+
+def test_decode_keeps_the_androguard_tree():
+    raw = etree.fromstring(RAW_MANIFEST)
+    decode_manifest(raw, Resources())
+    assert raw.find('application/activity').get(f'{NS_ANDROID}launchMode') == '2'
+
+
+def test_single_task_activity_findings():
+    app_dic = {
+        'md5': '0' * 64,
+        'zipped': 'apk',
+        'app_dir': '',
+    }
+    set_parsed_manifest(app_dic, get_decoded())
+    man_data_dic = extract_manifest_data(app_dic)
+    rules = {finding['rule'] for finding in
+             manifest_analysis(app_dic, man_data_dic)['manifest_anal']}
+    assert 'non_standard_launchmode' in rules
+    assert 'task_hijacking' in rules
@@ -0,0 +1,73 @@
+# -*- coding: utf_8 -*-
+"""Tests of the literal prefilter of the SAST pattern rules."""
+from pathlib import Path
+
+import pytest
+from libsast.core_matcher.helpers import get_rules
+from libsast.core_matcher.pattern_matcher import PatternMatcher
+
+from sources.sast_prefilter import (
+    PrefilterPatternMatcher,
+    get_regex_literals,
+    get_rule_literals,
+)
+
+ROOT = Path(__file__).resolve().parent.parent
+SAMPLES = Path(__file__).resolve().parent / 'data' / 'sast'
+RULE_FILES = (
+    'sources/androidRules/android_rules.yaml',
+    'sources/androidRules/android_apis.yaml',
+    'sources/MalwareAnalyzer/behaviour_rules.yaml',
+)
+
+
+@pytest.mark.parametrize('regex, literals', [
+    # Case insensitive, as a whole or in a group
+    (r'(?i)webview', None),
+    (r'foo(?i:bar)', {'foo'}),
+    (r'(?i:bar)baz', {'baz'}),
+    # Alternations, a branch without literals drops the group
+    (r'(loadUrl|evaluateJavascript)\(', {'loadUrl', 'evaluateJavascript'}),
+    (r'(loadUrl|\w+)\(x', {'(x'}),
+    (r'x|yz', {'x', 'yz'}),
+    (r'[a-z]+', None),
+    # Optional groups are not required, repeated ones are
+    (r'(abc){0,3}def', {'def'}),
+    (r'(abc)?de', {'de'}),
+    (r'(abc){1,3}d', {'abc'}),
+    (r'(?:foo|bar)baz+', {'foo', 'bar'}),
+    # Escapes are unescaped
+    (r'\.getDeviceId\(', {'.getDeviceId('}),
+    (r'a\.b\\c', {'a.b\\c'}),
+    (r'MessageDigest\.getInstance\(\s*"MD5"', {'MessageDigest.getInstance('}),
+])
+def test_get_regex_literals(regex, literals):
+    found = get_regex_literals(regex)
+    assert (found if found is None else set(found)) == literals
+
+
+def test_case_insensitive_rule_is_always_evaluated():
+    rule = {'type': 'Regex', 'pattern': r'\.getDeviceId\(', 'input_case': 'lower'}
+    assert get_rule_literals(rule) == ()
+
+
+def read_samples():
+    return [(path, path.read_text('utf-8'))
+            for path in sorted(SAMPLES.rglob('*')) if path.is_file()]
+
+
+@pytest.mark.parametrize('rule_file', RULE_FILES)
+def test_same_findings_as_pattern_matcher(rule_file):
+    rule_path = (ROOT / rule_file).as_posix()
+    file_contents = read_samples()
+    findings = []
+    for cls in (PatternMatcher, PrefilterPatternMatcher):
+        matcher = cls({
+            'match_rules': rule_path,
+            'match_extensions': {'.java', '.kt'},
+            'multiprocessing': 'thread',
+            'cpu_core': 1,
+        })
+        findings.append(matcher.regex_scan(file_contents, rule_path))
+    assert findings[0]
+    assert findings[0] == findings[1]
@@ -0,0 +1,24 @@
+# -*- coding: utf_8 -*-
+"""Tests of the common helpers."""
+import os
+
+import pytest
+
+from sources.common.utils import atomic_write
+
+
+def test_atomic_write(tmp_path):
+    text_file = tmp_path / 'cache' / 'entry.json'
+    atomic_write(str(text_file), '{"a": 1}')
+    atomic_write(str(tmp_path / 'cache' / 'entry.bin'), b'\x00\x01', 0o644)
+    assert text_file.read_text() == '{"a": 1}'
+    assert (tmp_path / 'cache' / 'entry.bin').read_bytes() == b'\x00\x01'
+    assert os.stat(tmp_path / 'cache' / 'entry.bin').st_mode & 0o777 == 0o644
+
+
+def test_atomic_write_removes_the_temporary_file(tmp_path):
+    atomic_write(str(tmp_path / 'entry.json'), 'old')
+    with pytest.raises(TypeError):
+        atomic_write(str(tmp_path / 'entry.json'), object())
+    assert os.listdir(tmp_path) == ['entry.json']
+    assert (tmp_path / 'entry.json').read_text() == 'old'
@@ -15,13 +15,16 @@ import re
 import unicodedata
 import zipfile
 from hashlib import md5, sha1, sha224, sha256, sha384, sha512
-from struct import unpack
+from concurrent.futures import ThreadPoolExecutor
+from struct import pack, unpack
 from typing import Any, Iterator, List, Tuple, Union
 from xml.dom.pulldom import SAX2DOM
 from zlib import crc32
 
+import lxml.etree
 import lxml.sax
-from .apkinspector.headers import ZipEntry
+from .apkinspector.extract import extract_head_based_on_central_directory
+from .apkinspector.headers import MmapFile, ZipEntry
 
 # Used for reading Certificates
 from asn1crypto import cms, keys, x509
@@ -112,6 +115,83 @@ class BrokenAPKError(Error):
     pass
 
 
+# Integrity policies of APK(testzip=...)
+INTEGRITY_POLICIES = ("off", "cd", "full")
+
+# File types told apart by get_file_type(), as (type, ((offset, magic), ...))
+# All the magics of a type must match, the first matching type wins
+FILE_SIGNATURES = (
+    ("DEX", ((0, b"dex\n"),)),
+    ("ODEX", ((0, b"dey\n"),)),
+    ("ELF", ((0, b"\x7fELF"),)),
+    ("ZIP", ((0, b"PK\x03\x04"),)),
+    ("ZIP", ((0, b"PK\x05\x06"),)),
+    ("PNG", ((0, b"\x89PNG\r\n\x1a\n"),)),
+    ("JPEG", ((0, b"\xff\xd8\xff"),)),
+    ("GIF", ((0, b"GIF8"),)),
+    ("WEBP", ((0, b"RIFF"), (8, b"WEBP"))),
+    ("AXML", ((0, b"\x03\x00\x08\x00"),)),
+    ("ARSC", ((0, b"\x02\x00\x0c\x00"),)),
+    ("JKS", ((0, b"\xfe\xed\xfe\xed"),)),
+    ("JCEKS", ((0, b"\xce\xce\xce\xce"),)),
+    # BouncyCastle keystore: version 1 or 2, then a 20 bytes salt
+    ("BKS", ((0, b"\x00\x00\x00\x02\x00\x00\x00\x14"),)),
+    ("BKS", ((0, b"\x00\x00\x00\x01\x00\x00\x00\x14"),)),
+    ("PEM", ((0, b"-----BEGIN "),)),
+    ("XML", ((0, b"<?xml"),)),
+)
+
+# Number of bytes of each entry read by get_files_types()
+FILE_HEAD_SIZE = 16
+
+# File types by (CRC32, size) of the entries, shared by the APKs of a process
+_FILE_TYPES_CACHE = {}
+FILE_TYPES_CACHE_SIZE = 65536
+
+
+def _get_der_type(buffer: bytes) -> Union[str, None]:
+    """
+    Return PKCS12 or X509 if the buffer starts like a DER keystore or
+    certificate, None otherwise.
+
+    :param buffer: the first bytes of a file
+    """
+    if len(buffer) < 2 or buffer[0] != 0x30:
+        return None
+    # Length of the outer SEQUENCE, short, long or indefinite form
+    if 0x81 <= buffer[1] <= 0x84:
+        inner = buffer[2 + (buffer[1] & 0x7F):]
+    elif buffer[1] <= 0x80:
+        inner = buffer[2:]
+    else:
+        return None
+    if inner[:3] == b"\x02\x01\x03":
+        # PFX version 3
+        return "PKCS12"
+    if inner[:1] == b"\x30" and len(inner) > 1 and 0x81 <= inner[1] <= 0x84:
+        # tbsCertificate with an explicit version [0]
+        if inner[2 + (inner[1] & 0x7F):][:4] == b"\xa0\x03\x02\x01":
+            return "X509"
+    return None
+
+
+def get_file_type(buffer: bytes) -> str:
+    """
+    Return the file type of a buffer from its first bytes, using
+    `FILE_SIGNATURES`, "Unknown" if no signature matches.
+
+    :param buffer: the first `FILE_HEAD_SIZE` bytes of a file, at least
+    :returns: str of filetype
+    """
+    for ftype, magics in FILE_SIGNATURES:
+        if all(
+            buffer[offset:offset + len(magic)] == magic
+            for offset, magic in magics
+        ):
+            return ftype
+    return _get_der_type(buffer) or "Unknown"
+
+
 def _dump_additional_attributes(additional_attributes):
     """try to parse additional attributes, but ends up to hexdump if the scheme is unknown"""
 
@@ -310,6 +390,19 @@ class APK:
         0x0301: "DSA with SHA2-256 digest",
     }
 
+    # Hash of the chunked content digest of each signature algorithm (v2/v3).
+    # 0x0421 (verity) digests a Merkle tree instead and is not supported.
+    _APK_SIG_CONTENT_DIGESTS = {
+        0x0101: "sha256",
+        0x0102: "sha512",
+        0x0103: "sha256",
+        0x0104: "sha512",
+        0x0201: "sha256",
+        0x0202: "sha512",
+        0x0301: "sha256",
+    }
+    _APK_SIG_CHUNK_SIZE = 1024 * 1024
+
     __no_magic = False
 
     def __init__(
@@ -318,7 +411,7 @@ class APK:
         raw: bool = False,
         magic_file: Union[str, None] = None,
         skip_analysis: bool = False,
-        testzip: bool = False,
+        testzip: Union[bool, str] = False,
     ) -> None:
         """
         This class can access to all elements in an APK file
@@ -332,13 +425,16 @@ class APK:
         :param raw: specify if the filename is a path or raw data (optional)
         :param magic_file: specify the magic file (not used anymore - legacy only)
         :param skip_analysis: Skip the analysis, e.g. no manifest files are read. (default: False)
-        :param testzip: Test the APK for integrity, e.g. if the ZIP file is broken. Throw an exception on failure (default False)
+        :param testzip: Integrity policy (default False).
+            'off' (or False) skips the test, 'cd' checks that every central directory entry points to a local header
+            within the archive, 'full' (or True) also checks the CRC32 of every entry.
+            With 'cd' the problems are logged and kept in `integrity_problems`, with 'full' a BrokenAPKError is thrown.
 
         :type filename: string
         :type raw: boolean
         :type magic_file: string
         :type skip_analysis: boolean
-        :type testzip: boolean
+        :type testzip: boolean or string
 
         """
         if magic_file:
@@ -362,11 +458,14 @@ class APK:
         self._is_signed_v2 = None
         self._is_signed_v3 = None
         self._v2_blocks = {}
+        self._v2_offsets = None
         self._v2_signing_data = None
         self._v3_signing_data = None
+        self._content_digests = {}
 
         self._files = {}
         self.files_crc32 = {}
+        self.integrity_problems = []
 
         if raw is True:
             self.__raw = filename
@@ -375,29 +474,32 @@ class APK:
             self.filename = "raw_apk_sha256:{}".format(self._sha256)
             self.zip = ZipEntry.parse(io.BytesIO(self.__raw), True)
         else:
+            # The APK is memory mapped, the raw bytes are only loaded if get_raw() is called
             self.zip = ZipEntry.parse(filename, False)
-            self.__raw = self.zip.zip.getvalue()
+            self.__raw = None
 
-        if testzip:
+        if testzip is True:
+            testzip = "full"
+        elif not testzip:
+            testzip = "off"
+        if testzip not in INTEGRITY_POLICIES:
+            raise ValueError(
+                "Unknown integrity policy {}, expected one of {}".format(
+                    testzip, INTEGRITY_POLICIES
+                )
+            )
+        if testzip == "cd":
+            # Overlapping or inconsistent local headers are common anti-analysis
+            # tricks on APKs that Android still installs, the APK is still parsed
+            self._test_central_directory(strict=False)
+        elif testzip == "full":
             logger.info(
                 "Testing zip file integrity, this might take a while..."
             )
-            # Test the zipfile for integrity before continuing.
-            # This process might be slow, as the whole file is read.
-            # Therefore it is possible to enable it as a separate feature.
-            #
-            # A short benchmark showed, that testing the zip takes about 10 times longer!
-            # e.g. normal zip loading (skip_analysis=True) takes about 0.01s, where
-            # testzip takes 0.1s!
-            test_zip = zipfile.ZipFile(io.BytesIO(self.__raw), mode="r")
-            ret = test_zip.testzip()
-            if ret is not None:
-                # we could print the filename here, but there are zip which are so broken
-                # That the filename is either very very long or does not make any sense.
-                # Thus we do not do it, the user might find out by using other tools.
-                raise BrokenAPKError(
-                    "The APK is probably broken: testzip returned an error."
-                )
+            # The whole file is read, but the CRC32 are kept in files_crc32
+            # so get_files_crc32() does not read the entries again.
+            self._test_central_directory()
+            self._test_crc32()
 
         if not skip_analysis:
             self._apk_analysis()
@@ -521,28 +623,46 @@ class APK:
 
         We remove the zip from the Object, as it is not pickable
         And it does not make any sense to pickle it anyways.
+        The parsed XML trees are stored as bytes, the AXML and ARSC parsers are
+        dropped and parsed again on demand. The raw bytes are only kept for APKs
+        created from raw data, otherwise the file is mapped again on load.
+
+        :returns: the picklable state of the APK Object, without zip.
+        """
+        # Upon pickling, we need to remove the ZipFile.
+        # Work on a copy, the object itself stays usable
+        state = self.__dict__.copy()
+        del state['zip']
+        state['xml'] = {
+            name: None if xml is None else lxml.etree.tostring(xml)
+            for name, xml in self.xml.items()
+        }
+        state['axml'] = {}
+        state['arsc'] = {}
+        if not self.filename.startswith("raw_apk_sha256:"):
+            state['_APK__raw'] = None
 
-        :returns: the picklable APK Object without zip.
-        """
-        # Upon pickling, we need to remove the ZipFile
-        x = self.__dict__
-        x['axml'] = str(x['axml'])
-        x['xml'] = str(x['xml'])
-        del x['zip']
-
-        return x
+        return state
 
     def __setstate__(self, state):
         """
         Load a pickled APK Object and restore the state
 
-        We load the zip file back by reading __raw from the Object.
+        We load the zip file back from `filename`, or from __raw for APKs
+        created from raw data.
 
         :param state: pickled state
         """
-        self.__dict__ = state
+        self.__dict__.update(state)
+        self.xml = {
+            name: None if xml is None else lxml.etree.fromstring(xml)
+            for name, xml in state['xml'].items()
+        }
 
-        self.zip = zipfile.ZipFile(io.BytesIO(self.get_raw()), mode="r")
+        if self.__raw is not None:
+            self.zip = ZipEntry.parse(io.BytesIO(self.__raw), True)
+        else:
+            self.zip = ZipEntry.parse(self.filename, False)
 
     def _get_res_string_value(self, string):
         if not string.startswith('@string/'):
@@ -857,30 +977,54 @@ class APK:
     #     else:
     #         return self._patch_magic(buffer, ftype)
 
-    # @property
-    # def files(self) -> dict[str, str]:
-    #     """
-    #     Returns a dictionary of filenames and detected magic type
+    @property
+    def files(self) -> dict[str, str]:
+        """
+        Returns a dictionary of filenames and detected file type
 
-    #     :returns: dictionary of files and their mime type
-    #     """
-    #     return self.get_files_types()
+        :returns: dictionary of files and their type
+        """
+        return self.get_files_types()
 
-    # def get_files_types(self) -> dict[str, str]:
-    #     """
-    #     Return the files inside the APK with their associated types (by using python-magic)
+    def get_files_types(self) -> dict[str, str]:
+        """
+        Return the files inside the APK with their associated types (by using `FILE_SIGNATURES`)
 
-    #     At the same time, the CRC32 are calculated for the files.
+        Only the first `FILE_HEAD_SIZE` bytes of each entry are read, in the
+        order of the local headers. The types are cached by the CRC32 and size
+        declared in the central directory, entries already seen in this or
+        another APK are not read again.
 
-    #     :rtype: a dictionary
-    #     """
-    #     if self._files == {}:
-    #         # Generate File Types / CRC List
-    #         for i in self.get_files():
-    #             buffer = self._get_crc32(i)
-    #             self._files[i] = self._get_file_magic_name(buffer)
+        :rtype: a dictionary
+        """
+        if self._files == {}:
+            entries = sorted(
+                self.zip.infolist().items(),
+                key=lambda item: item[1].relative_offset_of_local_file_header,
+            )
+            files = {}
+            with self.zip._lock:
+                for filename, entry in entries:
+                    key = (entry.crc32_of_uncompressed_data, entry.uncompressed_size)
+                    ftype = _FILE_TYPES_CACHE.get(key)
+                    if ftype is None:
+                        try:
+                            head = extract_head_based_on_central_directory(
+                                self.zip.zip, entry, FILE_HEAD_SIZE
+                            )
+                        except Exception as e:
+                            logger.warning("Can not read %s: %s", filename, e)
+                            files[filename] = "Unknown"
+                            continue
+                        ftype = get_file_type(head)
+                        if len(_FILE_TYPES_CACHE) >= FILE_TYPES_CACHE_SIZE:
+                            _FILE_TYPES_CACHE.clear()
+                        _FILE_TYPES_CACHE[key] = ftype
+                    files[filename] = ftype
+            # Same order as get_files()
+            self._files = {i: files[i] for i in self.get_files()}
 
-    #     return self._files
+        return self._files
 
     # def _patch_magic(self, buffer, orig):
     #     """
@@ -927,6 +1071,64 @@ class APK:
                 )
         return buffer
 
+    def _test_central_directory(self, strict=True):
+        """
+        Checks that every central directory entry points to a local header
+        and that its data ends before the central directory.
+        Only the headers are read, they are kept for the later reads.
+
+        :param strict: throw a BrokenAPKError on the first problem, otherwise
+            the problems are logged and appended to `integrity_problems`.
+        """
+        cd_start = self.zip.eocd.offset_of_start_of_central_directory
+        for filename, entry in self.zip.infolist().items():
+            try:
+                local_header = self.zip._get_local_header(filename)
+            except Exception:
+                local_header = None
+            if local_header is None:
+                problem = "no local header for {}".format(filename)
+            else:
+                data_end = (
+                    entry.relative_offset_of_local_file_header
+                    + 30
+                    + local_header.file_name_length
+                    + local_header.extra_field_length
+                    + entry.compressed_size
+                )
+                if data_end <= cd_start:
+                    continue
+                problem = "{} overlaps the central directory".format(filename)
+            if strict:
+                raise BrokenAPKError(
+                    "The APK is probably broken: {}".format(problem)
+                )
+            logger.warning("The APK is probably broken: {}".format(problem))
+            self.integrity_problems.append(problem)
+
+    def _test_crc32(self):
+        """
+        Checks the CRC32 of every entry against the central directory.
+        The calculated values are kept in `files_crc32`.
+        """
+        broken = []
+        for filename, entry in self.zip.infolist().items():
+            try:
+                self._get_crc32(filename)
+            except Exception:
+                broken.append(filename)
+                continue
+            if self.files_crc32[filename] != entry.crc32_of_uncompressed_data:
+                broken.append(filename)
+        if broken:
+            # we could print the filenames here, but there are zip which are so broken
+            # That the filename is either very very long or does not make any sense.
+            raise BrokenAPKError(
+                "The APK is probably broken: {} entries failed the CRC32 test.".format(
+                    len(broken)
+                )
+            )
+
     def get_files_crc32(self) -> dict[str, int]:
         """
         Calculates and returns a dictionary of filenames and CRC32
@@ -962,6 +1164,16 @@ class APK:
                 self.__raw = bytearray(f.read())
             return self.__raw
 
+    def _get_raw_reader(self):
+        """
+        Return a file-like object over the raw APK, without loading it in memory when it is memory mapped
+
+        :rtype: file-like object
+        """
+        if self.__raw is None and hasattr(self.zip.zip, 'reader'):
+            return self.zip.zip.reader()
+        return io.BytesIO(self.get_raw())
+
     def get_file(self, filename: str) -> bytes:
         """
         Return the raw data of the specified filename
@@ -2180,7 +2392,13 @@ class APK:
         try:
             return self.axml["AndroidManifest.xml"]
         except KeyError:
-            return None
+            if "AndroidManifest.xml" not in self.xml:
+                return None
+            # Dropped when pickling, parse it again
+            self.axml["AndroidManifest.xml"] = AXMLPrinter(
+                self.zip.read("AndroidManifest.xml")
+            )
+            return self.axml["AndroidManifest.xml"]
 
     def get_android_manifest_xml(self) -> Union[lxml.etree.Element, None]:
         """
@@ -2267,9 +2485,9 @@ class APK:
         digests = []
         block = io.BytesIO(digest_bytes)
 
-        data_len = self.read_uint32_le(block)
-        while block.tell() < data_len:
-
+        # Sequence of length-prefixed (algorithm ID, length-prefixed digest)
+        while block.tell() < len(digest_bytes):
+            self.read_uint32_le(block)
             algorithm_id = self.read_uint32_le(block)
             digest_len = self.read_uint32_le(block)
             digest = block.read(digest_len)
@@ -2290,7 +2508,7 @@ class APK:
         # * There should be again the size_of_block
         # * Now we can read the Key-Values
         # * IDs with an unknown value should be ignored.
-        f = io.BytesIO(self.get_raw())
+        f = self._get_raw_reader()
 
         size_central = None
         offset_central = None
@@ -2304,6 +2522,7 @@ class APK:
             f.seek(-1, io.SEEK_CUR)
             (r,) = unpack('<4s', f.read(4))
             if r == self._PK_END_OF_CENTRAL_DIR:
+                offset_eocd = f.tell() - 4
                 # Read central dir
                 (
                     this_disk,
@@ -2355,6 +2574,9 @@ class APK:
         (size_of_block_start,) = unpack("<Q", f.read(8))
         if size_of_block_start != size_of_block:
             raise BrokenAPKError("Sizes at beginning and and does not match!")
+        # Offsets of the signing block, central directory and EOCD, the
+        # sections of the content digests
+        self._v2_offsets = (f.tell() - 8, end_offset, offset_eocd)
 
         # Store all blocks
         while f.tell() < end_offset - 24:
@@ -2376,6 +2598,172 @@ class APK:
         if self._APK_SIG_KEY_V3_SIGNATURE in self._v2_blocks:
             self._is_signed_v3 = True
 
+    def _compute_content_digests(self, hash_names, workers=None) -> None:
+        """
+        Compute the v2/v3 content digests of the APK, stored in `_content_digests` by hash name.
+
+        The signing block is skipped and the offset of the central directory in the EOCD is replaced
+        by the offset of the signing block. The 1 MB chunks are hashed straight from the memory mapped
+        APK on a thread pool, hashlib releases the GIL.
+
+        :param hash_names: names of the hashlib functions
+        :param workers: number of threads (default: CPU count, up to 4)
+        """
+        hash_names = [x for x in hash_names if x not in self._content_digests]
+        if not hash_names or not self._v2_offsets:
+            return
+        block_start, cd_start, eocd_start = self._v2_offsets
+        funcs = [getattr(hashlib, x) for x in hash_names]
+        chunk_size = self._APK_SIG_CHUNK_SIZE
+
+        source = self.zip.zip
+        if isinstance(source, MmapFile):
+            view = memoryview(source.buffer)
+        else:
+            view = memoryview(self.get_raw())
+        eocd = bytearray(view[eocd_start:])
+        eocd[16:20] = pack('<I', block_start)
+        chunks = []
+        for start, end in ((0, block_start), (cd_start, eocd_start)):
+            for offset in range(start, end, chunk_size):
+                chunks.append(view[offset: min(offset + chunk_size, end)])
+        chunks.append(memoryview(eocd))
+
+        def digest_chunk(chunk):
+            prefix = b"\xa5" + pack('<I', len(chunk))
+            digests = []
+            for func in funcs:
+                h = func(prefix)
+                h.update(chunk)
+                digests.append(h.digest())
+            return digests
+
+        if workers is None:
+            workers = min(4, os.cpu_count() or 1)
+        try:
+            if workers <= 1:
+                chunk_digests = [digest_chunk(x) for x in chunks]
+            else:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    chunk_digests = list(executor.map(digest_chunk, chunks))
+        finally:
+            # A memory map can't be closed while views on it exist
+            for chunk in chunks:
+                chunk.release()
+            view.release()
+
+        for i, name in enumerate(hash_names):
+            h = funcs[i](b"\x5a" + pack('<I', len(chunk_digests)))
+            for digests in chunk_digests:
+                h.update(digests[i])
+            self._content_digests[name] = h.digest()
+
+    @staticmethod
+    def _verify_v2_v3_signature(algorithm_id, public_key, signature, signed_data):
+        """
+        Verify a v2/v3 signature over the signed data, raise InvalidSignature on failure.
+        """
+        hash_algorithm = (
+            hashes.SHA256()
+            if APK._APK_SIG_CONTENT_DIGESTS[algorithm_id] == "sha256"
+            else hashes.SHA512()
+        )
+        if algorithm_id in (0x0101, 0x0102):
+            public_key.verify(
+                signature,
+                signed_data,
+                padding.PSS(
+                    mgf=padding.MGF1(hash_algorithm),
+                    salt_length=hash_algorithm.digest_size,
+                ),
+                hash_algorithm,
+            )
+        elif algorithm_id in (0x0103, 0x0104):
+            public_key.verify(
+                signature, signed_data, padding.PKCS1v15(), hash_algorithm
+            )
+        elif algorithm_id in (0x0201, 0x0202):
+            public_key.verify(signature, signed_data, ec.ECDSA(hash_algorithm))
+        else:
+            public_key.verify(signature, signed_data, hash_algorithm)
+
+    def _verify_v2_v3_signers(self, signers, workers=None) -> Union[bool, None]:
+        """
+        Verify the signers of a v2/v3 signing block: the signatures over the signed data, the public key
+        of the first certificate and the content digests.
+
+        :returns: True if every signer verifies, None if a signer only uses unsupported algorithms
+        """
+        if not signers:
+            return False
+        supported = [
+            [x for x in signer.signed_data.digests if x[0] in self._APK_SIG_CONTENT_DIGESTS]
+            for signer in signers
+        ]
+        if not all(supported):
+            return None
+        self._compute_content_digests(
+            {self._APK_SIG_CONTENT_DIGESTS[x[0]] for digests in supported for x in digests},
+            workers,
+        )
+        for signer, digests in zip(signers, supported):
+            signed_data = signer.signed_data
+            if [x[0] for x in signer.signatures] != [x[0] for x in signed_data.digests]:
+                logger.warning("Signature and digest algorithms of the signer do not match")
+                return False
+            if not signed_data.certificates:
+                return False
+            cert = x509.Certificate.load(signed_data.certificates[0])
+            if cert.public_key.dump() != signer.public_key:
+                logger.warning("Public key of the signer does not match its certificate")
+                return False
+            public_key = serialization.load_der_public_key(
+                signer.public_key, backend=default_backend()
+            )
+            for algorithm_id, signature in signer.signatures:
+                if algorithm_id not in self._APK_SIG_CONTENT_DIGESTS:
+                    continue
+                try:
+                    self._verify_v2_v3_signature(
+                        algorithm_id, public_key, signature, signed_data._bytes
+                    )
+                except InvalidSignature:
+                    logger.warning("Invalid signature of the signed data")
+                    return False
+            for algorithm_id, digest in digests:
+                if digest != self._content_digests[self._APK_SIG_CONTENT_DIGESTS[algorithm_id]]:
+                    logger.warning("Content digest of the APK does not match the signed digest")
+                    return False
+        return True
+
+    def verify_signature_v2(self, workers=None) -> Union[bool, None]:
+        """
+        Verify the v2 signature (APK Signature Scheme v2) without loading the APK in memory.
+
+        :param workers: number of threads hashing the APK chunks
+        :returns: True if verified, False if not signed with v2 or the verification fails,
+            None if the signer only uses unsupported algorithms
+        """
+        if not self.is_signed_v2():
+            return False
+        if self._v2_signing_data is None:
+            self.parse_v2_signing_block()
+        return self._verify_v2_v3_signers(self._v2_signing_data, workers)
+
+    def verify_signature_v3(self, workers=None) -> Union[bool, None]:
+        """
+        Verify the v3 signature (APK Signature Scheme v3) without loading the APK in memory.
+
+        :param workers: number of threads hashing the APK chunks
+        :returns: True if verified, False if not signed with v3 or the verification fails,
+            None if the signer only uses unsupported algorithms
+        """
+        if not self.is_signed_v3():
+            return False
+        if self._v3_signing_data is None:
+            self.parse_v3_signing_block()
+        return self._verify_v2_v3_signers(self._v3_signing_data, workers)
+
     def parse_v3_signing_block(self) -> None:
         """
         Parse the V2 signing block and extract all features
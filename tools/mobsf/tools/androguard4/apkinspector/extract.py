@@ -1,5 +1,6 @@
 # -*- coding: utf_8 -*-
 # flake8: noqa
+import struct
 import zlib
 import os
 
@@ -62,6 +63,54 @@ def extract_file_based_on_header_info(apk_file, local_header_info, central_direc
     return extracted_data, indicator
 
 
+def extract_head_based_on_central_directory(apk_file, central_directory_entry, size):
+    """
+    Extracts the first bytes of a single file, reading only its local header and as much data as needed
+    to get them. The compression method is handled as in extract_file_based_on_header_info.
+
+    :param apk_file: The APK file e.g. with open('test.apk', 'rb') as apk_file
+    :type apk_file: bytesIO
+    :param central_directory_entry: The central directory entry of the file
+    :type central_directory_entry: CentralDirectoryEntry
+    :param size: the number of bytes to extract
+    :type size: int
+    :return: Returns the first size bytes of the file, less if the file is smaller, or b'' if the local header is missing.
+    :rtype: bytes
+    """
+    offset = central_directory_entry.relative_offset_of_local_file_header
+    apk_file.seek(offset)
+    local_header = apk_file.read(30)
+    if len(local_header) < 30 or local_header[:4] != b'\x50\x4b\x03\x04':
+        return b''
+    compression_method, = struct.unpack_from('<H', local_header, 8)
+    compressed_size, uncompressed_size, filename_length, extra_field_length = struct.unpack_from(
+        '<IIHH', local_header, 18)
+    if compressed_size == 0 or uncompressed_size == 0:
+        compressed_size = central_directory_entry.compressed_size
+        uncompressed_size = central_directory_entry.uncompressed_size
+    apk_file.seek(offset + 30 + filename_length + extra_field_length)
+    if compression_method == 0 or (compression_method != 8 and compressed_size == uncompressed_size):
+        return apk_file.read(min(size, uncompressed_size))
+    cur_loc = apk_file.tell()
+    decompressor = zlib.decompressobj(-15)
+    head = b''
+    remaining = compressed_size
+    try:
+        # A deflate block header is at most a few hundred bytes
+        while len(head) < size and remaining > 0 and not decompressor.eof:
+            compressed_data = apk_file.read(min(1024, remaining))
+            if not compressed_data:
+                break
+            remaining -= len(compressed_data)
+            head += decompressor.decompress(compressed_data, size - len(head))
+    except zlib.error:
+        if compression_method == 8:
+            return b''
+        apk_file.seek(cur_loc)
+        return apk_file.read(min(size, uncompressed_size))
+    return head
+
+
 def extract_all_files_from_central_directory(apk_file, central_directory_entries, local_header_entries, output_dir):
     """
     Extracts all files from an APK based on the entries detected in the central_directory_entries.
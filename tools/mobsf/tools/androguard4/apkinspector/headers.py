@@ -2,14 +2,83 @@
 # flake8: noqa
 # ApkInspector - Nov 24, 2024 - 293ab2d89ab9ce011c7dbbc5df3c876172875a1c
 import io
+import mmap
 import os
 import struct
+import threading
 from typing import Dict
 
 from .extract import extract_file_based_on_header_info, extract_all_files_from_central_directory
 from .helpers import pretty_print_header, save_to_json, save_data_to_file
 
 
+class MmapFile:
+    """
+    Read-only file-like object over a memory map of the APK. The pages are loaded by the OS on demand,
+    so the APK is never copied in memory. Unlike mmap.seek, seek returns the new position, as io.BytesIO does.
+    """
+
+    def __init__(self, buffer, pos=0):
+        self.buffer = buffer
+        self.pos = pos
+
+    @classmethod
+    def open(cls, path):
+        """
+        Map the file at path. Empty files can't be mapped, an empty io.BytesIO is returned instead.
+
+        :param path: path of the file
+        :type path: str
+        :return: the file-like object
+        :rtype: MmapFile or io.BytesIO
+        """
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return io.BytesIO(b'')
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += len(self.buffer)
+        if offset < 0:
+            raise ValueError(f"negative seek value {offset}")
+        self.pos = offset
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        end = len(self.buffer) if size is None or size < 0 else self.pos + size
+        data = self.buffer[self.pos:end]
+        self.pos += len(data)
+        return data
+
+    def reader(self):
+        """
+        New file-like object over the same memory map with its own position, for concurrent readers.
+
+        :rtype: MmapFile
+        """
+        return MmapFile(self.buffer)
+
+    def getvalue(self):
+        """
+        The whole content as bytes, like io.BytesIO.getvalue. This copies the file in memory.
+
+        :rtype: bytes
+        """
+        return self.buffer[:]
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def close(self):
+        self.buffer.close()
+
+
 class EndOfCentralDirectoryRecord:
     """
     A class to provide details about the end of central directory record.
@@ -398,19 +467,23 @@ class LocalHeaderRecord:
 class ZipEntry:
     """
     Is the actual APK represented as a composition of the previous classes, which are: the EndOfCentralDirectoryRecord, the CentralDirectory and a dictionary of values of LocalHeaderRecord.
+    The local headers are parsed lazily, the first time an entry is read, and keyed by the central directory filename.
     """
 
     def __init__(self, zip_bytes, eocd: EndOfCentralDirectoryRecord, central_directory: CentralDirectory,
-                 local_headers: Dict[str, LocalHeaderRecord]):
+                 local_headers: Dict[str, LocalHeaderRecord] = None):
         self.zip = zip_bytes
         self.eocd = eocd
         self.central_directory = central_directory
-        self.local_headers = local_headers
+        self._local_headers = local_headers if local_headers is not None else {}
+        # zip is a single file-like object shared by every reader
+        self._lock = threading.RLock()
 
     @classmethod
     def parse(cls, inc_apk, raw: bool = True):
         """
         Method to start processing an APK. The raw (bytes) APK may be passed or the path to it.
+        A path is memory mapped instead of read, and only the central directory is parsed upfront.
 
         :param inc_apk: the incoming apk, either path or bytes
         :type inc_apk: str or bytesIO
@@ -422,16 +495,40 @@ class ZipEntry:
         if raw:
             apk_file = inc_apk
         else:
-            with open(inc_apk, 'rb') as apk:
-                apk_file = io.BytesIO(apk.read())
+            apk_file = MmapFile.open(inc_apk)
         eocd = EndOfCentralDirectoryRecord.parse(apk_file)
         central_directory = CentralDirectory.parse(apk_file, eocd)
-        local_headers = {}
-        for entry in central_directory.entries:
-            local_header_entry = LocalHeaderRecord.parse(
-                apk_file, central_directory.entries[entry])
-            local_headers[local_header_entry.filename] = local_header_entry
-        return cls(apk_file, eocd, central_directory, local_headers)
+        return cls(apk_file, eocd, central_directory)
+
+    @property
+    def local_headers(self) -> Dict[str, LocalHeaderRecord]:
+        """
+        Local headers of every entry in the central directory. This parses all the pending ones.
+
+        :rtype: dict
+        """
+        for filename in self.central_directory.entries:
+            self._get_local_header(filename)
+        return self._local_headers
+
+    def _get_local_header(self, filename):
+        local_header = self._local_headers.get(filename)
+        if local_header is None and filename in self.central_directory.entries:
+            with self._lock:
+                local_header = LocalHeaderRecord.parse(
+                    self.zip, self.central_directory.entries[filename])
+            if local_header is not None:
+                self._local_headers[filename] = local_header
+        return local_header
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
 
     @classmethod
     def parse_single(cls, apk_file, filename, eocd: EndOfCentralDirectoryRecord = None,
@@ -494,8 +591,9 @@ class ZipEntry:
         :return: returns a ditionary of the local header entry or None if the filename is not found
         :rtype: dict
         """
-        if filename in self.local_headers:
-            return self.local_headers[filename].to_dict()
+        local_header = self._get_local_header(filename)
+        if local_header is not None:
+            return local_header.to_dict()
         else:
             raise KeyError(
                 f"Key: {filename} was not found within the local headers list!")
@@ -511,8 +609,10 @@ class ZipEntry:
         :return: returns the raw bytes of the filename that was extracted
         :rtype: bytes
         """
-        extracted_file = extract_file_based_on_header_info(self.zip, self.get_local_header_dict(name),
-                                                           self.get_central_directory_entry_dict(name))[0]
+        local_header = self.get_local_header_dict(name)
+        with self._lock:
+            extracted_file = extract_file_based_on_header_info(self.zip, local_header,
+                                                               self.get_central_directory_entry_dict(name))[0]
         if save:
             save_data_to_file(f"EXTRACTED_{name}", extracted_file)
         return extracted_file
@@ -545,8 +645,9 @@ class ZipEntry:
         :type apk_name: str
         """
         output_path = os.path.join(extract_path, apk_name)
-        if not extract_all_files_from_central_directory(self.zip, self.to_dict()["central_directory"],
-                                                        self.to_dict()["local_headers"], output_path):
+        entries = self.to_dict()
+        if not extract_all_files_from_central_directory(self.zip, entries["central_directory"],
+                                                        entries["local_headers"], output_path):
             print(f"Extraction successful for: {apk_name}")
 
 
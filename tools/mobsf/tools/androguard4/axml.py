@@ -10,6 +10,9 @@ import binascii
 import collections
 import io
 import re
+import sys
+import threading
+from array import array
 from collections import defaultdict
 from struct import pack, unpack
 from typing import BinaryIO, Union
@@ -155,20 +158,16 @@ class StringBlock:
                 "This is not a problem but could indicate packers."
             )
 
-        self.m_stringOffsets = []
-        self.m_styleOffsets = []
         self.m_charbuff = ""
-        self.m_styles = []
+        self._strings = None
 
         # Next, there is a list of string following.
         # This is only a list of offsets (4 byte each)
-        for i in range(self.stringCount):
-            self.m_stringOffsets.append(unpack('<I', buff.read(4))[0])
+        self.m_stringOffsets = self._read_uint32_array(buff, self.stringCount)
 
         # And a list of styles
         # again, a list of offsets
-        for i in range(self.styleCount):
-            self.m_styleOffsets.append(unpack('<I', buff.read(4))[0])
+        self.m_styleOffsets = self._read_uint32_array(buff, self.styleCount)
 
         # FIXME it is probably better to parse n strings and not calculate the size
         size = self.header.size - self.stringsOffset
@@ -183,14 +182,38 @@ class StringBlock:
 
         self.m_charbuff = buff.read(size)
 
+        self.m_styles = array('I')
         if self.stylesOffset != 0 and self.styleCount != 0:
             size = self.header.size - self.stylesOffset
 
             if (size % 4) != 0:
                 logger.warning("Size of styles is not aligned by four bytes.")
 
-            for i in range(0, size // 4):
-                self.m_styles.append(unpack('<I', buff.read(4))[0])
+            self.m_styles = self._read_uint32_array(buff, size // 4)
+
+    @staticmethod
+    def _read_uint32_array(buff: BinaryIO, count: int) -> array:
+        """
+        Read `count` little endian uint32 in a single call
+
+        :param buff: buffer set to the position of the first value
+        :param count: number of values
+        :return: array of int
+        """
+        values = array('I')
+        if count <= 0:
+            return values
+        data = buff.read(count * 4)
+        if len(data) != count * 4:
+            raise ResParserError(
+                "Can not read {} offsets, the string pool is truncated".format(
+                    count
+                )
+            )
+        values.frombytes(data)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
 
     def __repr__(self):
         return "<StringPool #strings={}, #styles={}, UTF8={}>".format(
@@ -213,8 +236,7 @@ class StringBlock:
         """
         Iterable over all strings
         """
-        for i in range(self.stringCount):
-            yield self.getString(i)
+        yield from self.getStrings()
 
     def getString(self, idx: int) -> str:
         """
@@ -223,6 +245,9 @@ class StringBlock:
         :param idx: index in the string table
         :return: str
         """
+        if self._strings is not None and 0 <= idx < len(self._strings):
+            return self._strings[idx]
+
         if idx in self._cache:
             return self._cache[idx]
 
@@ -238,6 +263,108 @@ class StringBlock:
 
         return self._cache[idx]
 
+    def getStrings(self) -> list[str]:
+        """
+        Return all the strings of the table, decoded in a single pass
+
+        The whole pool is decoded at once (latin-1 for UTF-8 pools, utf-16 for
+        UTF-16 pools) and every string is a slice of it. Strings which do not fit
+        the fast path (non ASCII UTF-8, surrogates, malformed entries) are decoded
+        one by one with :meth:`getString`.
+
+        :return: list of str
+        """
+        if self._strings is None:
+            if not self.m_stringOffsets:
+                self._strings = []
+            elif self.m_isUTF8:
+                self._strings = self._decode_all8()
+            else:
+                self._strings = self._decode_all16()
+        return self._strings
+
+    def _decode_all8(self) -> list[str]:
+        """
+        Decode all the strings of an UTF-8 pool, see :meth:`getStrings`
+
+        :return: list of str
+        """
+        buff = self.m_charbuff
+        buff_len = len(buff)
+        # latin-1 maps every byte to one char, offsets stay the same
+        text = buff.decode('latin-1')
+        strings = []
+        append = strings.append
+        for idx, offset in enumerate(self.m_stringOffsets[:self.stringCount]):
+            if offset + 4 > buff_len:
+                append(self.getString(idx))
+                continue
+            str_len = buff[offset]
+            if str_len & 0x80:
+                str_len = ((str_len & 0x7F) << 8) | buff[offset + 1]
+                offset += 2
+            else:
+                offset += 1
+            encoded_bytes = buff[offset]
+            if encoded_bytes & 0x80:
+                if offset + 1 >= buff_len:
+                    append(self.getString(idx))
+                    continue
+                encoded_bytes = ((encoded_bytes & 0x7F) << 8) | buff[offset + 1]
+                offset += 2
+            else:
+                offset += 1
+            end = offset + encoded_bytes
+            if end >= buff_len or buff[end] != 0:
+                append(self.getString(idx))
+                continue
+            string = text[offset:end]
+            if str_len == encoded_bytes and string.isascii():
+                append(string)
+            else:
+                append(self._decode_bytes(buff[offset:end], 'utf-8', str_len))
+        return strings
+
+    def _decode_all16(self) -> list[str]:
+        """
+        Decode all the strings of an UTF-16 pool, see :meth:`getStrings`
+
+        :return: list of str
+        """
+        buff = self.m_charbuff
+        units = array('H')
+        units.frombytes(buff[:len(buff) & ~1])
+        if sys.byteorder == 'big':
+            units.byteswap()
+        text = buff[:len(units) * 2].decode('utf-16-le', 'replace')
+        # With surrogate pairs the slices would not match the offsets,
+        # every string is decoded on its own
+        sliceable = len(text) == len(units)
+        units_len = len(units)
+        strings = []
+        append = strings.append
+        for idx, offset in enumerate(self.m_stringOffsets[:self.stringCount]):
+            pos = offset >> 1
+            if offset & 1 or pos + 2 > units_len:
+                append(self.getString(idx))
+                continue
+            str_len = units[pos]
+            if str_len & 0x8000:
+                str_len = ((str_len & 0x7FFF) << 16) | units[pos + 1]
+                pos += 2
+            else:
+                pos += 1
+            end = pos + str_len
+            if end >= units_len or units[end] != 0:
+                append(self.getString(idx))
+            elif sliceable and (not str_len or units[pos] not in (0xFEFF, 0xFFFE)):
+                append(text[pos:end])
+            else:
+                # 'utf-16' honours a leading BOM, as _decode16 does
+                append(self._decode_bytes(
+                    buff[pos * 2:end * 2], 'utf-16', str_len))
+        return strings
+
     def getStyle(self, idx: int) -> int:
         """
         Return the style associated with the index
@@ -444,6 +571,14 @@ class AXMLParser:
     See http://androidxref.com/9.0.0_r3/xref/frameworks/base/libs/androidfw/include/androidfw/ResourceTypes.h#563
     """
 
+    __slots__ = (
+        '_valid', 'axml_tampered', 'buff', 'buff_size', 'packerwarning',
+        'filesize', 'sb', 'm_resourceIDs', 'namespaces', 'm_event',
+        'm_lineNumber', 'm_comment_index', 'm_name', 'm_namespaceUri',
+        'm_attributes', 'm_attribute_count', 'm_idAttribute',
+        'm_classAttribute', 'm_styleAttribute', 'at_start', 'at_size',
+    )
+
     def __init__(self, raw_buff: bytes) -> None:
         logger.debug("AXMLParser")
 
@@ -577,7 +712,8 @@ class AXMLParser:
         self.m_lineNumber = -1
         self.m_name = -1
         self.m_namespaceUri = -1
-        self.m_attributes = []
+        # Flat uint32 array, ATTRIBUTE_LENGTH fields per attribute
+        self.m_attributes = array('I')
         self.m_idAttribute = -1
         self.m_classAttribute = -1
         self.m_styleAttribute = -1
@@ -1610,6 +1746,11 @@ class ARSCParser:
 
     Each package is a chunk of type RES_TABLE_PACKAGE_TYPE.
     It contains again many more chunks.
+
+    The constructor only indexes the chunks. The entries of a resource type are
+    parsed the first time the type is queried (:meth:`get_res_configs`,
+    :meth:`get_id`, :meth:`get_string_resources`, :meth:`get_resolved_strings`...),
+    the whole table only by the methods listing every type or locale.
     """
 
     def __init__(self, raw_buff: bytes) -> None:
@@ -1628,9 +1769,21 @@ class ARSCParser:
 
         self.analyzed = False
         self._resolved_strings = None
+        self._string_index = {}
+        # Resource types are indexed on the first pass and their entries are
+        # parsed on demand, see _load_type()
+        self._lock = threading.RLock()
+        self._chunks = defaultdict(list)
+        self._types = defaultdict(list)
+        self._locales = defaultdict(dict)
+        self._loaded_types = {}
+        self._loaded_groups = set()
+        self._type_values = {}
         self.packages = defaultdict(list)
         self.values = {}
-        self.resource_values = defaultdict(defaultdict)
+        # resource id -> (config, entry) for the resources with a single
+        # config (most of them), {config: entry} otherwise. See _get_res_options()
+        self.resource_values = {}
         self.resource_configs = defaultdict(lambda: defaultdict(set))
         self.resource_keys = defaultdict(lambda: defaultdict(defaultdict))
         self.stringpool_main = None
@@ -1787,95 +1940,36 @@ class ARSCParser:
                         # we are way off the package chunk; bail out
                         break
 
-                    self.packages[package_name].append(pkg_chunk_header)
-
                     if pkg_chunk_header.type == RES_TABLE_TYPE_SPEC_TYPE:
-                        self.packages[package_name].append(
-                            ARSCResTypeSpec(self.buff, pc)
+                        self._chunks[package_name].append(
+                            (pkg_chunk_header, ARSCResTypeSpec(self.buff, pc))
                         )
 
                     elif pkg_chunk_header.type == RES_TABLE_TYPE_TYPE:
-                        # Parse a RES_TABLE_TYPE
-                        # http://androidxref.com/9.0.0_r3/xref/frameworks/base/tools/aapt2/format/binary/BinaryResourceParser.cpp#311
-                        start_of_chunk = self.buff.tell() - 8
-                        expected_end_of_chunk = (
-                            start_of_chunk + pkg_chunk_header.size
-                        )
+                        # Only the ResTable_type header and its config are read,
+                        # the entries are parsed by _load_type()
                         a_res_type = ARSCResType(self.buff, pc)
-                        self.packages[package_name].append(a_res_type)
+                        a_res_type.chunk = pkg_chunk_header
+                        a_res_type.offsets_start = self.buff.tell()
+                        self._chunks[package_name].append(
+                            (pkg_chunk_header, a_res_type)
+                        )
+                        self._types[package_name].append(a_res_type)
                         self.resource_configs[package_name][a_res_type].add(
                             a_res_type.config
                         )
-
-                        logger.debug("Config: {}".format(a_res_type.config))
-
-                        entries = []
-                        FLAG_OFFSET16 = 0x02
-                        NO_ENTRY_16 = 0xFFFF
-                        NO_ENTRY_32 = 0xFFFFFFFF
-                        expected_entries_start = (
-                            start_of_chunk + a_res_type.entriesStart
+                        self._locales[package_name].setdefault(
+                            a_res_type.config.get_language_and_region()
                         )
 
-                        # Helper function to convert 16-bit offset to 32-bit
-                        def offset_from16(off16):
-                            return (
-                                NO_ENTRY_16
-                                if off16 == NO_ENTRY_16
-                                else off16 * 4
-                            )
-
-                        for i in range(0, a_res_type.entryCount):
-                            current_package.mResId = (
-                                current_package.mResId & 0xFFFF0000 | i
-                            )
-                            # Check if FLAG_OFFSET16 is set
-                            if a_res_type.flags & FLAG_OFFSET16:
-                                # Read as 16-bit offset
-                                offset_16 = unpack('<H', self.buff.read(2))[0]
-                                offset = offset_from16(offset_16)
-                                if offset == NO_ENTRY_16:
-                                    continue
-                            else:
-                                # Read as 32-bit offset
-                                offset = unpack('<I', self.buff.read(4))[0]
-                                if offset == NO_ENTRY_32:
-                                    continue
-                            entries.append((offset, current_package.mResId))
-
-                        self.packages[package_name].append(entries)
-
-                        base_offset = self.buff.tell()
-                        if base_offset + ((4 - (base_offset % 4)) % 4) != expected_entries_start:
-                            # FIXME: seems like I am missing 2 bytes here in some cases, though it does not affect the result
-                            logger.warning(
-                                "Something is off here! We are not where the entries should start."
-                            )
-                        base_offset = expected_entries_start
-                        for entry_offset, res_id in entries:
-                            if entry_offset != -1:
-                                ate = ARSCResTableEntry(
-                                    self.buff,
-                                    base_offset + entry_offset,
-                                    expected_end_of_chunk,
-                                    res_id,
-                                    pc,
-                                )
-                                self.packages[package_name].append(ate)
-                                if ate.is_weak():
-                                    # FIXME we are not sure how to implement the FLAG_WEAK!
-                                    # We saw the following: There is just a single Res_value after the ARSCResTableEntry
-                                    # and then comes the next ARSCHeader.
-                                    # Therefore we think this means all entries are somehow replicated?
-                                    # So we do some kind of hack here. We set the idx to the entry again...
-                                    # Now we will read all entries!
-                                    # Not sure if this is a good solution though
-                                    self.buff.seek(ate.start)
+                        logger.debug("Config: {}".format(a_res_type.config))
                     elif pkg_chunk_header.type == RES_TABLE_LIBRARY_TYPE:
+                        self._chunks[package_name].append((pkg_chunk_header, None))
                         logger.warning(
                             "RES_TABLE_LIBRARY_TYPE chunk is not supported"
                         )
                     else:
+                        self._chunks[package_name].append((pkg_chunk_header, None))
                         # Unknown / not-handled chunk type
                         logger.warning(
                             "Unknown chunk type encountered inside RES_TABLE_PACKAGE: %s",
@@ -1893,103 +1987,226 @@ class ARSCParser:
             # move to the next resource chunk
             self.buff.seek(res_header.end)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def _load_type(self, a_res_type: ARSCResType) -> list:
+        """
+        Parse the entries of a `ResTable_type` chunk, once
+
+        :param a_res_type: a type indexed by the first pass
+        :return: list of :class:`ARSCResTableEntry`
+        """
+        loaded = self._loaded_types.get(id(a_res_type))
+        if loaded is not None:
+            return loaded
+        with self._lock:
+            loaded = self._loaded_types.get(id(a_res_type))
+            if loaded is not None:
+                return loaded
+            # http://androidxref.com/9.0.0_r3/xref/frameworks/base/tools/aapt2/format/binary/BinaryResourceParser.cpp#311
+            start_of_chunk = a_res_type.chunk.start
+            expected_end_of_chunk = start_of_chunk + a_res_type.chunk.size
+            expected_entries_start = start_of_chunk + a_res_type.entriesStart
+
+            FLAG_OFFSET16 = 0x02
+            NO_ENTRY_16 = 0xFFFF
+            NO_ENTRY_32 = 0xFFFFFFFF
+
+            self.buff.seek(a_res_type.offsets_start)
+            # All the offsets in a single read
+            offsets = array('H' if a_res_type.flags & FLAG_OFFSET16 else 'I')
+            data = self.buff.read(a_res_type.entryCount * offsets.itemsize)
+            offsets.frombytes(data[: len(data) - len(data) % offsets.itemsize])
+            if sys.byteorder == 'big':
+                offsets.byteswap()
+
+            base_offset = self.buff.tell()
+            if base_offset + ((4 - (base_offset % 4)) % 4) != expected_entries_start:
+                # FIXME: seems like I am missing 2 bytes here in some cases, though it does not affect the result
+                logger.warning(
+                    "Something is off here! We are not where the entries should start."
+                )
+            base_offset = expected_entries_start
+            res_id_base = a_res_type.mResId & 0xFFFF0000
+            ates = []
+            for i, offset in enumerate(offsets):
+                if a_res_type.flags & FLAG_OFFSET16:
+                    # Convert 16-bit offset to 32-bit
+                    if offset == NO_ENTRY_16:
+                        continue
+                    offset *= 4
+                elif offset == NO_ENTRY_32:
+                    continue
+                # The (offset, resource id) pairs are not kept, get_items()
+                # derives them from the entries
+                ates.append(
+                    ARSCResTableEntry(
+                        self.buff,
+                        base_offset + offset,
+                        expected_end_of_chunk,
+                        res_id_base | i,
+                        a_res_type.parent,
+                    )
+                )
+            self._loaded_types[id(a_res_type)] = ates
+            return ates
+
+    def _load_type_group(self, package_name: str, type_id: int) -> list:
+        """
+        Parse all the configs of a resource type and index their entries in
+        `resource_values` and `resource_keys`
+
+        :param package_name: the package name
+        :param type_id: the type id, as in the resource id 0xpptteeee
+        :return: list of (:class:`ARSCResType`, list of :class:`ARSCResTableEntry`) in file order
+        """
+        group = [
+            (a_res_type, self._load_type(a_res_type))
+            for a_res_type in self._types.get(package_name, [])
+            if a_res_type.id == type_id
+        ]
+        if (package_name, type_id) not in self._loaded_groups:
+            with self._lock:
+                for a_res_type, ates in group:
+                    config = a_res_type.config
+                    for ate in ates:
+                        options = self.resource_values.get(ate.mResId)
+                        if options is None or (
+                            type(options) is tuple and options[0] == config
+                        ):
+                            self.resource_values[ate.mResId] = (config, ate)
+                        else:
+                            if type(options) is tuple:
+                                options = dict((options,))
+                                self.resource_values[ate.mResId] = options
+                            options[config] = ate
+                        self.resource_keys[package_name][a_res_type.get_type()][
+                            ate.get_value()
+                        ] = ate.mResId
+                self._loaded_groups.add((package_name, type_id))
+        return group
+
+    def _get_res_options(self, rid: int) -> dict:
+        """
+        The entries of a resource id by config, from `resource_values`
+
+        :param rid: resource id as int
+        :return: dict of {:class:`ARSCResTableConfig`: :class:`ARSCResTableEntry`}
+        """
+        options = self.resource_values[rid]
+        if type(options) is tuple:
+            return dict((options,))
+        return options
+
+    def _get_type_id(self, package_name: str, type_name: str) -> Union[int, None]:
+        for a_res_type in self._types.get(package_name, []):
+            if a_res_type.get_type() == type_name:
+                return a_res_type.id
+        return None
+
+    def _get_type_values(
+        self, package_name: str, locale: str, type_name: str
+    ) -> tuple[list, list]:
+        """
+        The `public` and `type_name` values of a single type and locale, as
+        stored in `values` by :meth:`_analyse`, without parsing the other types
+
+        :return: tuple of (public list, values list)
+        """
+        if self.analyzed:
+            c_value = self.values.get(package_name, {}).get(locale, {})
+            return (
+                [i for i in c_value.get("public", []) if i[0] == type_name],
+                c_value.get(type_name, []),
+            )
+        key = (package_name, locale, type_name)
+        if key not in self._type_values:
+            public = []
+            values = []
+            type_id = self._get_type_id(package_name, type_name)
+            for a_res_type, ates in self._load_type_group(package_name, type_id):
+                if a_res_type.config.get_language_and_region() != locale:
+                    continue
+                for ate in ates:
+                    if ate.get_index() != -1:
+                        public.append((type_name, ate.get_value(), ate.mResId))
+                    value = self._get_entry_value(type_name, ate)
+                    if value is not None:
+                        values.append(value)
+            self._type_values[key] = (public, values)
+        return self._type_values[key]
+
+    def _get_entry_value(self, type_name: str, ate: ARSCResTableEntry):
+        """
+        The value stored in `values` for an entry, None if it is not stored
+        """
+        if type_name == "string":
+            return self.get_resource_string(ate)
+        elif type_name == "id":
+            if not ate.is_complex() and not ate.is_compact():
+                return self.get_resource_id(ate)
+        elif type_name == "bool":
+            if not ate.is_complex() and not ate.is_compact():
+                return self.get_resource_bool(ate)
+        elif type_name == "integer":
+            if ate.is_compact():
+                return ate.data
+            else:
+                return self.get_resource_integer(ate)
+        elif type_name == "color":
+            if not ate.is_compact():
+                return self.get_resource_color(ate)
+        elif type_name == "dimen":
+            if not ate.is_compact():
+                return self.get_resource_dimen(ate)
+        return None
+
     def _analyse(self):
         if self.analyzed:
             return
 
-        self.analyzed = True
+        with self._lock:
+            if self.analyzed:
+                return
 
-        for package_name in self.packages:
-            self.values[package_name] = {}
+            for package_name in self.packages:
+                self.values[package_name] = {}
 
-            nb = 3
-            while nb < len(self.packages[package_name]):
-                header = self.packages[package_name][nb]
-                if isinstance(header, ARSCHeader):
-                    if header.type == RES_TABLE_TYPE_TYPE:
-                        a_res_type = self.packages[package_name][nb + 1]
+                for a_res_type in self._types[package_name]:
+                    self._load_type_group(package_name, a_res_type.id)
 
-                        locale = a_res_type.config.get_language_and_region()
+                    locale = a_res_type.config.get_language_and_region()
 
-                        c_value = self.values[package_name].setdefault(
-                            locale, {"public": []}
-                        )
+                    c_value = self.values[package_name].setdefault(
+                        locale, {"public": []}
+                    )
 
-                        entries = self.packages[package_name][nb + 2]
-                        nb_i = 0
-                        for entry, res_id in entries:
-                            if entry != -1:
-                                ate = self.packages[package_name][
-                                    nb + 3 + nb_i
-                                ]
-
-                                self.resource_values[ate.mResId][
-                                    a_res_type.config
-                                ] = ate
-                                self.resource_keys[package_name][
-                                    a_res_type.get_type()
-                                ][ate.get_value()] = ate.mResId
-
-                                if ate.get_index() != -1:
-                                    c_value["public"].append(
-                                        (
-                                            a_res_type.get_type(),
-                                            ate.get_value(),
-                                            ate.mResId,
-                                        )
-                                    )
-
-                                if a_res_type.get_type() not in c_value:
-                                    c_value[a_res_type.get_type()] = []
-
-                                if a_res_type.get_type() == "string":
-                                    c_value["string"].append(
-                                        self.get_resource_string(ate)
-                                    )
-
-                                elif a_res_type.get_type() == "id":
-                                    if (
-                                        not ate.is_complex()
-                                        and not ate.is_compact()
-                                    ):
-                                        c_value["id"].append(
-                                            self.get_resource_id(ate)
-                                        )
-
-                                elif a_res_type.get_type() == "bool":
-                                    if (
-                                        not ate.is_complex()
-                                        and not ate.is_compact()
-                                    ):
-                                        c_value["bool"].append(
-                                            self.get_resource_bool(ate)
-                                        )
-
-                                elif a_res_type.get_type() == "integer":
-                                    if ate.is_compact():
-                                        c_value["integer"].append(ate.data)
-                                    else:
-                                        c_value["integer"].append(
-                                            self.get_resource_integer(ate)
-                                        )
-
-                                elif a_res_type.get_type() == "color":
-                                    if not ate.is_compact():
-                                        c_value["color"].append(
-                                            self.get_resource_color(ate)
-                                        )
-
-                                elif a_res_type.get_type() == "dimen":
-                                    if not ate.is_compact():
-                                        c_value["dimen"].append(
-                                            self.get_resource_dimen(ate)
-                                        )
-
-                                nb_i += 1
-                        nb += (
-                            3 + nb_i - 1
-                        )  # -1 to account for the nb+=1 on the next line
-                nb += 1
+                    type_name = a_res_type.get_type()
+                    for ate in self._load_type(a_res_type):
+                        if ate.get_index() != -1:
+                            c_value["public"].append(
+                                (
+                                    type_name,
+                                    ate.get_value(),
+                                    ate.mResId,
+                                )
+                            )
+
+                        if type_name not in c_value:
+                            c_value[type_name] = []
+
+                        value = self._get_entry_value(type_name, ate)
+                        if value is not None:
+                            c_value[type_name].append(value)
+
+            self.analyzed = True
 
     def get_resource_string(self, ate: ARSCResTableEntry) -> list:
         return [ate.get_value(), ate.get_key_data()]
@@ -2119,13 +2336,11 @@ class ARSCParser:
         :param package_name: the package name to get the resources for
         :param locale: the locale to get the resources for (default: '\x00\x00')
         """
-        self._analyse()
-
         buff = '<?xml version="1.0" encoding="utf-8"?>\n'
         buff += '<resources>\n'
 
         try:
-            for i in self.values[package_name][locale]["string"]:
+            for i in self._get_type_values(package_name, locale, "string")[1]:
                 if any(map(i[1].__contains__, '<&>')):
                     value = '<![CDATA[%s]]>' % i[1]
                 else:
@@ -2325,14 +2540,15 @@ class ARSCParser:
         :param locale: specific locale
         :return: tuple of (resource_type, resource_name, resource_id)
         """
-        self._analyse()
-
-        try:
-            for i in self.values[package_name][locale]["public"]:
-                if i[2] == rid:
-                    return i
-        except KeyError:
-            pass
+        # Only the type of the resource id is parsed
+        type_id = (rid >> 16) & 0xFF
+        for a_res_type in self._types.get(package_name, []):
+            if a_res_type.id == type_id:
+                type_name = a_res_type.get_type()
+                for i in self._get_type_values(package_name, locale, type_name)[0]:
+                    if i[2] == rid:
+                        return i
+                break
         return None, None, None
 
     class ResourceResolver:
@@ -2473,7 +2689,6 @@ class ARSCParser:
         return resolver.resolve(rid)
 
     def get_resolved_strings(self) -> list[str]:
-        self._analyse()
         if self._resolved_strings:
             return self._resolved_strings
 
@@ -2482,31 +2697,77 @@ class ARSCParser:
             r[package_name] = {}
             k = {}
 
-            for locale in self.values[package_name]:
+            # Only the string type is parsed
+            for locale in self._locales[package_name]:
                 v_locale = locale
                 if v_locale == '\x00\x00':
                     v_locale = 'DEFAULT'
 
                 r[package_name][v_locale] = {}
 
-                try:
-                    for i in self.values[package_name][locale]["public"]:
-                        if i[0] == 'string':
-                            r[package_name][v_locale][i[2]] = None
-                            k[i[1]] = i[2]
-                except KeyError:
-                    pass
+                public, strings = self._get_type_values(package_name, locale, 'string')
+                for i in public:
+                    r[package_name][v_locale][i[2]] = None
+                    k[i[1]] = i[2]
 
-                try:
-                    for i in self.values[package_name][locale]["string"]:
-                        if i[0] in k:
-                            r[package_name][v_locale][k[i[0]]] = i[1]
-                except KeyError:
-                    pass
+                for i in strings:
+                    if i[0] in k:
+                        r[package_name][v_locale][k[i[0]]] = i[1]
 
         self._resolved_strings = r
         return r
 
+    def get_string_index(self, package_name: str) -> tuple[list[str], list[str]]:
+        """
+        Flat index of the string resources of a package, all locales merged.
+        Each (key, value) pair is kept once, in file order.
+
+        Only the string type is parsed, the values are not formatted.
+
+        :param package_name: the package name
+        :return: tuple of (list of keys, list of values), of the same length
+        """
+        index = self._string_index.get(package_name)
+        if index is None:
+            keys = []
+            values = []
+            seen = set()
+            for locale in self._locales[package_name]:
+                for key, value in self._get_type_values(
+                    package_name, locale, 'string'
+                )[1]:
+                    if (key, value) not in seen:
+                        seen.add((key, value))
+                        keys.append(key)
+                        values.append(value)
+            index = (keys, values)
+            self._string_index[package_name] = index
+        return index
+
+    def get_resource_files(self, package_name: str, type_name: str) -> dict[str, str]:
+        """
+        Files of the resources of a type, all configs merged, in file order.
+        Only the given type is parsed.
+
+        :param package_name: the package name
+        :param type_name: the type name, like `xml` or `mipmap`
+        :return: dict of {file name in the APK: XML name, like `@xml/foobar`}
+        """
+        files = {}
+        type_id = self._get_type_id(package_name, type_name)
+        if type_id is None:
+            return files
+        for a_res_type, ates in self._load_type_group(package_name, type_id):
+            for ate in ates:
+                if ate.is_complex() or ate.is_compact():
+                    continue
+                if ate.key.get_data_type() != TYPE_STRING:
+                    continue
+                files.setdefault(
+                    ate.get_key_data(), "@{}/{}".format(type_name, ate.get_value())
+                )
+        return files
+
     def get_res_configs(
         self,
         rid: int,
@@ -2532,13 +2793,16 @@ class ARSCParser:
         :param fallback: Enable the fallback for resolving default configuration (default: True)
         :return: a list of ARSCResTableConfig:
         """
-        self._analyse()
-
         if not rid:
             raise ValueError("'rid' should be set")
         if not isinstance(rid, int):
             raise ValueError("'rid' must be an int")
 
+        # Only the type of the resource id is parsed
+        for package in self.packages.values():
+            if package[0].id == rid >> 24:
+                self._load_type_group(package[0].get_name(), (rid >> 16) & 0xFF)
+
         if rid not in self.resource_values:
             logger.warning(
                 "The requested rid '0x{:08x}' could not be found in the list of resources.".format(
@@ -2547,7 +2811,7 @@ class ARSCParser:
             )
             return []
 
-        res_options = self.resource_values[rid]
+        res_options = self._get_res_options(rid)
         if len(res_options) > 1 and config:
             if config in res_options:
                 return [(config, res_options[config])]
@@ -2557,7 +2821,7 @@ class ARSCParser:
                         rid
                     )
                 )
-                return [list(self.resource_values[rid].items())[0]]
+                return [list(res_options.items())[0]]
             else:
                 return []
         else:
@@ -2566,24 +2830,38 @@ class ARSCParser:
     def get_string(
         self, package_name: str, name: str, locale: str = '\x00\x00'
     ) -> Union[str, None]:
-        self._analyse()
-
-        try:
-            for i in self.values[package_name][locale]["string"]:
-                if i[0] == name:
-                    return i
-        except KeyError:
-            return None
+        for i in self._get_type_values(package_name, locale, "string")[1]:
+            if i[0] == name:
+                return i
+        return None
 
     def get_res_id_by_key(self, package_name, resource_type, key):
+        type_id = self._get_type_id(package_name, resource_type)
+        if type_id is not None:
+            self._load_type_group(package_name, type_id)
         try:
             return self.resource_keys[package_name][resource_type][key]
         except KeyError:
             return None
 
     def get_items(self, package_name):
+        """
+        All the chunks of a package, in file order: the package, its type and
+        key string pools, then every chunk header followed by its content.
+        """
         self._analyse()
-        return self.packages[package_name]
+        items = list(self.packages[package_name])
+        for header, chunk in self._chunks[package_name]:
+            items.append(header)
+            if isinstance(chunk, ARSCResTypeSpec):
+                items.append(chunk)
+            elif isinstance(chunk, ARSCResType):
+                ates = self._load_type(chunk)
+                base_offset = chunk.chunk.start + chunk.entriesStart
+                items.append(chunk)
+                items.append([(ate.start - base_offset, ate.mResId) for ate in ates])
+                items.extend(ates)
+        return items
 
     def get_type_configs(self, package_name, type_name=None):
         if package_name is None:
@@ -2734,6 +3012,8 @@ class ARSCHeader:
     # This is the minimal size such a header must have. There might be other header data too!
     SIZE = 2 + 2 + 4
 
+    __slots__ = ('start', '_type', '_header_size', '_size')
+
     def __init__(
         self,
         buff: BinaryIO,
@@ -2882,6 +3162,8 @@ class ARSCResTypeSpec:
     See http://androidxref.com/9.0.0_r3/xref/frameworks/base/libs/androidfw/include/androidfw/ResourceTypes.h#1327
     """
 
+    __slots__ = ('start', 'parent', 'id', 'res0', 'res1', 'entryCount', 'typespec_entries')
+
     def __init__(
         self, buff: BinaryIO, parent: Union[PackageContext, None] = None
     ) -> None:
@@ -2913,6 +3195,12 @@ class ARSCResType:
     See http://androidxref.com/9.0.0_r3/xref/frameworks/base/libs/androidfw/include/androidfw/ResourceTypes.h#1364
     """
 
+    # chunk and offsets_start are set by ARSCParser, to parse the entries later
+    __slots__ = (
+        'start', 'parent', 'id', 'flags', 'reserved', 'entryCount',
+        'entriesStart', 'mResId', 'config', 'chunk', 'offsets_start',
+    )
+
     def __init__(
         self, buff: BinaryIO, parent: Union[PackageContext, None] = None
     ) -> None:
@@ -2966,6 +3254,13 @@ class ARSCResTableConfig:
     http://androidxref.com/9.0.0_r3/xref/frameworks/base/libs/androidfw/include/androidfw/ResourceTypes.h#911
     """
 
+    __slots__ = (
+        'start', 'size', 'imsi', 'locale', 'screenType', 'input',
+        'screenSize', 'version', 'screenConfig', 'screenSizeDp',
+        'localeScript', 'localeVariant', 'screenConfig2', 'exceedingSize',
+        'padding',
+    )
+
     @classmethod
     def default_config(cls):
         if not hasattr(cls, 'DEFAULT'):
@@ -3494,6 +3789,11 @@ class ARSCResTableEntry:
     See https://cs.android.com/android/platform/superproject/main/+/main:frameworks/base/libs/androidfw/include/androidfw/ResourceTypes.h;l=1522;drc=442fcb158a5b2e23340b74ce2e29e5e1f5bf9d66;bpv=0;bpt=0
     """
 
+    __slots__ = (
+        'start', 'mResId', 'parent', 'size', 'flags', 'index', 'item', 'key',
+        'data', 'datatype',
+    )
+
     # If set, this is a complex entry, holding a set of name/value
     # mappings.  It is followed by an array of ResTable_map structures.
     FLAG_COMPLEX = 1
@@ -3585,6 +3885,8 @@ class ARSCComplex:
     and http://androidxref.com/9.0.0_r3/xref/frameworks/base/libs/androidfw/include/androidfw/ResourceTypes.h#1498 for `ResTable_map`
     """
 
+    __slots__ = ('start', 'parent', 'id_parent', 'count', 'items')
+
     def __init__(
         self,
         buff: BinaryIO,
@@ -3628,6 +3930,8 @@ class ARSCResStringPoolRef:
     See: http://androidxref.com/9.0.0_r3/xref/frameworks/base/libs/androidfw/include/androidfw/ResourceTypes.h#262
     """
 
+    __slots__ = ('start', 'parent', 'size', 'res0', 'data_type', 'data')
+
     def __init__(
         self, buff: BinaryIO, parent: Union[PackageContext, None] = None
     ) -> None: